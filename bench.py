@@ -0,0 +1,234 @@
+#!/usr/bin/env python
+# Copyright (c) 2010 Nathan Morris, nathan.ms@gmail.com
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish, dis-
+# tribute, sublicense, and/or sell copies of the Software, and to permit
+# persons to whom the Software is furnished to do so, subject to the fol-
+# lowing conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABIL
+# ITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT
+# SHALL THE AUTHOR BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+# benchmarks for pyturk: signing, request encoding, response parsing and
+# whole operations against a local fakemturk endpoint
+#
+#   python bench.py                        run everything
+#   python bench.py -k parse -o out.json   only benchmarks matching "parse"
+#   python bench.py --record               rewrite the xml fixtures
+#
+# Each benchmark reports ops/sec and the number of gc-tracked objects one
+# call leaves alive (python 2 has no allocation tracer, so retained
+# objects stand in for allocations). Results are written as json.
+
+
+import os
+import gc
+import sys
+import json
+import time
+import urllib
+import platform
+import resource
+import xml.dom.minidom
+
+import pyturk
+import fakemturk
+
+FIXTURES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'benchfixtures')
+
+# fixture name -> (operation, parameters) recorded from a populated fake
+FIXTURE_CALLS = [
+    ('search_hits_1', 'SearchHITs', {'PageSize': 1}),
+    ('search_hits_10', 'SearchHITs', {'PageSize': 10}),
+    ('search_hits_100', 'SearchHITs', {'PageSize': 100}),
+    ('reviewable_hits_100', 'GetReviewableHITs', {'PageSize': 100}),
+    ('assignments_100', 'GetAssignmentsForHIT', {'PageSize': 100}),
+    ('get_hit', 'GetHIT', {}),
+    ('error', 'GetHIT', {'HITId': 'NOSUCHHIT'}),
+]
+
+
+def populated_fake(latency=0):
+    fake = fakemturk.FakeMTurk(latency=latency, seed=2010)
+    fake.populate(hits=100, assignments=1)
+    answers = dict(('q%d' % i, ['answer %d ' % i * 20, 'other']) for i in
+                   range(10))
+    # one HIT with a full page of assignments carrying long answers
+    HITId = fake.populate(hits=1, assignments=100,
+                          workers=['W%013dEXAMPLE' % i for i in range(100)],
+                          answers=answers)[0]
+    return fake, HITId
+
+
+def record():
+    fake, HITId = populated_fake()
+    if not os.path.isdir(FIXTURES):
+        os.makedirs(FIXTURES)
+    for name, operation, parameters in FIXTURE_CALLS:
+        parameters = dict(parameters, Operation=operation,
+                          Service=fakemturk.SERVICE_NAME)
+        if operation in ('GetAssignmentsForHIT', 'GetHIT'):
+            parameters.setdefault('HITId', HITId)
+        status, body = fake.handle(parameters)
+        f = open(os.path.join(FIXTURES, name + '.xml'), 'w')
+        f.write(body)
+        f.close()
+        print 'recorded %s (%d bytes)' % (name, len(body))
+
+
+def fixture(name):
+    f = open(os.path.join(FIXTURES, name + '.xml'))
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+def measure(function, duration):
+    """Call function repeatedly for about `duration` seconds.
+
+    Returns (iterations, seconds, retained objects per call).
+    """
+    function()
+    gc.collect()
+    before = len(gc.get_objects())
+    keep = function()
+    retained = len(gc.get_objects()) - before - 1
+    del keep
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        iterations = 0
+        batch = 1
+        start = time.time()
+        while True:
+            for i in xrange(batch):
+                function()
+            iterations += batch
+            elapsed = time.time() - start
+            if elapsed >= duration:
+                break
+            batch = min(batch * 2, 10000)
+    finally:
+        if gc_enabled:
+            gc.enable()
+    return iterations, elapsed, max(0, retained)
+
+
+def benchmarks(endpoint, HITId):
+    """Yield (name, function) pairs."""
+    signer = pyturk.Signer('secret')
+    stamps = ['2010-01-01T00:00:%02dZ' % (i % 60) for i in range(1000)]
+    counter = [0]
+    uncached = pyturk.Signer('secret', cache_size=1)
+
+    def sign_uncached():
+        counter[0] += 1
+        uncached.clear()
+        return uncached.sign('GetHIT', stamps[counter[0] % 1000])
+    yield 'sign_uncached', sign_uncached
+    yield 'sign_cached', lambda: signer.sign('GetHIT', stamps[0])
+    yield 'generate_signature', lambda: pyturk.generate_signature(
+        pyturk.SERVICE_NAME, 'GetHIT', stamps[0], 'secret')
+
+    parameters = {
+        'Service': pyturk.SERVICE_NAME, 'Version': pyturk.SERVICE_VERSION,
+        'AWSAccessKeyId': 'AKIAEXAMPLE', 'Timestamp': stamps[0],
+        'Signature': signer.sign('CreateHIT', stamps[0]),
+        'Operation': 'CreateHIT', 'Title': 'test', 'Description': 'test',
+        'Question': pyturk.externalQuestion('http://example.com/task'),
+        'Reward.1.Amount': 0.05, 'Reward.1.CurrencyCode': 'USD',
+        'LifetimeInSeconds': 172800, 'AssignmentDurationInSeconds': 3600,
+    }
+    yield 'encode_create_hit', lambda: urllib.urlencode(parameters)
+
+    for name, operation, p in FIXTURE_CALLS:
+        body = fixture(name)
+        yield 'pp_' + name, lambda body=body: pyturk.pp(body)
+        yield ('minidom_' + name,
+               lambda body=body: xml.dom.minidom.parseString(body))
+    body = fixture('search_hits_100')
+    fields = frozenset(['HITId', 'HITStatus', 'Reward.Amount'])
+    yield 'pp_search_hits_100_projected', lambda: pyturk.pp(body, fields)
+
+    pyturk.LOCAL_URL = endpoint
+    pyturk.LOCALP = True
+    yield 'op_GetHIT', lambda: pyturk.GetHIT(HITId)
+    yield 'op_SearchHITs_10', lambda: pyturk.SearchHITs(PageSize=10)
+    yield 'op_SearchHITs_100', lambda: pyturk.SearchHITs(PageSize=100)
+    yield 'op_SearchHITs_100_minimal', lambda: pyturk.SearchHITs(
+        PageSize=100, ResponseGroup='Minimal', fields=['HITId'])
+    yield 'op_GetReviewableHITs_100', \
+        lambda: pyturk.GetReviewableHITs(PageSize=100)
+    yield 'op_GetAssignmentsForHIT_100', \
+        lambda: pyturk.GetAssignmentsForHIT(HITId, PageSize=100)
+    yield 'op_iter_search_hits', \
+        lambda: list(pyturk.iter_search_hits(PageSize=10))
+
+    # 16 concurrent GetHIT calls per op
+    client = pyturk.AsyncClient(concurrency=16)
+
+    def concurrent_get_hit():
+        return [f.result() for f in [client.GetHIT(HITId)
+                                     for i in range(16)]]
+    try:
+        yield 'op_GetHIT_x16_concurrent', concurrent_get_hit
+    finally:
+        client.close()
+
+
+def run(names=None, duration=1.0, output='bench_results.json'):
+    fake, HITId = populated_fake()
+    endpoint = fake.start()
+    results = []
+    for name, function in benchmarks(endpoint, HITId):
+        if names and not [n for n in names if n in name]:
+            continue
+        iterations, elapsed, retained = measure(function, duration)
+        result = dict(name=name, iterations=iterations, seconds=elapsed,
+                      ops_per_sec=iterations / elapsed,
+                      usec_per_op=elapsed / iterations * 1e6,
+                      retained_objects=retained)
+        results.append(result)
+        print '%-32s %12.1f ops/s %10.1f us/op %8d objects' % (
+            name, result['ops_per_sec'], result['usec_per_op'], retained)
+    fake.stop()
+    report = dict(
+        created=time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        python=sys.version.split()[0], platform=platform.platform(),
+        duration=duration, results=results,
+        peak_rss_kb=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+    f = open(output, 'w')
+    json.dump(report, f, indent=2, sort_keys=True)
+    f.close()
+    print 'wrote %s' % output
+    return report
+
+
+if __name__ == '__main__':
+    import optparse
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('-k', dest='names', action='append',
+                      help='only run benchmarks whose name contains this')
+    parser.add_option('-d', '--duration', type='float', default=1.0,
+                      help='seconds to run each benchmark')
+    parser.add_option('-o', '--output', default='bench_results.json')
+    parser.add_option('--record', action='store_true',
+                      help='record the xml fixtures and exit')
+    options, args = parser.parse_args()
+    if options.record:
+        record()
+    else:
+        run(options.names, options.duration, options.output)
@@ -0,0 +1,1086 @@
+#!/usr/bin/env python
+# Copyright (c) 2010 Nathan Morris, nathan.ms@gmail.com
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish, dis-
+# tribute, sublicense, and/or sell copies of the Software, and to permit
+# persons to whom the Software is furnished to do so, subject to the fol-
+# lowing conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABIL
+# ITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT
+# SHALL THE AUTHOR BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+# in-memory stand-in for the mturk Requester service (2008-08-02), for
+# load testing pyturk without credentials or network access
+#
+#   import pyturk, fakemturk
+#   fake = fakemturk.FakeMTurk(latency=0.05, throttle_rate=0.01)
+#   pyturk.LOCAL_URL = fake.start()
+#   pyturk.LOCALP = True
+#   fake.populate(hits=100, assignments=3)
+#   pyturk.SearchHITs()
+
+
+import cgi
+import hmac
+import sha
+import time
+import Queue
+import urllib
+import base64
+import random
+import socket
+import threading
+import collections
+import SocketServer
+import BaseHTTPServer
+from xml.sax.saxutils import escape
+
+SERVICE_NAME = 'AWSMechanicalTurkRequester'
+SERVICE_VERSION = '2008-08-02'
+NOTIFICATION_SERVICE = 'AWSMechanicalTurkRequesterNotification'
+NOTIFICATION_VERSION = '2006-05-05'
+
+# recipients accepted by one NotifyWorkers call
+MAX_NOTIFY_WORKERS = 100
+
+# seconds a GetFileUploadURL url stays valid
+FILE_UPLOAD_URL_LIFETIME = 60
+
+QUESTION_FORM_ANSWERS_NS = ('http://mechanicalturk.amazonaws.com/'
+                            'AWSMechanicalTurkDataSchemas/2005-10-01/'
+                            'QuestionFormAnswers.xsd')
+
+
+def timestamp(t=None):
+    if t is None:
+        t = time.time()
+    return time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(t))
+
+
+def el(tag, value):
+    if value is None:
+        return ''
+    if isinstance(value, unicode):
+        value = value.encode('utf-8')
+    return '<%s>%s</%s>' % (tag, escape(str(value)), tag)
+
+
+def price(amount):
+    amount = float(amount)
+    return (el('Amount', '%.2f' % amount) + el('CurrencyCode', 'USD') +
+            el('FormattedPrice', '$%.2f' % amount))
+
+
+class Fault(Exception):
+    """An error the service reports back in the response."""
+
+    def __init__(self, code, message, status=200):
+        Exception.__init__(self, code, message)
+        self.code = code
+        self.message = message
+        self.status = status
+
+
+def question_form_answers(answers, files=None):
+    # QuestionFormAnswers xml for a submitted assignment
+    parts = ['<QuestionFormAnswers xmlns="%s">' % QUESTION_FORM_ANSWERS_NS]
+    for identifier, text in sorted((answers or {}).items()):
+        parts.append('<Answer>' + el('QuestionIdentifier', identifier) +
+                     el('FreeText', text) + '</Answer>')
+    for identifier, data in sorted((files or {}).items()):
+        parts.append('<Answer>' + el('QuestionIdentifier', identifier) +
+                     '<UploadedFileSizeInBytes>%d</UploadedFileSizeInBytes>'
+                     % len(data) +
+                     el('UploadedFileKey', identifier) + '</Answer>')
+    parts.append('</QuestionFormAnswers>')
+    return ''.join(parts)
+
+
+def response_groups(p):
+    groups = [v for k, v in p.items() if k.startswith('ResponseGroup')]
+    return groups and set(groups) or None
+
+
+class FakeMTurk(object):
+    """In-memory mturk Requester service.
+
+    latency is a number of seconds, or a (low, high) range, slept before
+    every response. error_rate and throttle_rate are the fractions of
+    requests answered with an internal error or a throttling error, and
+    rate_limit throttles requests beyond that many per second. When
+    secret is given, request signatures are checked against it.
+    """
+
+    def __init__(self, latency=0, error_rate=0, throttle_rate=0,
+                 rate_limit=None, secret=None, balance=10000.0, seed=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.rate_limit = rate_limit
+        self.secret = secret
+        self.balance = balance
+        self.random = random.Random(seed)
+        self.lock = threading.RLock()
+        self.hits = collections.OrderedDict()
+        self.hit_types = {}
+        self.assignments = collections.OrderedDict()
+        self.qualification_types = collections.OrderedDict()
+        self.qualifications = collections.OrderedDict()
+        self.qualification_requests = collections.OrderedDict()
+        self.bonus_payments = []
+        self.blocked = {}
+        self.messages = []
+        self.files = {}
+        self.upload_urls = {}
+        self.notifications = {}
+        self.delivered = []
+        self.request_tokens = {}
+        self._outbox = None
+        self.counts = collections.defaultdict(int)
+        self.server = None
+        self._ids = 0
+        self._tokens = float(rate_limit or 0)
+        self._stamp = time.time()
+
+    # ids, paging and common response parts
+    def new_id(self, prefix):
+        with self.lock:
+            self._ids += 1
+            return '%s%016dEXAMPLE' % (prefix, self._ids)
+
+    def page(self, p, items):
+        size = int(p.get('PageSize', 10))
+        number = int(p.get('PageNumber', 1))
+        if not 1 <= size <= 100:
+            raise Fault('AWS.ParameterOutOfRange',
+                        'PageSize must be between 1 and 100')
+        start = (number - 1) * size
+        chosen = items[start:start + size]
+        return chosen, (el('NumResults', len(chosen)) +
+                        el('TotalNumResults', len(items)) +
+                        el('PageNumber', number))
+
+    def response(self, operation, body='', wrapper=None):
+        wrapper = wrapper or operation + 'Result'
+        return ('<?xml version="1.0"?>\n<%sResponse><OperationRequest>%s'
+                '</OperationRequest><%s><Request><IsValid>True</IsValid>'
+                '</Request>%s</%s></%sResponse>'
+                % (operation, el('RequestId', self.new_id('R')), wrapper,
+                   body, wrapper, operation))
+
+    def error_response(self, operation, code, message):
+        return ('<?xml version="1.0"?>\n<%sResponse><OperationRequest>%s'
+                '</OperationRequest><%sResult><Request><IsValid>False'
+                '</IsValid><Errors><Error>%s%s</Error></Errors></Request>'
+                '</%sResult></%sResponse>'
+                % (operation, el('RequestId', self.new_id('R')), operation,
+                   el('Code', code), el('Message', message), operation,
+                   operation))
+
+    # request handling
+    def handle(self, p):
+        """Answer one request, return (http status, body)."""
+        operation = p.get('Operation', '')
+        with self.lock:
+            self.counts[operation] += 1
+        latency = self.latency
+        if isinstance(latency, (tuple, list)):
+            latency = self.random.uniform(*latency)
+        if latency:
+            time.sleep(latency)
+        try:
+            self.check(p)
+            method = getattr(self, 'op_' + operation, None)
+            if method is None:
+                raise Fault('AWS.InvalidOperation',
+                            'Unknown operation %s' % operation)
+            with self.lock:
+                return 200, method(p)
+        except Fault, f:
+            return f.status, self.error_response(operation, f.code,
+                                                 f.message)
+
+    def check(self, p):
+        with self.lock:
+            if self.rate_limit:
+                now = time.time()
+                self._tokens = min(self.rate_limit, self._tokens +
+                                   (now - self._stamp) * self.rate_limit)
+                self._stamp = now
+                if self._tokens < 1:
+                    raise Fault('ServiceUnavailable',
+                                'Request throttled, slow down', 503)
+                self._tokens -= 1
+            roll = self.random.random()
+        if roll < self.throttle_rate:
+            raise Fault('ServiceUnavailable', 'Request throttled, slow down',
+                        503)
+        if roll < self.throttle_rate + self.error_rate:
+            raise Fault('AWS.InternalError', 'Injected error', 500)
+        if p.get('Service') != SERVICE_NAME:
+            raise Fault('AWS.BadService', 'Unknown service')
+        if self.secret is not None:
+            expected = base64.b64encode(hmac.new(
+                self.secret, SERVICE_NAME + p.get('Operation', '') +
+                p.get('Timestamp', ''), sha).digest())
+            if p.get('Signature') != expected:
+                raise Fault('AWS.NotAuthorized', 'Signature does not match')
+
+    def required(self, p, *names):
+        for name in names:
+            if not p.get(name):
+                raise Fault('AWS.MissingParameters',
+                            'Your request is missing a required parameter '
+                            '(%s)' % name)
+
+    # HITs
+    def hit_type_for(self, p):
+        key = (p.get('Title'), p.get('Description'), p.get('Reward.1.Amount'),
+               p.get('AssignmentDurationInSeconds'), p.get('Keywords'),
+               p.get('AutoApprovalDelayInSeconds', '2592000'),
+               tuple(sorted((k, v) for k, v in p.items()
+                            if k.startswith('QualificationRequirement'))))
+        for HITTypeId, hit_type in self.hit_types.items():
+            if hit_type['key'] == key:
+                return HITTypeId
+        self.required(p, 'Title', 'Description', 'Reward.1.Amount',
+                      'AssignmentDurationInSeconds')
+        HITTypeId = self.new_id('T')
+        self.hit_types[HITTypeId] = dict(
+            key=key, Title=p['Title'], Description=p['Description'],
+            Reward=float(p['Reward.1.Amount']), Keywords=p.get('Keywords'),
+            AssignmentDurationInSeconds=p['AssignmentDurationInSeconds'],
+            AutoApprovalDelayInSeconds=p.get('AutoApprovalDelayInSeconds',
+                                             '2592000'),
+            QualificationRequirement=dict(key[-1]))
+        return HITTypeId
+
+    def get_hit(self, HITId):
+        hit = self.hits.get(HITId)
+        if hit is None:
+            raise Fault('AWS.MechanicalTurk.HITDoesNotExist',
+                        'Hit %s does not exist.' % HITId)
+        self.refresh(hit)
+        return hit
+
+    def hit_assignments(self, HITId):
+        return [a for a in self.assignments.values() if a['HITId'] == HITId]
+
+    def refresh(self, hit):
+        if hit['HITStatus'] in ('Reviewing', 'Disposed'):
+            return
+        completed = len(self.hit_assignments(hit['HITId']))
+        if completed >= hit['MaxAssignments'] or \
+                hit['Expiration'] <= time.time():
+            if hit['HITStatus'] != 'Reviewable':
+                hit['HITStatus'] = 'Reviewable'
+                self.notify(hit, 'HITReviewable')
+        else:
+            hit['HITStatus'] = 'Assignable'
+
+    def notify(self, hit, event_type, AssignmentId=None):
+        notification = self.notifications.get(hit['HITTypeId'])
+        if notification and notification['Active'] and \
+                event_type in notification['EventTypes']:
+            self.send_event(notification, event_type, hit['HITTypeId'],
+                            hit['HITId'], AssignmentId)
+
+    def send_event(self, notification, event_type, HITTypeId, HITId,
+                   AssignmentId=None):
+        # REST notifications only, delivered by a background thread so the
+        # request that caused the event is not held up
+        if notification['Transport'] != 'REST':
+            return
+        now = timestamp()
+        p = {'method': 'Notify', 'Timestamp': now,
+             'Version': NOTIFICATION_VERSION,
+             'Event.1.EventType': event_type, 'Event.1.EventTime': now,
+             'Event.1.HITTypeId': HITTypeId, 'Event.1.HITId': HITId}
+        if AssignmentId:
+            p['Event.1.AssignmentId'] = AssignmentId
+        if self.secret is not None:
+            p['Signature'] = base64.b64encode(hmac.new(
+                self.secret, NOTIFICATION_SERVICE + 'Notify' + now,
+                sha).digest())
+        url = notification['Destination']
+        url += ('?' in url and '&' or '?') + urllib.urlencode(p)
+        if self._outbox is None:
+            self._outbox = Queue.Queue()
+            thread = threading.Thread(target=self.deliver)
+            thread.daemon = True
+            thread.start()
+        self._outbox.put(url)
+
+    def deliver(self):
+        while True:
+            url = self._outbox.get()
+            try:
+                status = urllib.urlopen(url).getcode()
+            except IOError:
+                status = None
+            self.delivered.append((url, status))
+
+    def notification_for(self, p):
+        self.required(p, 'Notification.1.Destination',
+                      'Notification.1.Transport')
+        event_types = [v for k, v in sorted(p.items())
+                       if k.startswith('Notification.1.EventType')]
+        if not event_types:
+            raise Fault('AWS.MissingParameters',
+                        'Your request is missing a required parameter '
+                        '(Notification.1.EventType)')
+        return dict(Destination=p['Notification.1.Destination'],
+                    Transport=p['Notification.1.Transport'],
+                    EventTypes=event_types, Active=True)
+
+    def hit_xml(self, hit, detail=True, groups=None):
+        if not detail:
+            return '<HIT>' + el('HITId', hit['HITId']) + '</HIT>'
+        return '<HIT>' + self.hit_fields(hit, groups) + '</HIT>'
+
+    def hit_fields(self, hit, groups=None):
+        # groups is the set of requested ResponseGroups, None for all
+        hit_type = self.hit_types[hit['HITTypeId']]
+        completed = len(self.hit_assignments(hit['HITId']))
+        qualifications = hit_type['QualificationRequirement']
+        requirements = []
+        i = 1
+        while 'QualificationRequirement.%d.QualificationTypeId' % i in \
+                qualifications:
+            prefix = 'QualificationRequirement.%d.' % i
+            requirements.append(
+                '<QualificationRequirement>' +
+                el('QualificationTypeId',
+                   qualifications[prefix + 'QualificationTypeId']) +
+                el('Comparator', qualifications.get(prefix + 'Comparator')) +
+                el('IntegerValue', qualifications.get(prefix + 'IntegerValue'))
+                + '</QualificationRequirement>')
+            i += 1
+        parts = [
+            ('Minimal', el('HITId', hit['HITId']) +
+             el('HITTypeId', hit['HITTypeId'])),
+            ('HITDetail', el('CreationTime', timestamp(hit['CreationTime'])) +
+             el('Title', hit_type['Title']) +
+             el('Description', hit_type['Description'])),
+            ('HITQuestion', el('Question', hit['Question'])),
+            ('HITDetail', el('Keywords', hit_type['Keywords']) +
+             el('HITStatus', hit['HITStatus']) +
+             el('MaxAssignments', hit['MaxAssignments']) +
+             '<Reward>' + price(hit_type['Reward']) + '</Reward>' +
+             el('AutoApprovalDelayInSeconds',
+                hit_type['AutoApprovalDelayInSeconds']) +
+             el('Expiration', timestamp(hit['Expiration'])) +
+             el('AssignmentDurationInSeconds',
+                hit_type['AssignmentDurationInSeconds']) +
+             ''.join(requirements) +
+             el('RequesterAnnotation', hit.get('RequesterAnnotation')) +
+             el('HITReviewStatus', hit['HITReviewStatus'])),
+            ('HITAssignmentSummary', el('NumberOfAssignmentsPending', 0) +
+             el('NumberOfAssignmentsAvailable',
+                max(0, hit['MaxAssignments'] - completed)) +
+             el('NumberOfAssignmentsCompleted', completed)),
+        ]
+        return ''.join(xml for group, xml in parts
+                       if groups is None or group == 'Minimal' or
+                       group in groups)
+
+    def op_RegisterHITType(self, p):
+        HITTypeId = self.hit_type_for(p)
+        return self.response('RegisterHITType', el('HITTypeId', HITTypeId))
+
+    def check_token(self, operation, p):
+        # a UniqueRequestToken seen before fails the request
+        token = p.get('UniqueRequestToken')
+        if token and (operation, token) in self.request_tokens:
+            raise Fault('AWS.MechanicalTurk.DuplicateRequest',
+                        'There is already a %s request with token %s%s'
+                        % (operation, token,
+                           self.request_tokens[(operation, token)]))
+
+    def remember_token(self, operation, p, detail=''):
+        token = p.get('UniqueRequestToken')
+        if token:
+            self.request_tokens[(operation, token)] = detail
+
+    def op_CreateHIT(self, p):
+        self.check_token('CreateHIT', p)
+        hit = self.create_hit(p)
+        self.remember_token('CreateHIT', p, ', HITId: %s' % hit['HITId'])
+        return self.response('CreateHIT', el('HITId', hit['HITId']) +
+                             el('HITTypeId', hit['HITTypeId']), 'HIT')
+
+    def create_hit(self, p):
+        self.required(p, 'Question', 'LifetimeInSeconds')
+        if p.get('HITTypeId'):
+            HITTypeId = p['HITTypeId']
+            if HITTypeId not in self.hit_types:
+                raise Fault('AWS.MechanicalTurk.HITTypeDoesNotExist',
+                            'HITType %s does not exist.' % HITTypeId)
+        else:
+            HITTypeId = self.hit_type_for(p)
+        now = time.time()
+        hit = dict(HITId=self.new_id('H'), HITTypeId=HITTypeId,
+                   CreationTime=now, Question=p['Question'],
+                   Expiration=now + int(p['LifetimeInSeconds']),
+                   MaxAssignments=int(p.get('MaxAssignments', 1)),
+                   RequesterAnnotation=p.get('RequesterAnnotation'),
+                   HITStatus='Assignable', HITReviewStatus='NotReviewed')
+        self.hits[hit['HITId']] = hit
+        return hit
+
+    def op_GetHIT(self, p):
+        hit = self.get_hit(p.get('HITId'))
+        return self.response('GetHIT', self.hit_fields(
+            hit, response_groups(p)), 'HIT')
+
+    def op_SearchHITs(self, p):
+        hits = self.hits.values()
+        for hit in hits:
+            self.refresh(hit)
+        prop = {'Title': lambda h: self.hit_types[h['HITTypeId']]['Title'],
+                'Reward': lambda h: self.hit_types[h['HITTypeId']]['Reward'],
+                'Expiration': lambda h: h['Expiration'],
+                'CreationTime': lambda h: h['CreationTime'],
+                'Enumeration': lambda h: h['CreationTime']}
+        key = prop.get(p.get('SortProperty', 'CreationTime'),
+                       prop['CreationTime'])
+        hits = sorted(hits, key=key,
+                      reverse=p.get('SortDirection') == 'Descending')
+        chosen, paging = self.page(p, hits)
+        groups = response_groups(p)
+        return self.response('SearchHITs', paging + ''.join(
+            self.hit_xml(hit, groups=groups) for hit in chosen))
+
+    def op_GetReviewableHITs(self, p):
+        status = p.get('Status', 'Reviewable')
+        hits = []
+        for hit in self.hits.values():
+            self.refresh(hit)
+            if hit['HITStatus'] == status and \
+                    p.get('HITTypeId') in (None, hit['HITTypeId']):
+                hits.append(hit)
+        chosen, paging = self.page(p, hits)
+        return self.response('GetReviewableHITs', paging + ''.join(
+            self.hit_xml(hit, False) for hit in chosen))
+
+    def op_GetHITsForQualificationType(self, p):
+        self.required(p, 'QualificationTypeId')
+        hits = []
+        for hit in self.hits.values():
+            requirements = self.hit_types[hit['HITTypeId']][
+                'QualificationRequirement']
+            if p['QualificationTypeId'] in requirements.values():
+                self.refresh(hit)
+                hits.append(hit)
+        chosen, paging = self.page(p, hits)
+        return self.response('GetHITsForQualificationType', paging + ''.join(
+            self.hit_xml(hit) for hit in chosen))
+
+    def op_SetHITAsReviewing(self, p):
+        hit = self.get_hit(p.get('HITId'))
+        if p.get('Revert', 'False').lower() == 'true':
+            if hit['HITStatus'] != 'Reviewing':
+                raise Fault('AWS.MechanicalTurk.InvalidHITState',
+                            'HIT %s is not Reviewing' % hit['HITId'])
+            hit['HITStatus'] = 'Reviewable'
+        else:
+            if hit['HITStatus'] != 'Reviewable':
+                raise Fault('AWS.MechanicalTurk.InvalidHITState',
+                            'HIT %s is not Reviewable' % hit['HITId'])
+            hit['HITStatus'] = 'Reviewing'
+        return self.response('SetHITAsReviewing')
+
+    def op_ChangeHITTypeOfHIT(self, p):
+        hit = self.get_hit(p.get('HITId'))
+        if p.get('HITTypeId') not in self.hit_types:
+            raise Fault('AWS.MechanicalTurk.HITTypeDoesNotExist',
+                        'HITType %s does not exist.' % p.get('HITTypeId'))
+        hit['HITTypeId'] = p['HITTypeId']
+        return self.response('ChangeHITTypeOfHIT')
+
+    def op_ExtendHIT(self, p):
+        self.check_token('ExtendHIT', p)
+        hit = self.get_hit(p.get('HITId'))
+        self.remember_token('ExtendHIT', p)
+        hit['MaxAssignments'] += int(p.get('MaxAssignmentsIncrement', 0))
+        hit['Expiration'] = max(hit['Expiration'], time.time()) + \
+            int(p.get('ExpirationIncrementInSeconds', 0))
+        if hit['HITStatus'] == 'Reviewable':
+            hit['HITStatus'] = 'Assignable'
+        self.refresh(hit)
+        return self.response('ExtendHIT')
+
+    def op_ForceExpireHIT(self, p):
+        hit = self.get_hit(p.get('HITId'))
+        hit['Expiration'] = time.time()
+        self.notify(hit, 'HITExpired')
+        self.refresh(hit)
+        return self.response('ForceExpireHIT')
+
+    def op_SetHITTypeNotification(self, p):
+        self.required(p, 'HITTypeId')
+        HITTypeId = p['HITTypeId']
+        if HITTypeId not in self.hit_types:
+            raise Fault('AWS.MechanicalTurk.HITTypeDoesNotExist',
+                        'HITType %s does not exist.' % HITTypeId)
+        if p.get('Notification.1.Destination'):
+            self.notifications[HITTypeId] = self.notification_for(p)
+        elif HITTypeId not in self.notifications:
+            raise Fault('AWS.MissingParameters',
+                        'HITType %s has no notification' % HITTypeId)
+        if 'Active' in p:
+            self.notifications[HITTypeId]['Active'] = \
+                p['Active'].lower() == 'true'
+        return self.response('SetHITTypeNotification')
+
+    def op_SendTestEventNotification(self, p):
+        notification = self.notification_for(p)
+        self.send_event(notification, p.get('TestEventType', 'Ping'),
+                        'T0000000000000000EXAMPLE', 'H0000000000000000EXAMPLE',
+                        'A0000000000000000EXAMPLE')
+        return self.response('SendTestEventNotification')
+
+    def remove_hit(self, hit):
+        for assignment in self.hit_assignments(hit['HITId']):
+            del self.assignments[assignment['AssignmentId']]
+        del self.hits[hit['HITId']]
+
+    def op_DisableHIT(self, p):
+        hit = self.get_hit(p.get('HITId'))
+        for assignment in self.hit_assignments(hit['HITId']):
+            if assignment['AssignmentStatus'] == 'Submitted':
+                self.approve(assignment)
+        self.remove_hit(hit)
+        return self.response('DisableHIT')
+
+    def op_DisposeHIT(self, p):
+        hit = self.get_hit(p.get('HITId'))
+        if hit['HITStatus'] not in ('Reviewable', 'Reviewing'):
+            raise Fault('AWS.MechanicalTurk.InvalidHITState',
+                        'HIT %s is not Reviewable' % hit['HITId'])
+        for assignment in self.hit_assignments(hit['HITId']):
+            if assignment['AssignmentStatus'] == 'Submitted':
+                raise Fault('AWS.MechanicalTurk.InvalidHITState',
+                            'HIT %s has assignments awaiting review'
+                            % hit['HITId'])
+        self.remove_hit(hit)
+        return self.response('DisposeHIT')
+
+    # assignments
+    def submit_assignment(self, HITId, WorkerId=None, answers=None,
+                          files=None):
+        """Simulate a worker submitting an assignment, return its id."""
+        with self.lock:
+            hit = self.get_hit(HITId)
+            if hit['HITStatus'] != 'Assignable':
+                raise Fault('AWS.MechanicalTurk.InvalidHITState',
+                            'HIT %s is not Assignable' % HITId)
+            WorkerId = WorkerId or self.new_id('W')
+            AssignmentId = self.new_id('A')
+            now = time.time()
+            hit_type = self.hit_types[hit['HITTypeId']]
+            self.assignments[AssignmentId] = dict(
+                AssignmentId=AssignmentId, WorkerId=WorkerId, HITId=HITId,
+                AssignmentStatus='Submitted',
+                AutoApprovalTime=now + int(
+                    hit_type['AutoApprovalDelayInSeconds']),
+                AcceptTime=now, SubmitTime=now,
+                Answer=question_form_answers(answers, files))
+            for identifier, data in (files or {}).items():
+                self.files[(AssignmentId, identifier)] = data
+            self.notify(hit, 'AssignmentSubmitted', AssignmentId)
+            self.refresh(hit)
+            return AssignmentId
+
+    def populate(self, hits=10, assignments=1, workers=None, answers=None):
+        """Create HITs with submitted assignments, return the HITIds.
+
+        workers is a list of WorkerIds to draw from; answers a dict of
+        QuestionIdentifier to a list of possible answers.
+        """
+        workers = workers or ['W%013dEXAMPLE' % i for i in range(20)]
+        answers = answers or {'q1': ['yes', 'no']}
+        HITIds = []
+        for i in range(hits):
+            p = {'Title': 'test', 'Description': 'test',
+                 'Reward.1.Amount': '0.05', 'Reward.1.CurrencyCode': 'USD',
+                 'AssignmentDurationInSeconds': '3600',
+                 'LifetimeInSeconds': '86400',
+                 'MaxAssignments': str(max(1, assignments)),
+                 'Question': '<ExternalQuestion/>'}
+            with self.lock:
+                HITId = self.create_hit(p)['HITId']
+            for WorkerId in self.random.sample(workers, assignments):
+                self.submit_assignment(HITId, WorkerId, dict(
+                    (q, self.random.choice(choices))
+                    for q, choices in answers.items()))
+            HITIds.append(HITId)
+        return HITIds
+
+    def get_assignment(self, AssignmentId):
+        assignment = self.assignments.get(AssignmentId)
+        if assignment is None:
+            raise Fault('AWS.MechanicalTurk.AssignmentDoesNotExist',
+                        'Assignment %s does not exist.' % AssignmentId)
+        return assignment
+
+    def assignment_xml(self, a):
+        return ('<Assignment>' + el('AssignmentId', a['AssignmentId']) +
+                el('WorkerId', a['WorkerId']) + el('HITId', a['HITId']) +
+                el('AssignmentStatus', a['AssignmentStatus']) +
+                el('AutoApprovalTime', timestamp(a['AutoApprovalTime'])) +
+                el('AcceptTime', timestamp(a['AcceptTime'])) +
+                el('SubmitTime', timestamp(a['SubmitTime'])) +
+                el('ApprovalTime', a.get('ApprovalTime') and
+                   timestamp(a['ApprovalTime'])) +
+                el('RejectionTime', a.get('RejectionTime') and
+                   timestamp(a['RejectionTime'])) +
+                el('RequesterFeedback', a.get('RequesterFeedback')) +
+                el('Answer', a['Answer']) + '</Assignment>')
+
+    def op_GetAssignmentsForHIT(self, p):
+        hit = self.get_hit(p.get('HITId'))
+        assignments = [a for a in self.hit_assignments(hit['HITId'])
+                       if p.get('AssignmentStatus') in
+                       (None, a['AssignmentStatus'])]
+        chosen, paging = self.page(p, assignments)
+        return self.response('GetAssignmentsForHIT', paging + ''.join(
+            self.assignment_xml(a) for a in chosen))
+
+    def approve(self, assignment):
+        reward = self.hit_types[self.hits[assignment['HITId']]['HITTypeId']][
+            'Reward']
+        self.balance -= reward
+        assignment['AssignmentStatus'] = 'Approved'
+        assignment['ApprovalTime'] = time.time()
+
+    def op_ApproveAssignment(self, p):
+        assignment = self.get_assignment(p.get('AssignmentId'))
+        if assignment['AssignmentStatus'] != 'Submitted':
+            raise Fault('AWS.MechanicalTurk.InvalidAssignmentState',
+                        'Assignment %s is not Submitted'
+                        % assignment['AssignmentId'])
+        self.approve(assignment)
+        assignment['RequesterFeedback'] = p.get('RequesterFeedback')
+        return self.response('ApproveAssignment')
+
+    def op_RejectAssignment(self, p):
+        assignment = self.get_assignment(p.get('AssignmentId'))
+        if assignment['AssignmentStatus'] != 'Submitted':
+            raise Fault('AWS.MechanicalTurk.InvalidAssignmentState',
+                        'Assignment %s is not Submitted'
+                        % assignment['AssignmentId'])
+        assignment['AssignmentStatus'] = 'Rejected'
+        assignment['RejectionTime'] = time.time()
+        assignment['RequesterFeedback'] = p.get('RequesterFeedback')
+        return self.response('RejectAssignment')
+
+    def op_GetFileUploadURL(self, p):
+        self.required(p, 'AssignmentId', 'QuestionIdentifier')
+        key = (p['AssignmentId'], p['QuestionIdentifier'])
+        if key not in self.files:
+            raise Fault('AWS.MechanicalTurk.FileUploadDoesNotExist',
+                        'No file was uploaded for %s/%s' % key)
+        token = self.new_id('U')
+        self.upload_urls[token] = (key, time.time() + FILE_UPLOAD_URL_LIFETIME)
+        return self.response('GetFileUploadURL', el(
+            'FileUploadURL', '%s/upload/%s' % (self.url or '', token)))
+
+    def download(self, token, start=0):
+        # (status, body) for a GET of a GetFileUploadURL url, from byte
+        # `start` on when a Range was asked for
+        with self.lock:
+            key, expires = self.upload_urls.get(token, (None, 0))
+            if key is None or expires < time.time():
+                return 403, 'Request has expired'
+            data = self.files[key]
+        if not start:
+            return 200, data
+        if start >= len(data):
+            return 416, ''
+        return 206, data[start:]
+
+    # payments and workers
+    def op_GetAccountBalance(self, p):
+        return self.response('GetAccountBalance', '<AvailableBalance>' +
+                             price(self.balance) + '</AvailableBalance>')
+
+    def op_GrantBonus(self, p):
+        self.required(p, 'WorkerId', 'AssignmentId', 'BonusAmount.1.Amount',
+                      'Reason')
+        assignment = self.get_assignment(p['AssignmentId'])
+        if assignment['WorkerId'] != p['WorkerId']:
+            raise Fault('AWS.MechanicalTurk.InvalidParameterValue',
+                        'Worker %s did not work on assignment %s'
+                        % (p['WorkerId'], p['AssignmentId']))
+        self.check_token('GrantBonus', p)
+        amount = float(p['BonusAmount.1.Amount'])
+        self.balance -= amount
+        self.remember_token('GrantBonus', p)
+        self.bonus_payments.append(dict(
+            WorkerId=p['WorkerId'], AssignmentId=p['AssignmentId'],
+            HITId=assignment['HITId'], Amount=amount, Reason=p['Reason'],
+            GrantTime=time.time()))
+        return self.response('GrantBonus')
+
+    def op_GetBonusPayments(self, p):
+        if p.get('HITId'):
+            payments = [b for b in self.bonus_payments
+                        if b['HITId'] == p['HITId']]
+        elif p.get('AssignmentId'):
+            payments = [b for b in self.bonus_payments
+                        if b['AssignmentId'] == p['AssignmentId']]
+        else:
+            raise Fault('AWS.MissingParameters',
+                        'Either HITId or AssignmentId is required')
+        chosen, paging = self.page(p, payments)
+        return self.response('GetBonusPayments', paging + ''.join(
+            '<BonusPayment>' + el('WorkerId', b['WorkerId']) +
+            '<BonusAmount>' + price(b['Amount']) + '</BonusAmount>' +
+            el('AssignmentId', b['AssignmentId']) + el('Reason', b['Reason']) +
+            el('GrantTime', timestamp(b['GrantTime'])) + '</BonusPayment>'
+            for b in chosen))
+
+    def op_BlockWorker(self, p):
+        self.required(p, 'WorkerId', 'Reason')
+        self.blocked[p['WorkerId']] = p['Reason']
+        return self.response('BlockWorker')
+
+    def op_UnblockWorker(self, p):
+        self.required(p, 'WorkerId')
+        self.blocked.pop(p['WorkerId'], None)
+        return self.response('UnblockWorker')
+
+    def op_NotifyWorkers(self, p):
+        self.required(p, 'Subject', 'MessageText', 'WorkerId.1')
+        workers = [v for k, v in p.items() if k.startswith('WorkerId.')]
+        if len(workers) > MAX_NOTIFY_WORKERS:
+            raise Fault('AWS.MechanicalTurk.InvalidParameterValue',
+                        'No more than %d WorkerIds may be notified at once'
+                        % MAX_NOTIFY_WORKERS)
+        self.messages.append(dict(Subject=p['Subject'],
+                                  MessageText=p['MessageText'],
+                                  WorkerIds=workers))
+        return self.response('NotifyWorkers')
+
+    def op_GetRequesterStatistic(self, p):
+        self.required(p, 'Statistic', 'TimePeriod')
+        values = dict(
+            NumberAssignmentsApproved=len(
+                [a for a in self.assignments.values()
+                 if a['AssignmentStatus'] == 'Approved']),
+            NumberAssignmentsRejected=len(
+                [a for a in self.assignments.values()
+                 if a['AssignmentStatus'] == 'Rejected']),
+            NumberHITsCreated=len(self.hits),
+            TotalBonusAmountPaid=sum(b['Amount']
+                                     for b in self.bonus_payments))
+        value = values.get(p['Statistic'], 0)
+        return self.response('GetRequesterStatistic', el('Statistic', p[
+            'Statistic']) + el('TimePeriod', p['TimePeriod']) +
+            '<DataPoint>' + el('Date', timestamp()) +
+            el('DoubleValue', value) + '</DataPoint>', 'GetStatisticResult')
+
+    # qualifications
+    def get_qualification_type(self, QualificationTypeId):
+        qualification_type = self.qualification_types.get(QualificationTypeId)
+        if qualification_type is None:
+            raise Fault('AWS.MechanicalTurk.QualificationTypeDoesNotExist',
+                        'QualificationType %s does not exist.'
+                        % QualificationTypeId)
+        return qualification_type
+
+    def qualification_type_xml(self, q):
+        return (el('QualificationTypeId', q['QualificationTypeId']) +
+                el('CreationTime', timestamp(q['CreationTime'])) +
+                el('Name', q['Name']) + el('Description', q['Description']) +
+                el('QualificationTypeStatus', q['QualificationTypeStatus']) +
+                el('RetryDelayInSeconds', q.get('RetryDelayInSeconds')) +
+                el('TestDurationInSeconds', q.get('TestDurationInSeconds')) +
+                el('AutoGranted', q['AutoGranted']) +
+                el('AutoGrantedValue', q.get('AutoGrantedValue')))
+
+    def op_CreateQualificationType(self, p):
+        self.required(p, 'Name', 'Description', 'QualificationTypeStatus')
+        for q in self.qualification_types.values():
+            if q['Name'] == p['Name']:
+                raise Fault('AWS.MechanicalTurk.QualificationTypeAlreadyExists',
+                            'You have already created a QualificationType '
+                            'with this name.')
+        q = dict(QualificationTypeId=self.new_id('Q'),
+                 CreationTime=time.time(), Name=p['Name'],
+                 Description=p['Description'],
+                 QualificationTypeStatus=p['QualificationTypeStatus'],
+                 AutoGranted=p.get('AutoGranted', 'false'),
+                 AutoGrantedValue=p.get('AutoGrantedValue'))
+        self.qualification_types[q['QualificationTypeId']] = q
+        return self.response('CreateQualificationType',
+                             self.qualification_type_xml(q),
+                             'QualificationType')
+
+    def op_GetQualificationType(self, p):
+        q = self.get_qualification_type(p.get('QualificationTypeId'))
+        return self.response('GetQualificationType',
+                             self.qualification_type_xml(q),
+                             'QualificationType')
+
+    def op_UpdateQualificationType(self, p):
+        q = self.get_qualification_type(p.get('QualificationTypeId'))
+        for name in ('RetryDelayInSeconds', 'QualificationTypeStatus',
+                     'Description', 'TestDurationInSeconds', 'AutoGranted',
+                     'AutoGrantedValue'):
+            if p.get(name):
+                q[name] = p[name]
+        return self.response('UpdateQualificationType',
+                             self.qualification_type_xml(q),
+                             'QualificationType')
+
+    def op_DisposeQualificationType(self, p):
+        q = self.get_qualification_type(p.get('QualificationTypeId'))
+        del self.qualification_types[q['QualificationTypeId']]
+        for key in list(self.qualifications):
+            if key[0] == q['QualificationTypeId']:
+                del self.qualifications[key]
+        return self.response('DisposeQualificationType')
+
+    def op_SearchQualificationTypes(self, p):
+        query = p.get('Query', '').lower()
+        types = [q for q in self.qualification_types.values()
+                 if query in q['Name'].lower() or
+                 query in q['Description'].lower()]
+        chosen, paging = self.page(p, types)
+        return self.response('SearchQualificationTypes', paging + ''.join(
+            '<QualificationType>' + self.qualification_type_xml(q) +
+            '</QualificationType>' for q in chosen))
+
+    def qualification_xml(self, q):
+        return (el('QualificationTypeId', q['QualificationTypeId']) +
+                el('SubjectId', q['SubjectId']) +
+                el('GrantTime', timestamp(q['GrantTime'])) +
+                el('IntegerValue', q['IntegerValue']) +
+                el('Status', q['Status']))
+
+    def grant(self, QualificationTypeId, SubjectId, IntegerValue):
+        self.get_qualification_type(QualificationTypeId)
+        self.qualifications[(QualificationTypeId, SubjectId)] = dict(
+            QualificationTypeId=QualificationTypeId, SubjectId=SubjectId,
+            GrantTime=time.time(), IntegerValue=int(IntegerValue),
+            Status='Granted')
+
+    def get_qualification(self, p):
+        self.required(p, 'QualificationTypeId', 'SubjectId')
+        q = self.qualifications.get((p['QualificationTypeId'],
+                                     p['SubjectId']))
+        if q is None or q['Status'] != 'Granted':
+            raise Fault('AWS.MechanicalTurk.QualificationDoesNotExist',
+                        'You requested a Qualification that does not exist.')
+        return q
+
+    def op_AssignQualification(self, p):
+        self.required(p, 'QualificationTypeId', 'WorkerId')
+        self.grant(p['QualificationTypeId'], p['WorkerId'],
+                   p.get('IntegerValue', 1))
+        return self.response('AssignQualification')
+
+    def op_UpdateQualificationScore(self, p):
+        q = self.get_qualification(p)
+        self.required(p, 'IntegerValue')
+        q['IntegerValue'] = int(p['IntegerValue'])
+        return self.response('UpdateQualificationScore')
+
+    def op_RevokeQualification(self, p):
+        q = self.get_qualification(p)
+        q['Status'] = 'Revoked'
+        return self.response('RevokeQualification')
+
+    def op_GetQualificationScore(self, p):
+        q = self.get_qualification(p)
+        return self.response('GetQualificationScore',
+                             self.qualification_xml(q), 'Qualification')
+
+    def op_GetQualificationsForQualificationType(self, p):
+        self.get_qualification_type(p.get('QualificationTypeId'))
+        status = p.get('Status', 'Granted')
+        qualifications = [q for q in self.qualifications.values()
+                          if q['QualificationTypeId'] ==
+                          p['QualificationTypeId'] and q['Status'] == status]
+        chosen, paging = self.page(p, qualifications)
+        return self.response('GetQualificationsForQualificationType',
+                             paging + ''.join(
+                                 '<Qualification>' + self.qualification_xml(q)
+                                 + '</Qualification>' for q in chosen))
+
+    def request_qualification(self, QualificationTypeId, SubjectId,
+                              Answer=None):
+        """Simulate a worker requesting a qualification, return its id."""
+        with self.lock:
+            self.get_qualification_type(QualificationTypeId)
+            QualificationRequestId = self.new_id('QR')
+            self.qualification_requests[QualificationRequestId] = dict(
+                QualificationRequestId=QualificationRequestId,
+                QualificationTypeId=QualificationTypeId, SubjectId=SubjectId,
+                Answer=Answer, SubmitTime=time.time())
+            return QualificationRequestId
+
+    def op_GetQualificationRequests(self, p):
+        requests = [r for r in self.qualification_requests.values()
+                    if p.get('QualificationTypeId') in
+                    (None, r['QualificationTypeId'])]
+        if p.get('SortProperty') == 'SubmitTime':
+            requests.sort(key=lambda r: r['SubmitTime'],
+                          reverse=p.get('SortDirection') == 'Descending')
+        chosen, paging = self.page(p, requests)
+        return self.response('GetQualificationRequests', paging + ''.join(
+            '<QualificationRequest>' +
+            el('QualificationRequestId', r['QualificationRequestId']) +
+            el('QualificationTypeId', r['QualificationTypeId']) +
+            el('SubjectId', r['SubjectId']) + el('Answer', r['Answer']) +
+            el('SubmitTime', timestamp(r['SubmitTime'])) +
+            '</QualificationRequest>' for r in chosen))
+
+    def pop_qualification_request(self, p):
+        self.required(p, 'QualificationRequestId')
+        request = self.qualification_requests.pop(p['QualificationRequestId'],
+                                                  None)
+        if request is None:
+            raise Fault('AWS.MechanicalTurk.QualificationRequestDoesNotExist',
+                        'QualificationRequest %s does not exist.'
+                        % p['QualificationRequestId'])
+        return request
+
+    def op_GrantQualification(self, p):
+        request = self.pop_qualification_request(p)
+        self.grant(request['QualificationTypeId'], request['SubjectId'],
+                   p.get('IntegerValue', 1))
+        return self.response('GrantQualification')
+
+    def op_RejectQualificationRequest(self, p):
+        self.pop_qualification_request(p)
+        return self.response('RejectQualificationRequest')
+
+    # http server
+    url = None
+
+    def start(self, host='127.0.0.1', port=0):
+        """Serve on a background thread, return the endpoint url."""
+        self.server = _Server((host, port), _Handler)
+        self.server.fake = self
+        self.url = 'http://%s:%d' % self.server.server_address
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return self.url
+
+    def drop_connections(self):
+        """Close every open client connection, as a server dropping idle
+        keep-alive connections would."""
+        if self.server is None:
+            return
+        with self.server.lock:
+            connections = list(self.server.connections)
+        for connection in connections:
+            try:
+                connection.shutdown(socket.SHUT_RDWR)
+            except socket.error:
+                pass
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # write each response in one segment; unbuffered header lines run into
+    # delayed acks on keep-alive connections
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        BaseHTTPServer.BaseHTTPRequestHandler.setup(self)
+        with self.server.lock:
+            self.server.connections.add(self.connection)
+
+    def finish(self):
+        with self.server.lock:
+            self.server.connections.discard(self.connection)
+        BaseHTTPServer.BaseHTTPRequestHandler.finish(self)
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        parameters = dict(cgi.parse_qsl(self.rfile.read(length), True))
+        status, body = self.server.fake.handle(parameters)
+        self.reply(status, body, 'text/xml')
+
+    def do_GET(self):
+        path, _, query = self.path.partition('?')
+        if path.startswith('/upload/'):
+            start = self.headers.get('Range', 'bytes=0-')
+            start = int(start.split('=', 1)[1].split('-', 1)[0] or 0)
+            status, body = self.server.fake.download(path[len('/upload/'):],
+                                                     start)
+            self.reply(status, body, 'application/octet-stream')
+            return
+        status, body = self.server.fake.handle(dict(cgi.parse_qsl(query,
+                                                                  True)))
+        self.reply(status, body, 'text/xml')
+
+    def reply(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _Server(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+    request_queue_size = 128
+
+    def __init__(self, address, handler):
+        BaseHTTPServer.HTTPServer.__init__(self, address, handler)
+        self.lock = threading.Lock()
+        self.connections = set()
+
+
+if __name__ == '__main__':
+    import optparse
+    parser = optparse.OptionParser(usage='%prog [options]')
+    parser.add_option('--host', default='127.0.0.1')
+    parser.add_option('--port', type='int', default=8808)
+    parser.add_option('--latency', type='float', default=0)
+    parser.add_option('--error-rate', type='float', default=0)
+    parser.add_option('--throttle-rate', type='float', default=0)
+    parser.add_option('--rate-limit', type='float', default=None)
+    parser.add_option('--hits', type='int', default=0,
+                      help='HITs to create at startup')
+    parser.add_option('--assignments', type='int', default=1,
+                      help='submitted assignments per HIT')
+    options, args = parser.parse_args()
+    fake = FakeMTurk(latency=options.latency, error_rate=options.error_rate,
+                     throttle_rate=options.throttle_rate,
+                     rate_limit=options.rate_limit)
+    fake.populate(options.hits, options.assignments)
+    print 'serving on %s' % fake.start(options.host, options.port)
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        fake.stop()
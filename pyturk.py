@@ -24,12 +24,30 @@
 # http://docs.amazonwebservices.com/AWSMechanicalTurkRequester/2008-08-02/
 
 
+import os
 import time
+import errno
+import select
 import hmac
 import sha
+import sys
 import base64
+import random
+import socket
 import urllib
-import xml.dom.minidom
+import httplib
+import urlparse
+import threading
+import Queue
+import json
+import uuid
+import itertools
+import SocketServer
+import BaseHTTPServer
+import collections
+import bisect
+import re
+import xml.parsers.expat
 
 AWS_ACCESS_KEY_ID = 'YOUR KEY HERE'
 AWS_SECRET_ACCESS_KEY = 'YOUR SECRET HERE'
@@ -38,75 +56,1724 @@ SERVICE_VERSION = '2008-08-02'
 
 SANDBOXP = False
 
+PRODUCTION_URL = 'http://mechanicalturk.amazonaws.com'
+SANDBOX_URL = 'http://mechanicalturk.sandbox.amazonaws.com'
+
+# point the client at a local stand-in service, see fakemturk.py
+LOCALP = False
+LOCAL_URL = 'http://127.0.0.1:8808'
+
+# signatures memoized per signer, keyed by (operation, timestamp)
+SIGNATURE_CACHE_SIZE = 256
+
+# opt-in cache of parsed read-only responses, see enable_cache()
+CACHE_SIZE = 1000           # entries kept, least recently used dropped
+CACHE_TTL = {               # seconds a response stays fresh, per operation
+    'GetHIT': 30,
+    'GetQualificationType': 300,
+    'GetQualificationScore': 60,
+    'GetAccountBalance': 10,
+}
+
+# keep-alive connection pool settings, one pool per endpoint
+POOL_SIZE = 10              # idle connections kept per endpoint
+POOL_IDLE_TIMEOUT = 60      # seconds before an idle connection is dropped
+POOL_SOCKET_TIMEOUT = 60    # socket timeout for connect/read
+
+# client-side rate limits per operation class. None sends as fast as the
+# service accepts: nothing is held back until the first throttling error,
+# and from then on the rate is adapted to what the service allows. A
+# (requests per second, burst) pair also caps the rate there.
+RATE_LIMITS = {
+    'read': None,
+    'write': None,
+}
+MIN_RATE = 0.5              # adaptive backoff never sends slower than this
+THROTTLE_WINDOW = 1.0       # seconds after a rate cut before another one
+
+# retries of throttled / unavailable requests
+MAX_RETRIES = 5
+BACKOFF_BASE = 0.5          # seconds, doubled on every attempt
+BACKOFF_MAX = 30.0
+
+# pages fetched ahead of the consumer by the iter_* helpers
+PREFETCH_WINDOW = 4
+
+# default AsyncClient settings
+ASYNC_CONCURRENCY = 16      # operations in flight at once
+ASYNC_TIMEOUT = None        # seconds allowed per call, None waits forever
+
+# download_files settings
+DOWNLOAD_CONCURRENCY = 8    # files downloaded at once
+DOWNLOAD_CHUNK_SIZE = 65536 # bytes read and written at a time
+
+# recipients allowed in one NotifyWorkers call
+NOTIFY_WORKERS_MAX = 100
+
+# default ReviewPipeline settings, worker threads per stage
+REVIEW_CONCURRENCY = {'reserve': 4, 'fetch': 4, 'decide': 1, 'act': 8,
+                      'dispose': 4}
+REVIEW_QUEUE_SIZE = 100     # items waiting between two stages
+
+# REST notifications, see SetHITTypeNotification and NotificationReceiver
+NOTIFICATION_SERVICE = 'AWSMechanicalTurkRequesterNotification'
+NOTIFICATION_VERSION = '2006-05-05'
+NOTIFICATION_EVENT_TYPES = ('AssignmentSubmitted', 'HITReviewable',
+                            'HITExpired')
+
+# write-ahead journal of mutating calls, see enable_journal()
+UNIQUE_REQUEST_TOKEN_OPERATIONS = ('CreateHIT', 'ExtendHIT', 'GrantBonus')
+# writes Journal.resume() sends again: the ones above, which the service
+# drops when it has seen their token, and ones that fail rather than
+# change anything a second time
+JOURNAL_REPLAYABLE = UNIQUE_REQUEST_TOKEN_OPERATIONS + (
+    'ApproveAssignment', 'RejectAssignment', 'AssignQualification',
+    'UpdateQualificationScore', 'RevokeQualification', 'GrantQualification',
+    'RejectQualificationRequest', 'CreateQualificationType',
+    'UpdateQualificationType', 'DisposeQualificationType', 'RegisterHITType',
+    'ChangeHITTypeOfHIT', 'SetHITAsReviewing', 'DisableHIT', 'DisposeHIT',
+    'ForceExpireHIT', 'BlockWorker', 'UnblockWorker',
+    'SetHITTypeNotification')
+JOURNAL_DUPLICATE_CODES = ('AWS.MechanicalTurk.DuplicateRequest',)
+JOURNAL_RESULT_FIELDS = ('HITId', 'HITTypeId', 'QualificationTypeId')
 
 # Define authentication routines
 def generate_timestamp(gmtime):
     return time.strftime("%Y-%m-%dT%H:%M:%SZ", gmtime)
 
 
+class Signer(object):
+    """Computes request signatures for one secret key.
+
+    The keyed HMAC state is built once and copied for every signature.
+    Since the signed string is only service + operation + timestamp, and
+    timestamps have one second resolution, signatures are also memoized
+    per (operation, timestamp) in a bounded cache. A Signer is
+    thread-safe and can be shared by any number of request paths.
+    """
+
+    def __init__(self, secret_access_key, service=SERVICE_NAME,
+                 cache_size=None):
+        self.service = service
+        self.cache_size = cache_size or SIGNATURE_CACHE_SIZE
+        self._hmac = hmac.new(secret_access_key, digestmod=sha)
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def sign(self, operation, timestamp):
+        key = (operation, timestamp)
+        with self._lock:
+            signature = self._cache.get(key)
+            if signature is not None:
+                self.hits += 1
+                return signature
+            self.misses += 1
+        my_sha_hmac = self._hmac.copy()
+        my_sha_hmac.update(self.service + operation + timestamp)
+        signature = base64.b64encode(my_sha_hmac.digest())
+        with self._lock:
+            self._cache[key] = signature
+            # timestamps only grow, so dropping the oldest entry is enough
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return signature
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(hits=self.hits, misses=self.misses,
+                        size=len(self._cache))
+
+
+_signers = {}
+_signers_lock = threading.Lock()
+
+
+def get_signer(secret_access_key=None, service=SERVICE_NAME):
+    # one shared Signer per (service, secret key)
+    if secret_access_key is None:
+        secret_access_key = AWS_SECRET_ACCESS_KEY
+    key = (service, secret_access_key)
+    with _signers_lock:
+        signer = _signers.get(key)
+        if signer is None:
+            signer = _signers[key] = Signer(secret_access_key, service)
+    return signer
+
+
 def generate_signature(service, operation, timestamp, secret_access_key):
-    sig = service + operation + timestamp
-    my_sha_hmac = hmac.new(secret_access_key, sig, sha)
-    my_b64_hmac_digest = base64.encodestring(my_sha_hmac.digest()).strip()
-    return my_b64_hmac_digest
+    return get_signer(secret_access_key, service).sign(operation, timestamp)
+
+
+class ConnectionPool(object):
+    """Thread-safe pool of persistent HTTP/1.1 connections to one endpoint.
+
+    Connections are checked out per request and returned afterwards, so
+    the TCP (and TLS) handshake is paid once per connection rather than
+    once per operation. Idle connections the server has closed are
+    dropped at checkout. One that closes as the request goes out is
+    replaced and the request sent again, but only when the request is
+    safe to repeat (resend) and it cannot have reached the service: it
+    failed while being written, or the socket was closed before any
+    response arrived. Timeouts are never resent.
+    """
+
+    def __init__(self, url, size=None, idle_timeout=None, timeout=None):
+        scheme, netloc, path = urlparse.urlsplit(url)[:3]
+        self.url = url
+        self.scheme = scheme
+        self.host = netloc
+        self.path = path or '/'
+        self.size = size or POOL_SIZE
+        self.idle_timeout = idle_timeout or POOL_IDLE_TIMEOUT
+        self.timeout = timeout or POOL_SOCKET_TIMEOUT
+        self._idle = []
+        self._lock = threading.Lock()
+        # counters
+        self.requests = 0
+        self.created = 0
+        self.reused = 0
+        self.reconnects = 0
+        self.expired = 0
+        self.dropped = 0
+        self.discarded = 0
+
+    def _connect(self):
+        if self.scheme == 'https':
+            conn = httplib.HTTPSConnection(self.host, timeout=self.timeout)
+        else:
+            conn = httplib.HTTPConnection(self.host, timeout=self.timeout)
+        with self._lock:
+            self.created += 1
+        return conn
+
+    def _checkout(self):
+        with self._lock:
+            self.requests += 1
+        while True:
+            with self._lock:
+                if not self._idle:
+                    break
+                conn, last_used = self._idle.pop()
+            if time.time() - last_used >= self.idle_timeout:
+                conn.close()
+                with self._lock:
+                    self.expired += 1
+            elif idle_socket_closed(conn.sock):
+                # the server dropped it while idle; never write to it
+                conn.close()
+                with self._lock:
+                    self.dropped += 1
+            else:
+                with self._lock:
+                    self.reused += 1
+                return conn, True
+        return self._connect(), False
+
+    def _checkin(self, conn):
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append((conn, time.time()))
+                return
+            self.discarded += 1
+        conn.close()
+
+    def _send(self, conn, body, stats, phase):
+        # phase[0] is the step under way when an exception escapes
+        start = time.time()
+        if conn.sock is None:
+            phase[0] = 'connect'
+            conn.connect()
+            connected = time.time()
+            if stats is not None:
+                stats.add('connect', connected - start)
+            start = connected
+        phase[0] = 'request'
+        conn.request('POST', self.path, body,
+                     {'Content-Type': 'application/x-www-form-urlencoded'})
+        phase[0] = 'status'
+        response = conn.getresponse()
+        received = time.time()
+        phase[0] = 'body'
+        data = response.read()
+        if stats is not None:
+            stats.add('wait', received - start)
+            stats.add('read', time.time() - received)
+        return response, data
+
+    def request(self, body, stats=None, resend=False):
+        """POST an urlencoded body, return (status, response body).
+
+        Connect, wait and read times are added to `stats` if given.
+        resend allows sending the body again on a fresh connection when
+        a reused one turns out to have been closed.
+        """
+        conn, reused = self._checkout()
+        phase = [None]
+        try:
+            try:
+                response, data = self._send(conn, body, stats, phase)
+            except (socket.error, httplib.HTTPException), e:
+                conn.close()
+                if not (reused and resend and unanswered(e, phase[0])):
+                    raise
+                # the server closed the idle keep-alive socket; reconnect once
+                with self._lock:
+                    self.reconnects += 1
+                conn = self._connect()
+                response, data = self._send(conn, body, stats, phase)
+        except:
+            conn.close()
+            raise
+        if response.will_close:
+            conn.close()
+        else:
+            self._checkin(conn)
+        return response.status, data
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn, last_used in idle:
+            conn.close()
+
+    def stats(self):
+        with self._lock:
+            return dict(requests=self.requests, created=self.created,
+                        reused=self.reused, reconnects=self.reconnects,
+                        expired=self.expired, dropped=self.dropped,
+                        discarded=self.discarded,
+                        idle=len(self._idle))
+
+
+def idle_socket_closed(sock):
+    # an idle keep-alive socket has nothing to read unless the server
+    # closed it (EOF) or broke the protocol, either way it is unusable
+    if sock is None:
+        return False
+    try:
+        return bool(select.select([sock], [], [], 0)[0])
+    except (select.error, socket.error, ValueError):
+        return True
+
+
+def unanswered(error, phase):
+    # True when a request that failed with error during phase (see
+    # ConnectionPool._send) cannot have been processed by the service
+    if isinstance(error, socket.timeout):
+        return False
+    if phase in ('connect', 'request'):
+        return True
+    if phase == 'status':
+        if isinstance(error, httplib.BadStatusLine):
+            # closed before a status line; the wording varies in 2.7.x
+            return error.line in ('', "''") or \
+                error.line.startswith('No status line received')
+        return isinstance(error, socket.error) and \
+            error.errno in (errno.ECONNRESET, errno.EPIPE)
+    return False
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def endpoint():
+    if LOCALP:
+        return LOCAL_URL
+    if SANDBOXP:
+        return SANDBOX_URL
+    return PRODUCTION_URL
+
+
+def get_pool(url=None):
+    # one shared pool per endpoint url, created on first use
+    url = url or endpoint()
+    with _pools_lock:
+        pool = _pools.get(url)
+        if pool is None:
+            pool = _pools[url] = ConnectionPool(url)
+    return pool
+
+
+def pool_stats():
+    with _pools_lock:
+        pools = _pools.items()
+    return dict((url, pool.stats()) for url, pool in pools)
+
+
+def close_pools():
+    with _pools_lock:
+        pools = _pools.values()
+        _pools.clear()
+    for pool in pools:
+        pool.close()
+
+
+# Rate limiting
+class TokenBucket(object):
+    """Thread-safe token bucket with an adaptive rate.
+
+    acquire() blocks until a request may be sent. throttled() halves the
+    rate (down to MIN_RATE) when the service pushes back, and every
+    succeeded() call raises it again by roughly one request per second
+    per second, up to `rate` if one is given and without limit if not,
+    so the bucket keeps probing for the highest rate the service
+    accepts. Without a rate nothing is held back until the first
+    throttled(), which starts from half the rate requests were being
+    sent at. Throttles within `window` seconds of a cut are answers to
+    requests sent before it and don't cut the rate again.
+    """
+
+    def __init__(self, rate=None, burst=None, min_rate=None, window=None):
+        self.max_rate = rate and float(rate)
+        self.rate = self.max_rate
+        self.burst = burst or max(1, int(rate or 1))
+        self.min_rate = min_rate or MIN_RATE
+        self.tokens = float(self.burst)
+        self.stamp = time.time()
+        self.window = window or THROTTLE_WINDOW
+        self.throttles = 0
+        self.cuts = 0
+        self._cut = None                    # time of the last rate cut
+        self._sent = collections.deque()    # send times in the last second
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.time()
+                if self.rate is None:
+                    sent = self._sent
+                    sent.append(now)
+                    while sent[0] < now - 1:
+                        sent.popleft()
+                    return
+                self.tokens = min(self.burst,
+                                  self.tokens + (now - self.stamp) * self.rate)
+                self.stamp = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                delay = (1 - self.tokens) / self.rate
+            time.sleep(delay)
+
+    def throttled(self):
+        with self._lock:
+            self.throttles += 1
+            now = time.time()
+            if self._cut is not None and now - self._cut < self.window:
+                return
+            self._cut = now
+            self.cuts += 1
+            if self.rate is None:
+                # the rate requests went out at until now
+                rate = float(len(self._sent))
+                self._sent.clear()
+                self.burst = max(1, int(rate / 2))
+                self.tokens = 0.0
+                self.stamp = now
+            else:
+                rate = self.rate
+            self.rate = max(self.min_rate, rate / 2)
+
+    def succeeded(self):
+        with self._lock:
+            if self.rate is None:
+                return
+            rate = self.rate + 1 / self.rate
+            if self.max_rate is not None:
+                rate = min(self.max_rate, rate)
+            self.rate = rate
+
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+
+
+def operation_class(operation):
+    if operation.startswith('Get') or operation.startswith('Search'):
+        return 'read'
+    return 'write'
+
+
+def get_bucket(operation):
+    name = operation_class(operation)
+    with _buckets_lock:
+        bucket = _buckets.get(name)
+        if bucket is None:
+            rate, burst = RATE_LIMITS.get(name) or (None, None)
+            bucket = _buckets[name] = TokenBucket(rate, burst)
+    return bucket
+
+
+def backoff(attempt):
+    # "full jitter" exponential backoff
+    return random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+
+
+def retryable_error(operation, status, result_xmlstr):
+    # the error to retry on, or None if the response should be returned
+    if '<Errors>' in result_xmlstr:
+        try:
+            errors = parse(result_xmlstr).errors
+        except xml.parsers.expat.ExpatError:
+            errors = []
+        if errors:
+            error = error_for(errors[0], operation, errors)
+            if error.retryable:
+                return error
+            return None
+    if status >= 500:
+        return ServiceUnavailableError('HTTP%d' % status,
+                                       'HTTP status %d' % status, operation)
+    return None
 
 
 def req(operation, args=None):
-    # Calculate the request authentication parameters
-    timestamp = generate_timestamp(time.gmtime())
-    signature = generate_signature('AWSMechanicalTurkRequester', operation,
-                                   timestamp, AWS_SECRET_ACCESS_KEY)
+    client = current_client()
+    stats = getattr(_local, 'stats', None)
+    bucket = client.bucket(operation)
+    # a write may have been applied before an error or a lost response,
+    # so only reads and writes carrying a token are ever sent twice
+    resend = (operation_class(operation) == 'read' or
+              'UniqueRequestToken' in (args or {}))
+    attempt = 0
+    while True:
+        start = time.time()
+        bucket.acquire()
+
+        # Calculate the request authentication parameters
+        signing = time.time()
+        timestamp = generate_timestamp(time.gmtime())
+        signature = client.signer.sign(operation, timestamp)
+
+        # Construct the request
+        parameters = {
+            'Service': SERVICE_NAME,
+            'Version': SERVICE_VERSION,
+            'AWSAccessKeyId': client.aws_access_key_id,
+            'Timestamp': timestamp,
+            'Signature': signature,
+            'Operation': operation
+        }
 
-    # Construct the request
-    parameters = {
-        'Service': SERVICE_NAME,
-        'Version': SERVICE_VERSION,
-        'AWSAccessKeyId': AWS_ACCESS_KEY_ID,
-        'Timestamp': timestamp,
-        'Signature': signature,
-        'Operation': operation
-    }
+        if args:
+            parameters.update(args)
+
+        encoding = time.time()
+        body = urllib.urlencode(parameters)
+        if stats is not None:
+            sent = time.time()
+            stats.add('throttle', signing - start)
+            stats.add('sign', encoding - signing)
+            stats.add('encode', sent - encoding)
+            stats.request_bytes += len(body)
+
+        # Make the request over a pooled keep-alive connection
+        status, result_xmlstr = client.pool.request(body, stats, resend)
+        if stats is not None:
+            stats.response_bytes += len(result_xmlstr)
+
+        # back off and retry when throttled or the service is unavailable
+        error = retryable_error(operation, status, result_xmlstr)
+        if error is None:
+            bucket.succeeded()
+            return result_xmlstr
+        bucket.throttled()
+        # throttled requests were turned away unprocessed, other errors
+        # (InternalError, HTTP 5xx) may come after the write was applied
+        if attempt >= MAX_RETRIES or not (
+                resend or isinstance(error, ThrottledError)):
+            raise error
+        delay = backoff(attempt)
+        if stats is not None:
+            stats.retries += 1
+            stats.add('throttle', delay)
+        time.sleep(delay)
+        attempt += 1
+
+
+# Response parsing
+#
+# Responses are parsed in a single expat pass. Every leaf element is
+# recorded in Result.fields (first occurrence wins, keyed both by its own
+# tag and by "Parent.Tag"), and the leaves under HIT, Assignment,
+# Qualification, ... elements are collected into one flat record per
+# element, so operations never have to search the tree again.
+
+# values repeated across many records, stored once per process
+INTERNED_FIELDS = frozenset([
+    'HITStatus', 'HITReviewStatus', 'AssignmentStatus', 'Status',
+    'QualificationTypeStatus', 'HITTypeId', 'QualificationTypeId',
+    'Reward.CurrencyCode', 'BonusAmount.CurrencyCode', 'IsRequestable',
+    'AutoGranted',
+])
+_interned = {}
+_missing = object()
+
+
+def _slot_names(fields):
+    return tuple(field.replace('.', '_') for field in fields)
+
+
+class Record(object):
+    """Flat mapping of the leaf values found under one response element.
+
+    Direct children are keyed by tag, deeper leaves by "Parent.Tag",
+    e.g. a HIT's reward amount is hit['Reward.Amount'] (or
+    hit.Reward_Amount). The fields a record type expects live in
+    __slots__, anything else in a small overflow dict, so records cost
+    far less memory than plain dicts while still behaving like one.
+    """
+    __slots__ = ('_extra',)
+    __hash__ = None
+    tag = None
+    FIELDS = ()
+    _keys = {}
+
+    def __init__(self, *args, **kwargs):
+        self._extra = None
+        if args or kwargs:
+            self.update(*args, **kwargs)
+
+    def _lookup(self, key, default):
+        slot = self._keys.get(key)
+        if slot is not None:
+            return getattr(self, slot, default)
+        if self._extra is None:
+            return default
+        return self._extra.get(key, default)
+
+    def __getitem__(self, key):
+        value = self._lookup(key, _missing)
+        if value is _missing:
+            raise KeyError(key)
+        return value
+
+    def __setitem__(self, key, value):
+        if key in INTERNED_FIELDS:
+            value = _interned.setdefault(value, value)
+        slot = self._keys.get(key)
+        if slot is not None:
+            setattr(self, slot, value)
+        else:
+            if self._extra is None:
+                self._extra = {}
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        slot = self._keys.get(key)
+        try:
+            if slot is not None:
+                delattr(self, slot)
+            else:
+                del self._extra[key]
+        except (AttributeError, KeyError, TypeError):
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        return self._lookup(key, _missing) is not _missing
+
+    has_key = __contains__
+
+    def get(self, key, default=None):
+        return self._lookup(key, default)
+
+    def setdefault(self, key, value=None):
+        current = self._lookup(key, _missing)
+        if current is not _missing:
+            return current
+        self[key] = value
+        return self._lookup(key, None)
+
+    def update(self, *args, **kwargs):
+        for key, value in dict(*args, **kwargs).iteritems():
+            self[key] = value
+
+    def iteritems(self):
+        for key, slot in zip(self.FIELDS, self.__slots__):
+            try:
+                yield key, getattr(self, slot)
+            except AttributeError:
+                pass
+        if self._extra:
+            for item in self._extra.iteritems():
+                yield item
+
+    def iterkeys(self):
+        for key, value in self.iteritems():
+            yield key
+
+    def itervalues(self):
+        for key, value in self.iteritems():
+            yield value
+
+    __iter__ = iterkeys
+
+    def items(self):
+        return list(self.iteritems())
+
+    def keys(self):
+        return list(self.iterkeys())
+
+    def values(self):
+        return list(self.itervalues())
+
+    def __len__(self):
+        return len(self.items())
+
+    def as_dict(self):
+        return dict(self.iteritems())
+
+    def copy(self):
+        return self.__class__(self.iteritems())
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            other = other.as_dict()
+        return self.as_dict() == other
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '%s(%r)' % (self.__class__.__name__, self.as_dict())
+
+    def __reduce__(self):
+        return self.__class__, (self.as_dict(),)
+
+
+class HIT(Record):
+    tag = 'HIT'
+    FIELDS = ('HITId', 'HITTypeId', 'CreationTime', 'Title', 'Description',
+              'Keywords', 'HITStatus', 'HITReviewStatus', 'MaxAssignments',
+              'Reward.Amount', 'Reward.CurrencyCode', 'Reward.FormattedPrice',
+              'AutoApprovalDelayInSeconds', 'Expiration',
+              'AssignmentDurationInSeconds', 'LifetimeInSeconds',
+              'NumberOfSimilarHITs', 'NumberOfAssignmentsPending',
+              'NumberOfAssignmentsAvailable', 'NumberOfAssignmentsCompleted',
+              'RequesterAnnotation', 'Question')
+    __slots__ = _slot_names(FIELDS)
+
+
+class Assignment(Record):
+    tag = 'Assignment'
+    FIELDS = ('AssignmentId', 'WorkerId', 'HITId', 'AssignmentStatus',
+              'AutoApprovalTime', 'AcceptTime', 'SubmitTime', 'ApprovalTime',
+              'RejectionTime', 'Deadline', 'RequesterFeedback', 'Answer')
+    __slots__ = _slot_names(FIELDS)
+
+    def answers(self):
+        # the decoded Answer, see parse_answers
+        return parse_answers(self.get('Answer'))
+
+
+class Qualification(Record):
+    tag = 'Qualification'
+    FIELDS = ('QualificationTypeId', 'SubjectId', 'GrantTime', 'IntegerValue',
+              'LocaleValue.Country', 'Status')
+    __slots__ = _slot_names(FIELDS)
+
+
+class QualificationRequest(Record):
+    tag = 'QualificationRequest'
+    FIELDS = ('QualificationRequestId', 'QualificationTypeId', 'SubjectId',
+              'Test', 'Answer', 'SubmitTime')
+    __slots__ = _slot_names(FIELDS)
+
+
+class QualificationType(Record):
+    tag = 'QualificationType'
+    FIELDS = ('QualificationTypeId', 'CreationTime', 'Name', 'Description',
+              'Keywords', 'QualificationTypeStatus', 'Test',
+              'TestDurationInSeconds', 'AnswerKey', 'RetryDelayInSeconds',
+              'IsRequestable', 'AutoGranted', 'AutoGrantedValue')
+    __slots__ = _slot_names(FIELDS)
+
+
+class BonusPayment(Record):
+    tag = 'BonusPayment'
+    FIELDS = ('WorkerId', 'BonusAmount.Amount', 'BonusAmount.CurrencyCode',
+              'BonusAmount.FormattedPrice', 'AssignmentId', 'Reason',
+              'GrantTime')
+    __slots__ = _slot_names(FIELDS)
+
+
+class Error(Record):
+    tag = 'Error'
+    FIELDS = ('Code', 'Message')
+    __slots__ = _slot_names(FIELDS)
+
+
+RECORD_TYPES = dict((cls.tag, cls) for cls in (
+    HIT, Assignment, Qualification, QualificationRequest, QualificationType,
+    BonusPayment, Error))
+
+for _cls in RECORD_TYPES.values():
+    _cls._keys = dict(zip(_cls.FIELDS, _cls.__slots__))
+
+
+class Result(object):
+    """Parsed response: top-level fields, typed records and errors."""
+
+    def __init__(self, xmlstr):
+        self.xmlstr = xmlstr
+        self.fields = {}
+        self.records = {}
+        self.errors = []
+
+    def get(self, name, default=None):
+        return self.fields.get(name, default)
+
+    def all(self, tag):
+        return self.records.get(tag, [])
+
+    def first(self, tag):
+        records = self.records.get(tag)
+        if records:
+            return records[0]
+        return None
+
+
+class _ResultBuilder(object):
+
+    def __init__(self, result, fields=None):
+        self.result = result
+        self.stack = []
+        self.leaf = []
+        self.open_records = []
+        self.text = []
+        self.fields = fields
+        self.skip = 0
+        if fields is not None:
+            # direct children of a record that lead to a wanted field
+            self.wanted = set(field.split('.')[0] for field in fields)
+            self.wanted.add('Request')
+
+    def start(self, name, attrs):
+        if self.skip:
+            self.skip += 1
+            return
+        if self.leaf:
+            self.leaf[-1] = False
+        if self.fields is not None and self.open_records and \
+                self.open_records[-1][1] == len(self.stack) and \
+                name not in self.wanted and \
+                self.open_records[-1][0].tag != 'Error':
+            # a record child that was not asked for, ignore its subtree
+            self.skip = 1
+            return
+        self.stack.append(name)
+        self.leaf.append(True)
+        self.text = []
+        cls = RECORD_TYPES.get(name)
+        if cls is not None:
+            self.open_records.append((cls(), len(self.stack)))
+
+    def data(self, data):
+        if not self.skip:
+            self.text.append(data)
+
+    def end(self, name):
+        if self.skip:
+            self.skip -= 1
+            return
+        stack = self.stack
+        depth = len(stack)
+        if self.leaf.pop():
+            value = ''.join(self.text)
+            if _non_ascii(value):
+                value = value.decode('utf-8')
+            fields = self.result.fields
+            fields.setdefault(name, value)
+            if depth > 1:
+                key = stack[-2] + '.' + name
+                fields.setdefault(key, value)
+            if self.open_records:
+                record, record_depth = self.open_records[-1]
+                if depth > record_depth + 1:
+                    name = key
+                if depth > record_depth and (self.fields is None or
+                                             name in self.fields or
+                                             record.tag == 'Error'):
+                    slot = record._keys.get(name)
+                    if slot is None:
+                        record.setdefault(name, value)
+                    elif getattr(record, slot, _missing) is _missing:
+                        if name in INTERNED_FIELDS:
+                            value = _interned.setdefault(value, value)
+                        setattr(record, slot, value)
+        if self.open_records and self.open_records[-1][1] == depth:
+            record = self.open_records.pop()[0]
+            self.result.records.setdefault(record.tag, []).append(record)
+            if record.tag == 'Error':
+                self.result.errors.append(record)
+        self.text = []
+        stack.pop()
+
+
+# ascii values are kept as byte strings, a quarter the size of unicode
+_non_ascii = re.compile('[\x80-\xff]').search
+
+
+def parse(string, fields=None):
+    # single pass over the response, no DOM is built; with `fields` only
+    # those record fields are kept and other record children are skipped
+    result = Result(string)
+    builder = _ResultBuilder(result, fields)
+    parser = xml.parsers.expat.ParserCreate()
+    parser.returns_unicode = False
+    parser.buffer_text = True
+    parser.StartElementHandler = builder.start
+    parser.EndElementHandler = builder.end
+    parser.CharacterDataHandler = builder.data
+    parser.Parse(string, True)
+    return result
+
+
+# Errors
+class MTurkError(Exception):
+    """An error returned by the service.
+
+    code and message come from the first Error element of the response,
+    errors holds all of them. retryable is True for errors that are
+    expected to go away when the request is sent again later.
+    """
+    retryable = False
 
-    if args:
-        parameters.update(args)
+    def __init__(self, code, message, operation=None, errors=None):
+        Exception.__init__(self, code, message)
+        self.code = code
+        self.message = message
+        self.operation = operation
+        self.errors = errors or []
 
-    # Make the request
-    if SANDBOXP:
-        url = 'http://mechanicalturk.sandbox.amazonaws.com'
+    def __str__(self):
+        return '%s: %s' % (self.code, self.message)
+
+
+class ThrottledError(MTurkError):
+    retryable = True
+
+
+class ServiceUnavailableError(MTurkError):
+    retryable = True
+
+
+THROTTLED_CODES = ('Throttling', 'RequestThrottled',
+                   'AWS.MechanicalTurk.Throttled')
+UNAVAILABLE_CODES = ('ServiceUnavailable', 'AWS.ServiceUnavailable',
+                     'AWS.MechanicalTurk.ServiceUnavailable', 'InternalError',
+                     'AWS.InternalError')
+
+
+def error_for(error, operation=None, errors=None):
+    # build the exception for an Error record
+    code = error.get('Code', '')
+    message = error.get('Message', '')
+    if code in THROTTLED_CODES or 'throttl' in message.lower():
+        cls = ThrottledError
+    elif code in UNAVAILABLE_CODES:
+        cls = ServiceUnavailableError
     else:
-        url = 'http://mechanicalturk.amazonaws.com'
-    result_xmlstr = urllib.urlopen(url, urllib.urlencode(parameters)).read()
-    return result_xmlstr
+        cls = MTurkError
+    return cls(code, message, operation, errors)
+
+
+def errcheck(result, operation=None):
+    # Raise an MTurkError for the first error in the response
+    if result.errors:
+        raise error_for(result.errors[0], operation, result.errors)
+    return result.errors
+
+
+class _AnswersBuilder(object):
+
+    def __init__(self):
+        self.answers = {}
+        self.identifier = None
+        self.values = []
+        self.text = []
+
+    def start(self, name, attrs):
+        self.text = []
+
+    def data(self, data):
+        self.text.append(data)
+
+    def end(self, name):
+        value = ''.join(self.text)
+        if _non_ascii(value):
+            value = value.decode('utf-8')
+        if name == 'QuestionIdentifier':
+            self.identifier = value
+        elif name in ('FreeText', 'SelectionIdentifier', 'OtherSelectionText',
+                      'UploadedFileKey'):
+            self.values.append(value)
+        elif name == 'Answer':
+            if len(self.values) == 1:
+                self.answers[self.identifier] = self.values[0]
+            else:
+                self.answers[self.identifier] = self.values
+            self.identifier = None
+            self.values = []
+        self.text = []
+
+
+def parse_answers(string):
+    """Decode a QuestionFormAnswers document into {QuestionIdentifier:
+    value}. The value is the answer text, selection or uploaded file key,
+    or a list of them when several selections were made.
+    """
+    if not string:
+        return {}
+    builder = _AnswersBuilder()
+    parser = xml.parsers.expat.ParserCreate(namespace_separator=' ')
+    parser.returns_unicode = False
+    parser.buffer_text = True
+    parser.StartElementHandler = builder.start
+    parser.EndElementHandler = lambda name: builder.end(name.split(' ')[-1])
+    parser.CharacterDataHandler = builder.data
+    if isinstance(string, unicode):
+        string = string.encode('utf-8')
+    parser.Parse(string, True)
+    return builder.answers
+
+
+def pp(string, fields=None):
+    return parse(string, fields)
+
+
+# Response cache
+#
+# Cached responses are tagged with the entities they describe, and every
+# operation that changes an entity drops the responses tagged with it.
+# CACHE_TAGS maps an operation to (tag, parameter names) pairs; the tag
+# of a call is the tag name followed by the values of those parameters.
+CACHE_TAGS = {
+    'GetHIT': [('HIT', ('HITId',))],
+    'GetQualificationType': [('QualificationType', ('QualificationTypeId',))],
+    'GetQualificationScore': [('Qualification', ('QualificationTypeId',
+                                                 'SubjectId')),
+                              ('QualificationScores', ())],
+    'GetAccountBalance': [('AccountBalance', ())],
+
+    'ExtendHIT': [('HIT', ('HITId',)), ('AccountBalance', ())],
+    'DisableHIT': [('HIT', ('HITId',)), ('AccountBalance', ())],
+    'ForceExpireHIT': [('HIT', ('HITId',)), ('AccountBalance', ())],
+    'DisposeHIT': [('HIT', ('HITId',))],
+    'SetHITAsReviewing': [('HIT', ('HITId',))],
+    'ChangeHITTypeOfHIT': [('HIT', ('HITId',))],
+    'CreateHIT': [('AccountBalance', ())],
+    'ApproveAssignment': [('AccountBalance', ())],
+    'GrantBonus': [('AccountBalance', ())],
+    'UpdateQualificationScore': [('Qualification', ('QualificationTypeId',
+                                                    'SubjectId'))],
+    'RevokeQualification': [('Qualification', ('QualificationTypeId',
+                                               'SubjectId'))],
+    'AssignQualification': [('Qualification', ('QualificationTypeId',
+                                               'WorkerId'))],
+    # only the request id is known, drop every cached score
+    'GrantQualification': [('QualificationScores', ())],
+    'UpdateQualificationType': [('QualificationType',
+                                 ('QualificationTypeId',))],
+    'DisposeQualificationType': [('QualificationType',
+                                  ('QualificationTypeId',))],
+}
+
+
+def cache_tags(operation, parameters):
+    tags = []
+    for name, keys in CACHE_TAGS.get(operation, ()):
+        tags.append((name,) + tuple(parameters.get(key) for key in keys))
+    return tags
+
+
+class ResponseCache(object):
+    """LRU cache of parsed responses with a TTL per operation.
+
+    Only operations listed in `ttls` are cached. Any other operation
+    invalidates the cached responses that share one of its tags.
+    """
 
+    def __init__(self, size=None, ttls=None):
+        self.size = size or CACHE_SIZE
+        self.ttls = ttls or CACHE_TTL
+        self._entries = collections.OrderedDict()
+        self._tagged = {}
+        self._lock = threading.Lock()
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _key(self, operation, parameters):
+        return (operation, tuple(sorted((parameters or {}).items())))
+
+    def get(self, operation, parameters):
+        if operation not in self.ttls:
+            return None
+        key = self._key(operation, parameters)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            if entry[0] < time.time():
+                self._forget(key, entry)
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def put(self, operation, parameters, result, version):
+        ttl = self.ttls.get(operation)
+        if ttl is None:
+            return
+        key = self._key(operation, parameters)
+        tags = cache_tags(operation, parameters or {})
+        with self._lock:
+            # something was invalidated while this response was in flight
+            if version != self.version:
+                return
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self._forget(key, old)
+            self._entries[key] = (time.time() + ttl, result, tags)
+            for tag in tags:
+                self._tagged.setdefault(tag, set()).add(key)
+            while len(self._entries) > self.size:
+                old_key, old = self._entries.popitem(last=False)
+                self._forget(old_key, old)
+                self.evictions += 1
+
+    def _forget(self, key, entry):
+        self._entries.pop(key, None)
+        for tag in entry[2]:
+            keys = self._tagged.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._tagged[tag]
+
+    def invalidate(self, operation, parameters):
+        if operation in self.ttls:
+            return
+        tags = cache_tags(operation, parameters or {})
+        if not tags:
+            return
+        with self._lock:
+            self.version += 1
+            for tag in tags:
+                for key in list(self._tagged.get(tag, ())):
+                    self._forget(key, self._entries[key])
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self.version += 1
+            self._entries.clear()
+            self._tagged.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            hit_rate = 0.0
+            if lookups:
+                hit_rate = float(self.hits) / lookups
+            return dict(hits=self.hits, misses=self.misses,
+                        hit_rate=hit_rate, expired=self.expired,
+                        evictions=self.evictions,
+                        invalidations=self.invalidations,
+                        size=len(self._entries))
+
+
+response_cache = None
+
+
+def enable_cache(size=None, ttls=None):
+    global response_cache
+    response_cache = ResponseCache(size, ttls)
+    return response_cache
+
+
+def disable_cache():
+    global response_cache
+    response_cache = None
+
+
+# Request coalescing
+#
+# With coalescing enabled, threads making the same read at the same time
+# (same operation, parameters and projection) share one request and its
+# parsed result instead of each sending their own. Results are shared
+# objects, like cached ones, so callers should not modify them.
+class _Flight(object):
+    __slots__ = ('event', 'result', 'error')
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """Runs one request for every group of concurrent identical reads.
+
+    Only read operations (see operation_class) are coalesced. When any
+    other operation finishes, the reads in flight stop taking on new
+    callers, so a read made after a write never gets a response that
+    was requested before it.
+    """
 
-def errcheck(result_xml):
-    # Check for and print results and errors
-    errors_nodes = result_xml.getElementsByTagName('Errors')
-    if errors_nodes:
-        print 'There was an error processing your request:'
-        for errors_node in errors_nodes:
-            for error_node in errors_node.getElementsByTagName('Error'):
-                print('  Error code:    ' +
-                      error_node.getElementsByTagName('Code')[0].childNodes[0].data)
-                print('  Error message: ' +
-                      error_node.getElementsByTagName('Message')[0].childNodes[0].data)
-    return errors_nodes
+    def __init__(self):
+        self._flights = {}
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.coalesced = 0
+        self.resets = 0
+
+    def _key(self, operation, parameters):
+        items = []
+        for name, value in (parameters or {}).items():
+            if not isinstance(value, basestring):
+                value = str(value)
+            items.append((name, value))
+        return (operation, tuple(sorted(items)))
+
+    def do(self, operation, parameters, function):
+        """Return (function(), False), or (result, True) when the result
+        of an identical call already in flight was shared.
+        """
+        if operation_class(operation) != 'read':
+            try:
+                return function(), False
+            finally:
+                self.reset()
+        key = self._key(operation, parameters)
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.calls += 1
+            else:
+                self.coalesced += 1
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error[0], flight.error[1], flight.error[2]
+            return flight.result, True
+        try:
+            flight.result = function()
+        except Exception:
+            flight.error = sys.exc_info()
+            raise
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            flight.event.set()
+        return flight.result, False
+
+    def reset(self):
+        with self._lock:
+            if self._flights:
+                self._flights.clear()
+                self.resets += 1
+
+    def stats(self):
+        with self._lock:
+            total = self.calls + self.coalesced
+            rate = 0.0
+            if total:
+                rate = float(self.coalesced) / total
+            return dict(calls=self.calls, coalesced=self.coalesced,
+                        coalesced_rate=rate, resets=self.resets,
+                        in_flight=len(self._flights))
+
+
+single_flight = None
+
+
+def enable_coalescing():
+    global single_flight
+    single_flight = SingleFlight()
+    return single_flight
+
+
+def disable_coalescing():
+    global single_flight
+    single_flight = None
+
+
+# Journal
+#
+# With a journal enabled, every write is logged before it is sent and its
+# outcome once the response is in. After a crash, resume() sends only the
+# writes that never got an answer, instead of crawling the account to
+# find out what went through:
+#
+#     journal = enable_journal('bonuses.journal')
+#     journal.resume()
+#     for WorkerId, AssignmentId in todo:
+#         GrantBonus(WorkerId, AssignmentId, 0.25, 'thanks')
+def _utf8(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def read_journal(path):
+    """Yield the entries of a journal file, skipping torn ones.
+
+    An entry torn by a crash was never completed: a write is only sent
+    once its entry is written, and a write whose outcome was torn off
+    simply stays unfinished.
+    """
+    f = open(path)
+    try:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                continue
+            yield entry
+    finally:
+        f.close()
+
+
+class Journal(object):
+    """Append-only log of the writes sent through a client.
+
+    Entries are json lines, one when a write is about to be sent
+    (flushed to disk first when sync is set) and one with its outcome:
+
+        {"id": ..., "operation": ..., "parameters": {...}, "time": ...}
+        {"id": ..., "status": "ok", "result": {"HITId": ...}, "time": ...}
+
+    status is ok, error, duplicate (the service had already seen the
+    UniqueRequestToken) or uncertain (resume() could not safely send it
+    again). Writes in UNIQUE_REQUEST_TOKEN_OPERATIONS are given a token
+    before they are logged, so sending one again never repeats it.
+    resume() sends as `client`, the client the journal was enabled on.
+    """
+
+    def __init__(self, path, sync=True, client=None):
+        self.path = path
+        self.sync = sync
+        self.client = client or default_client
+        self.session = uuid.uuid4().hex[:12]
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._file = open(path, 'a+')
+        self._file.seek(0, os.SEEK_END)
+        if self._file.tell():
+            self._file.seek(-1, os.SEEK_END)
+            if self._file.read(1) != '\n':
+                # the last entry was torn by a crash, don't extend it
+                self._file.write('\n')
+
+    def _append(self, entry, sync=False):
+        line = json.dumps(entry, sort_keys=True) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+        if sync:
+            os.fsync(self._file.fileno())
+
+    def prepare(self, operation, parameters):
+        # the parameters to send and log, with a UniqueRequestToken
+        if operation in UNIQUE_REQUEST_TOKEN_OPERATIONS and \
+                not (parameters or {}).get('UniqueRequestToken'):
+            parameters = dict(parameters or {})
+            parameters['UniqueRequestToken'] = uuid.uuid4().hex
+        return parameters
+
+    def run(self, operation, parameters, send):
+        """Log the write, send() it and log the Result it returns.
+
+        An exception from send() leaves the write unfinished.
+        """
+        replaying = getattr(_local, 'replaying', None)
+        if replaying is not None and replaying[0] is self:
+            _local.replaying = None
+            entry = replaying[1]
+        else:
+            entry = '%s.%d' % (self.session, next(self._ids))
+            self._append(dict(id=entry, operation=operation,
+                              parameters=parameters or {},
+                              time=time.time()), self.sync)
+        result = send()
+        if result.errors:
+            code = result.errors[0].get('Code')
+            status = 'error'
+            if code in JOURNAL_DUPLICATE_CODES:
+                status = 'duplicate'
+            self._append(dict(id=entry, status=status, code=code,
+                              message=result.errors[0].get('Message'),
+                              time=time.time()))
+        else:
+            values = dict((name, result.get(name))
+                          for name in JOURNAL_RESULT_FIELDS
+                          if result.get(name) is not None)
+            self._append(dict(id=entry, status='ok', result=values,
+                              time=time.time()))
+        return result
+
+    def unfinished(self):
+        """The logged writes that have no outcome yet, oldest first."""
+        with self._lock:
+            self._file.flush()
+        pending = collections.OrderedDict()
+        for entry in read_journal(self.path):
+            if 'operation' in entry:
+                pending[entry['id']] = entry
+            else:
+                pending.pop(entry['id'], None)
+        return pending.values()
+
+    def resume(self, window=None):
+        """Send the unfinished writes of JOURNAL_REPLAYABLE operations
+        again, `window` at a time, and mark any others uncertain.
+
+        Returns the number of writes per outcome. A write that again
+        gets no answer raises and stays unfinished for the next resume().
+        """
+        def replay(entry):
+            if entry['operation'] not in JOURNAL_REPLAYABLE:
+                self._append(dict(id=entry['id'], status='uncertain',
+                                  time=time.time()))
+                return 'uncertain'
+            # json gives back unicode, which urlencode can't take
+            parameters = dict((_utf8(name), _utf8(value)) for name, value
+                              in entry['parameters'].items())
+            _local.replaying = (self, entry['id'])
+            try:
+                call(str(entry['operation']), parameters)
+            except MTurkError, e:
+                if e.code in JOURNAL_DUPLICATE_CODES:
+                    return 'duplicate'
+                return 'error'
+            finally:
+                _local.replaying = None
+            return 'ok'
+
+        counts = dict(ok=0, error=0, duplicate=0, uncertain=0)
+        with self.client.activate():
+            results = prefetch(replay, self.unfinished(), window)
+            try:
+                for status in results:
+                    counts[status] += 1
+            finally:
+                results.close()
+        return counts
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+journal = None
+
+
+def enable_journal(path, sync=True):
+    global journal
+    disable_journal()
+    journal = Journal(path, sync)
+    return journal
+
+
+def disable_journal():
+    global journal
+    if journal is not None:
+        journal.close()
+    journal = None
+
+
+_local = threading.local()
+
+
+def call(operation, parameters=None, ResponseGroup=None, fields=None):
+    # send the request, parse the response and report any errors
+    default_group, default_fields = getattr(_local, 'projection', (None, None))
+    ResponseGroup = ResponseGroup or default_group
+    fields = fields or default_fields
+    if ResponseGroup:
+        parameters = dict(parameters or {})
+        parameters.update(response_group_parameters(ResponseGroup))
+    if fields is not None:
+        fields = frozenset(fields)
+    if not hooks:
+        return _call(operation, parameters, None, fields)
+    stats = _local.stats = CallStats(operation)
+    try:
+        return _call(operation, parameters, stats, fields)
+    except MTurkError, e:
+        stats.error = e.code
+        raise
+    except Exception, e:
+        stats.error = e.__class__.__name__
+        raise
+    finally:
+        _local.stats = None
+        stats.latency = time.time() - stats.start
+        for hook in list(hooks):
+            try:
+                hook.call_finished(stats)
+            except Exception:
+                # a broken metrics exporter must not fail the operation
+                pass
+
+
+def _call(operation, parameters, stats, fields=None):
+    client = current_client()
+    journal = client.journal
+    replaying = getattr(_local, 'replaying', None)
+    if replaying is not None:
+        journal = replaying[0]
+    elif journal is not None and operation_class(operation) == 'write':
+        parameters = journal.prepare(operation, parameters)
+    cache = client.cache
+    cache_parameters = parameters
+    if fields is not None:
+        # a projected result must not answer a call asking for more
+        cache_parameters = dict(parameters or {})
+        cache_parameters[' fields'] = ' '.join(sorted(fields))
+    if cache is not None:
+        result = cache.get(operation, cache_parameters)
+        if result is not None:
+            _local.result = result
+            if stats is not None:
+                stats.cached = True
+            return result
+        version = cache.version
+
+    def fetch():
+        result_xmlstr = req(operation, parameters)
+        start = time.time()
+        result = pp(result_xmlstr, fields)
+        if stats is not None:
+            stats.add('parse', time.time() - start)
+        return result
+
+    if journal is not None and operation_class(operation) == 'write':
+        send = fetch
+        fetch = lambda: journal.run(operation, parameters, send)
+    flights = client.single_flight
+    try:
+        if flights is None:
+            result = fetch()
+        else:
+            result, shared = flights.do(operation, cache_parameters, fetch)
+            if shared and stats is not None:
+                stats.coalesced = True
+        _local.result = result
+        errcheck(result, operation)
+    finally:
+        if cache is not None:
+            cache.invalidate(operation, parameters)
+    if cache is not None:
+        cache.put(operation, cache_parameters, result, version)
+    return result
+
+
+class projection(object):
+    """Apply a ResponseGroup and field projection to every call made
+    on this thread inside a with block, e.g.
+
+        with projection(['Minimal', 'HITDetail'], ['HITId', 'HITStatus']):
+            hits = SearchHITs()
+    """
+
+    def __init__(self, ResponseGroup=None, fields=None):
+        self.projection = (ResponseGroup, fields)
 
+    def __enter__(self):
+        self.previous = getattr(_local, 'projection', (None, None))
+        _local.projection = self.projection
+        return self
 
-def pp(string):
-    result_xml = xml.dom.minidom.parseString(string)
-    return result_xml
+    def __exit__(self, *exc_info):
+        _local.projection = self.previous
+
+
+def last_result():
+    # the Result of the most recent call made on this thread
+    return getattr(_local, 'result', None)
+
+
+# Instrumentation
+#
+# When any hooks are installed, every call() records a CallStats and
+# hands it to each hook's call_finished() once the call is over.
+PHASES = ('throttle', 'sign', 'encode', 'connect', 'wait', 'read', 'parse')
+
+# upper bounds, in seconds, of the latency histogram buckets
+HISTOGRAM_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5,
+                     1.0, 2.0, 5.0, 10.0, 30.0, 60.0)
+
+hooks = []
+
+
+class CallStats(object):
+    """Timings and sizes of one call, summed over its retries.
+
+    phases holds the seconds spent waiting on the rate limiter or backing
+    off (throttle), signing, urlencoding, connecting, waiting for the
+    response headers, reading the body and parsing it.
+    """
+
+    def __init__(self, operation):
+        self.operation = operation
+        self.start = time.time()
+        self.latency = 0.0
+        self.phases = dict.fromkeys(PHASES, 0.0)
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.retries = 0
+        self.error = None
+        self.cached = False
+        self.coalesced = False
+
+    def add(self, phase, seconds):
+        self.phases[phase] += seconds
+
+
+class Hook(object):
+    """Base class for instrumentation hooks."""
+
+    def call_finished(self, stats):
+        pass
+
+
+def add_hook(hook):
+    hooks.append(hook)
+    return hook
+
+
+def remove_hook(hook):
+    hooks.remove(hook)
+
+
+class Histogram(object):
+
+    def __init__(self, bounds=None):
+        self.bounds = bounds or HISTOGRAM_BUCKETS
+        self.counts = [0] * (len(self.bounds) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def percentile(self, p):
+        # upper bound of the bucket holding the p-th percentile
+        if not self.count:
+            return None
+        rank = p / 100.0 * self.count
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if seen >= rank:
+                return min(bound, self.max)
+        return self.max
+
+    def summary(self):
+        mean = None
+        if self.count:
+            mean = self.total / self.count
+        return dict(count=self.count, mean=mean, min=self.min, max=self.max,
+                    p50=self.percentile(50), p90=self.percentile(90),
+                    p99=self.percentile(99),
+                    buckets=zip(self.bounds + (None,), self.counts))
+
+
+class OperationStats(object):
+
+    def __init__(self):
+        self.calls = 0
+        self.cached = 0
+        self.coalesced = 0
+        self.retries = 0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.errors = collections.defaultdict(int)
+        self.latency = Histogram()
+        self.phases = dict((phase, Histogram()) for phase in PHASES)
+
+    def summary(self):
+        return dict(calls=self.calls, cached=self.cached,
+                    coalesced=self.coalesced,
+                    retries=self.retries, request_bytes=self.request_bytes,
+                    response_bytes=self.response_bytes,
+                    errors=dict(self.errors),
+                    latency=self.latency.summary(),
+                    phases=dict((phase, histogram.summary()) for
+                                phase, histogram in self.phases.items()))
+
+
+class Collector(Hook):
+    """In-memory hook keeping per-operation counters and histograms."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.operations = {}
+
+    def call_finished(self, stats):
+        with self._lock:
+            op = self.operations.get(stats.operation)
+            if op is None:
+                op = self.operations[stats.operation] = OperationStats()
+            op.calls += 1
+            op.retries += stats.retries
+            op.request_bytes += stats.request_bytes
+            op.response_bytes += stats.response_bytes
+            if stats.error is not None:
+                op.errors[stats.error] += 1
+            if stats.cached:
+                op.cached += 1
+            if stats.coalesced:
+                op.coalesced += 1
+                return
+            op.latency.add(stats.latency)
+            for phase, seconds in stats.phases.items():
+                op.phases[phase].add(seconds)
+
+    def summary(self):
+        with self._lock:
+            return dict((operation, op.summary()) for operation, op in
+                        self.operations.items())
+
+    def reset(self):
+        with self._lock:
+            self.operations = {}
 
 
 def GetAccountBalance():
-    result_xmlstr = req(operation='GetAccountBalance')
-    result_xml = pp(result_xmlstr)
-    errors = errcheck(result_xml)
-    availbalance_nodes = result_xml.getElementsByTagName('AvailableBalance')
-    if availbalance_nodes:
-        print("Available balance: " +
-              availbalance_nodes[0].getElementsByTagName('FormattedPrice')[0].childNodes[0].data)
-    return availbalance_nodes[0].getElementsByTagName('FormattedPrice')[0].childNodes[0].data
+    result = call('GetAccountBalance')
+    balance = result.get('AvailableBalance.FormattedPrice')
+    if balance is not None:
+        print("Available balance: " + balance)
+    return balance
 
 
 def UpdateQualificationScore(SubjectId=None, IntegerValue=70,
@@ -116,10 +1783,8 @@ def UpdateQualificationScore(SubjectId=None, IntegerValue=70,
         'SubjectId': SubjectId,
         'IntegerValue': IntegerValue,
     }
-    result_xmlstr = req(operation='UpdateQualificationScore', args=parameters)
-    result_xml = pp(result_xmlstr)
-    errors = errcheck(result_xml)
-    isvalid = result_xml.childNodes[0].getElementsByTagName('IsValid')[0].childNodes[0].data
+    result = call('UpdateQualificationScore', parameters)
+    isvalid = result.get('IsValid')
     return isvalid
 
 
@@ -142,12 +1807,10 @@ def CreateQualificationType(Name, Description, QualificationTypeStatus='Active',
         'AutoGranted': AutoGranted,
         'AutoGrantedValue': AutoGrantedValue,
     }
-    result_xmlstr = req(operation='CreateQualificationType',  args=parameters)
-    result_xml = pp(result_xmlstr)
-    errors = errcheck(result_xml)
+    result = call('CreateQualificationType', parameters)
 
     # get unique qualification id and return it
-    QualificationTypeId = result_xml.getElementsByTagName('QualificationTypeId')[0].childNodes[0].data
+    QualificationTypeId = result.get('QualificationTypeId')
     return dict(QualificationTypeId=QualificationTypeId)
 
 
@@ -156,49 +1819,30 @@ def GetReviewableHITs(PageSize=100, PageNumber=1):
         'PageSize': PageSize,
         'PageNumber': PageNumber,
     }
-    result_xmlstr = req(operation='GetReviewableHITs',  args=parameters)
-    result_xml = pp(result_xmlstr)
-    errors = errcheck(result_xml)
-    node_hits = result_xml.getElementsByTagName('HITId')
-    HIT = []
-    for i in node_hits:
-        HIT.append(i.childNodes[0].nodeValue)
-    TotalNumResults = result_xml.getElementsByTagName('TotalNumResults')[0].childNodes[0].data
+    result = call('GetReviewableHITs', parameters)
+    HIT = [hit['HITId'] for hit in result.all('HIT')]
+    TotalNumResults = result.get('TotalNumResults')
     return dict(TotalNumResults=TotalNumResults, HIT=HIT)
 
 
-def GetAssignmentsForHIT(HITId, PageSize=100, PageNumber=1):
+def GetAssignmentsForHIT(HITId, PageSize=100, PageNumber=1,
+                         ResponseGroup=None, fields=None):
     parameters = {
         'HITId': HITId,
         'PageSize': PageSize,
         'PageNumber': PageNumber,
     }
-    result_xmlstr = req(operation='GetAssignmentsForHIT',  args=parameters)
-    result_xml = pp(result_xmlstr)
-    errors = errcheck(result_xml)
-    AssignmentId = result_xml.getElementsByTagName('AssignmentId')
-    WorkerId = result_xml.getElementsByTagName('WorkerId')
-    AssignmentStatus = result_xml.getElementsByTagName('AssignmentStatus')
-    Assignment = []
-    for i in range(len(AssignmentId)):
-        Assignment.append(
-            {'AssignmentId': AssignmentId[i].childNodes[0].data,
-             'AssignmentStatus': AssignmentStatus[i].childNodes[0].data,
-             'WorkerId': WorkerId[i].childNodes[0].data}
-            )
-    return Assignment
+    result = call('GetAssignmentsForHIT', parameters, ResponseGroup, fields)
+    return result.all('Assignment')
 
 
 def ApproveAssignment(AssignmentId):
     parameters = {
         'AssignmentId': AssignmentId,
     }
-    result_xmlstr = req(operation='ApproveAssignment',  args=parameters)
-    print result_xmlstr
-    result_xml = pp(result_xmlstr)
-    errors = errcheck(result_xml)
-    isvalid = result_xml.childNodes[0].getElementsByTagName('IsValid')[0].childNodes[0].data
-    return result_xml
+    result = call('ApproveAssignment', parameters)
+    isvalid = result.get('IsValid')
+    return result
 
 
 def AssignQualification(
@@ -210,14 +1854,12 @@ def AssignQualification(
         'QualificationTypeId': QualificationTypeId,
         'WorkerId': WorkerId,
     }
-    if IntegerValue:
+    if IntegerValue is not None:
         parameters['IntegerValue'] = IntegerValue
     if SendNotification:
         parameters['SendNotification'] = SendNotification
-    result_xmlstr = req(operation='AssignQualification',  args=parameters)
-    result_xml = pp(result_xmlstr)
-    errors = errcheck(result_xml)
-    isvalid = result_xml.childNodes[0].getElementsByTagName('IsValid')[0].childNodes[0].data
+    result = call('AssignQualification', parameters)
+    isvalid = result.get('IsValid')
     return dict(isvalid=isvalid)
 
 
@@ -225,30 +1867,22 @@ def DisposeHIT(HITId):
     parameters = {
         'HITId': HITId,
     }
-    result_xmlstr = req(operation='DisposeHIT', args=parameters)
-    result_xml = pp(result_xmlstr)
-    errors = errcheck(result_xml)
-    isvalid = result_xml.childNodes[0].getElementsByTagName('IsValid')[0].childNodes[0].data
+    result = call('DisposeHIT', parameters)
+    isvalid = result.get('IsValid')
     return dict(isvalid=isvalid)
 
 
-def GetHIT(HITId):
+def GetHIT(HITId, ResponseGroup=None, fields=None):
     parameters = {
         'HITId': HITId,
     }
-    result_xmlstr = req(operation='GetHIT', args=parameters)
-    result_xml = pp(result_xmlstr)
-    errors = errcheck(result_xml)
-    AssignmentDurationInSeconds = result_xml.childNodes[0].\
-        getElementsByTagName('AssignmentDurationInSeconds')[0].childNodes[0].data
-    HITReviewStatus = result_xml.childNodes[0].\
-        getElementsByTagName('HITReviewStatus')[0].childNodes[0].data
-    CreationTime = result_xml.childNodes[0].\
-        getElementsByTagName('CreationTime')[0].childNodes[0].data
-    HITStatus = result_xml.childNodes[0].\
-        getElementsByTagName('HITStatus')[0].childNodes[0].data
-    Reward = result_xml.childNodes[0].getElementsByTagName('Reward')[0].\
-        childNodes[0].childNodes[0].data
+    result = call('GetHIT', parameters, ResponseGroup, fields)
+    hit = result.first('HIT')
+    AssignmentDurationInSeconds = hit.get('AssignmentDurationInSeconds')
+    HITReviewStatus = hit.get('HITReviewStatus')
+    CreationTime = hit.get('CreationTime')
+    HITStatus = hit.get('HITStatus')
+    Reward = hit.get('Reward.Amount')
     return dict(AssignmentDurationInSeconds=AssignmentDurationInSeconds,
                 HITReviewStatus=HITReviewStatus,
                 CreationTime=CreationTime,
@@ -261,10 +1895,8 @@ def SetHITAsReviewing(HITId, Revert=False):
         'HITId': HITId,
         'Revert': Revert,
     }
-    result_xmlstr = req(operation='SetHITAsReviewing', args=parameters)
-    result_xml = pp(result_xmlstr)
-    errors = errcheck(result_xml)
-    isvalid = result_xml.childNodes[0].getElementsByTagName('IsValid')[0].childNodes[0].data
+    result = call('SetHITAsReviewing', parameters)
+    isvalid = result.get('IsValid')
     return dict(isvalid=isvalid)
 
 
@@ -275,10 +1907,8 @@ def BlockWorker(WorkerId, Reason=None):
         'WorkerId': WorkerId,
         'Reason': Reason,
     }
-    result_xmlstr = req(operation='BlockWorker', args=parameters)
-    result_xml = pp(result_xmlstr)
-    errors = errcheck(result_xml)
-    isvalid = result_xml.childNodes[0].getElementsByTagName('IsValid')[0].childNodes[0].data
+    result = call('BlockWorker', parameters)
+    isvalid = result.get('IsValid')
     return dict(isvalid=isvalid)
 
 
@@ -289,23 +1919,19 @@ def UnblockWorker(WorkerId, Reason=None):
         'WorkerId': WorkerId,
         'Reason': Reason,
     }
-    result_xmlstr = req(operation='UnblockWorker', args=parameters)
-    result_xml = pp(result_xmlstr)
-    errors = errcheck(result_xml)
-    isvalid = result_xml.childNodes[0].getElementsByTagName('IsValid')[0].childNodes[0].data
+    result = call('UnblockWorker', parameters)
+    isvalid = result.get('IsValid')
     return dict(isvalid=isvalid)
 
 
 def ChangeHITTypeOfHIT(HITId, HITTypeId):
     # HITTypeId, the ID of the new HIT type
     parameters = {
-        'HITId': HITTypeId,
+        'HITId': HITId,
         'HITTypeId': HITTypeId,
     }
-    result_xmlstr = req(operation='ChangeHITTypeOfHIT', args=parameters)
-    result_xml = pp(result_xmlstr)
-    errors = errcheck(result_xml)
-    isvalid = result_xml.childNodes[0].getElementsByTagName('IsValid')[0].childNodes[0].data
+    result = call('ChangeHITTypeOfHIT', parameters)
+    isvalid = result.get('IsValid')
     return dict(isvalid=isvalid)
 
 
@@ -314,46 +1940,41 @@ def CreateHIT(HITTypeId=None, Question=None, LifetimeInSeconds=60*60*24*2,
               MaxAssignments=None, RequesterAnnotation=None, Title="test01",
               Description="test01",  Reward=0.01, AssignmentDurationInSeconds=3600,
               AutoApprovalDelayInSeconds=12*60*60, Keywords=None,
-              QualificationRequirement=None):
+              QualificationRequirement=None, UniqueRequestToken=None):
     parameters = {
         'Question': Question,
         'LifetimeInSeconds': LifetimeInSeconds,
-        'Title': Title,
-        'Description': Description,
-        'Reward.1.Amount': Reward,
-        'Reward.1.CurrencyCode': 'USD',
-        'AssignmentDurationInSeconds': AssignmentDurationInSeconds,
     }
     #optionsal parameters
-    if HITTypeId:
-        parameters['HITTypeId'] = HITTypeId
+    if UniqueRequestToken:
+        parameters['UniqueRequestToken'] = UniqueRequestToken
     if MaxAssignments:
         parameters['MaxAssignments'] = MaxAssignments
     if RequesterAnnotation:
         parameters['RequesterAnnotation'] = RequesterAnnotation
-    if Keywords:
-        parameters['Keywords']=Keywords
-    #QualificationRequirement is a list of dictionaries
-    if QualificationRequirement:
-          for i in range(len(QualificationRequirement)):
-                parameters['QualificationRequirement.' + str(i+1) + '.QualificationTypeId']=\
-                                             QualificationRequirement[i]['QualificationTypeId']
-                parameters['QualificationRequirement.' + str(i+1) + '.Comparator']=\
-                                             QualificationRequirement[i]['Comparator']
-                if QualificationRequirement[i]['IntegerValue']:
-                    parameters['QualificationRequirement.' + str(i+1) + '.IntegerValue']=\
-                                                 QualificationRequirement[i]['IntegerValue']
-                if QualificationRequirement[i]['LocaleValue']:
-                    parameters['QualificationRequirement.' + str(i+1) + '.LocaleValue.Country']=\
-                                                 QualificationRequirement[i]['LocaleValue']
-    if AutoApprovalDelayInSeconds:
-        parameters['AutoApprovalDelayInSeconds']=AutoApprovalDelayInSeconds
-    result_xmlstr = req(operation='CreateHIT', args=parameters)
-    result_xml = pp(result_xmlstr)
-    errors = errcheck(result_xml)
-    isvalid = result_xml.childNodes[0].getElementsByTagName('IsValid')[0].childNodes[0].data
-    HITId = result_xml.childNodes[0].getElementsByTagName('HITId')[0].childNodes[0].data
-    HITTypeId = result_xml.childNodes[0].getElementsByTagName('HITTypeId')[0].childNodes[0].data
+    if HITTypeId:
+        # the HIT type already carries title, reward, qualifications, ...
+        parameters['HITTypeId'] = HITTypeId
+    else:
+        parameters.update({
+            'Title': Title,
+            'Description': Description,
+            'Reward.1.Amount': Reward,
+            'Reward.1.CurrencyCode': 'USD',
+            'AssignmentDurationInSeconds': AssignmentDurationInSeconds,
+        })
+        if Keywords:
+            parameters['Keywords']=Keywords
+        #QualificationRequirement is a list of dictionaries
+        if QualificationRequirement:
+            parameters.update(qualification_parameters(
+                QualificationRequirement))
+        if AutoApprovalDelayInSeconds:
+            parameters['AutoApprovalDelayInSeconds']=AutoApprovalDelayInSeconds
+    result = call('CreateHIT', parameters)
+    isvalid = result.get('IsValid')
+    HITId = result.get('HITId')
+    HITTypeId = result.get('HITTypeId')
     return dict(isvalid=isvalid, HITId=HITId, HITTypeID=HITTypeId)
 
 
@@ -362,10 +1983,8 @@ def DisableHIT(HITId):
     parameters = {
         'HITId': HITId,
     }
-    result_xmlstr = req(operation='DisableHIT', args=parameters)
-    result_xml = pp(result_xmlstr)
-    errors = errcheck(result_xml)
-    isvalid = result_xml.childNodes[0].getElementsByTagName('IsValid')[0].childNodes[0].data
+    result = call('DisableHIT', parameters)
+    isvalid = result.get('IsValid')
     return dict(isvalid=isvalid)
 
 
@@ -374,28 +1993,26 @@ def DisposeQualificationType(QualificationTypeId):
     parameters = {
         'QualificationTypeId': QualificationTypeId,
     }
-    result_xmlstr = req(operation='DisposeQualificationType', args=parameters)
-    result_xml = pp(result_xmlstr)
-    errors = errcheck(result_xml)
-    isvalid = result_xml.childNodes[0].getElementsByTagName('IsValid')[0].childNodes[0].data
+    result = call('DisposeQualificationType', parameters)
+    isvalid = result.get('IsValid')
     return dict(isvalid=isvalid)
 
 
 def ExtendHIT(HITId, MaxAssignmentsIncrement=None,
-              ExpirationIncrementInSeconds=None):
+              ExpirationIncrementInSeconds=None, UniqueRequestToken=None):
    #required parameters
     parameters = {
         'HITId': HITId,
     }
+    if UniqueRequestToken:
+        parameters['UniqueRequestToken'] = UniqueRequestToken
     #optionsal parameters
     if MaxAssignmentsIncrement:
         parameters['MaxAssignmentsIncrement'] = MaxAssignmentsIncrement
     if ExpirationIncrementInSeconds:
         parameters['ExpirationIncrementInSeconds'] = ExpirationIncrementInSeconds
-    result_xmlstr = req(operation='ExtendHIT',  args=parameters)
-    result_xml = pp(result_xmlstr)
-    errors = errcheck(result_xml)
-    isvalid = result_xml.childNodes[0].getElementsByTagName('IsValid')[0].childNodes[0].data
+    result = call('ExtendHIT', parameters)
+    isvalid = result.get('IsValid')
     return dict(isvalid=isvalid)
 
 
@@ -403,10 +2020,8 @@ def ForceExpireHIT(HITId):
     parameters = {
         'HITId': HITId,
     }
-    result_xmlstr = req(operation='ForceExpireHIT', args=parameters)
-    result_xml = pp(result_xmlstr)
-    errors = errcheck(result_xml)
-    isvalid = result_xml.childNodes[0].getElementsByTagName('IsValid')[0].childNodes[0].data
+    result = call('ForceExpireHIT', parameters)
+    isvalid = result.get('IsValid')
     return dict(isvalid=isvalid)
 
 
@@ -415,27 +2030,25 @@ def GetBonusPayments(HITId=None, AssignmentId=None,
                      PageSize=100, PageNumber=1):
     #function needs HITId or AssignmentId
     parameters = {
+        'PageSize': PageSize,
+        'PageNumber': PageNumber,
     }
     if HITId:
           parameters['HITId'] = HITId
     elif AssignmentId != None:
           parameters['AssignmentId'] = AssignmentId
-    result_xmlstr = req(operation='GetBonusPayments', args=parameters)
-    result_xml = pp(result_xmlstr)
-    errors = errcheck(result_xml)
-    return dict(result_xmlstr=result_xmlstr)
+    result = call('GetBonusPayments', parameters)
+    return dict(result_xmlstr=result.xmlstr)
 
 
-# todo: need to test and finish parsing response
 def GetFileUploadURL(AssignmentId,QuestionIdentifier):
+    # the url is only valid for about a minute, see download_files
     parameters = {
         'AssignmentId': AssignmentId,
         'QuestionIdentifier':  QuestionIdentifier,
     }
-    result_xmlstr = req(operation='GetFileUploadURL', args=parameters)
-    result_xml = pp(result_xmlstr)
-    errors = errcheck(result_xml)
-    return result_xmlstr
+    result = call('GetFileUploadURL', parameters)
+    return result.get('FileUploadURL')
 
 
 # todo: need to finish parsing reponse
@@ -443,11 +2056,11 @@ def GetHITsForQualificationType(QualificationTypeId, PageSize=100,
                                 PageNumber=1):
     parameters = {
         'QualificationTypeId': QualificationTypeId,
+        'PageSize': PageSize,
+        'PageNumber': PageNumber,
     }
-    result_xmlstr = req(operation='GetHITsForQualificationType', args=parameters)
-    result_xml = pp(result_xmlstr)
-    errors = errcheck(result_xml)
-    return result_xmlstr
+    result = call('GetHITsForQualificationType', parameters)
+    return result.xmlstr
 
 
 # todo: need to finish parsing response
@@ -455,16 +2068,17 @@ def GetQualificationsForQualificationType(QualificationTypeId, Status=None,
                                           PageSize=100, PageNumber =1):
     parameters = {
         'QualificationTypeId': QualificationTypeId,
+        'PageSize': PageSize,
+        'PageNumber': PageNumber,
     }
     # optionsal parameters
     if Status:
         parameters['Status'] = Status
-    result_xmlstr = req(operation='GetQualificationsForQualificationType',
-                        args=parameters)
-    result_xml = pp(result_xmlstr)
-    errors = errcheck(result_xml)
-    isvalid = result_xml.childNodes[0].getElementsByTagName('IsValid')[0].childNodes[0].data
-    return dict(isvalid=isvalid, result_xmlstr=result_xmlstr)
+    result = call('GetQualificationsForQualificationType', parameters)
+    isvalid = result.get('IsValid')
+    return dict(isvalid=isvalid, result_xmlstr=result.xmlstr,
+                TotalNumResults=result.get('TotalNumResults'),
+                Qualification=result.all('Qualification'))
 
 
 # todo need to finish parsing response 
@@ -483,11 +2097,9 @@ def GetQualificationRequests(QualificationTypeId=None, SortProperty=None,
         parameters['SortDirection'] = SortDirection
     if SortDirection:
         parameters['SortDirection'] = SortDirection
-    result_xmlstr = req(operation='GetQualificationRequests', args=parameters)
-    result_xml = pp(result_xmlstr)
-    errors = errcheck(result_xml)
-    isvalid = result_xml.childNodes[0].getElementsByTagName('IsValid')[0].childNodes[0].data
-    return dict(isvalid=isvalid, result_xmlstr=result_xmlstr)
+    result = call('GetQualificationRequests', parameters)
+    isvalid = result.get('IsValid')
+    return dict(isvalid=isvalid, result_xmlstr=result.xmlstr)
 
 
 def GetQualificationScore(QualificationTypeId, SubjectId):
@@ -495,10 +2107,8 @@ def GetQualificationScore(QualificationTypeId, SubjectId):
         'QualificationTypeId': QualificationTypeId,
         'SubjectId': SubjectId,
     }
-    result_xmlstr = req(operation='GetQualificationScore', args=parameters)
-    result_xml = pp(result_xmlstr)
-    errors = errcheck(result_xml)
-    IntegerValue = result_xml.childNodes[0].getElementsByTagName('IntegerValue')[0].childNodes[0].data
+    result = call('GetQualificationScore', parameters)
+    IntegerValue = result.first('Qualification')['IntegerValue']
     return dict(IntegerValue=IntegerValue)
 
 
@@ -507,10 +2117,8 @@ def GetQualificationType(QualificationTypeId):
     parameters = {
         'QualificationTypeId': QualificationTypeId,
     }
-    result_xmlstr = req(operation='GetQualificationType', args=parameters)
-    result_xml = pp(result_xmlstr)
-    errors = errcheck(result_xml)
-    return dict(result_xmlstr=result_xmlstr)
+    result = call('GetQualificationType', parameters)
+    return dict(result_xmlstr=result.xmlstr)
 
 
 # todo to parse response and test
@@ -523,13 +2131,12 @@ def GetRequesterStatistic(Statistic, TimePeriod='OneDay', Count=1):
     }
     if TimePeriod == "OneDay":
         parameters['Count']=Count
-    result_xmlstr = req(operation='GetRequesterStatistic', args=parameters)
-    result_xml = pp(result_xmlstr)
-    errors = errcheck(result_xml)
-    return dict(result_xmlstr=result_xmlstr)
+    result = call('GetRequesterStatistic', parameters)
+    return dict(result_xmlstr=result.xmlstr)
 
 
-def GrantBonus(WorkerId, AssignmentId, BonusAmount=0.05, Reason="gave 110%"):
+def GrantBonus(WorkerId, AssignmentId, BonusAmount=0.05, Reason="gave 110%",
+               UniqueRequestToken=None):
     parameters = {
         'WorkerId': WorkerId,
         'AssignmentId': AssignmentId, 
@@ -537,10 +2144,10 @@ def GrantBonus(WorkerId, AssignmentId, BonusAmount=0.05, Reason="gave 110%"):
         'BonusAmount.1.CurrencyCode': 'USD',
         'Reason': Reason,
     }
-    result_xmlstr = req(operation='GrantBonus', args=parameters)
-    result_xml = pp(result_xmlstr)
-    errors = errcheck(result_xml)
-    isvalid = result_xml.childNodes[0].getElementsByTagName('IsValid')[0].childNodes[0].data
+    if UniqueRequestToken:
+        parameters['UniqueRequestToken'] = UniqueRequestToken
+    result = call('GrantBonus', parameters)
+    isvalid = result.get('IsValid')
     return dict(isvalid=isvalid)
 
 
@@ -550,10 +2157,8 @@ def GrantQualification(QualificationRequestId, IntegerValue=1):
         'QualificationRequestId': QualificationRequestId,
         'IntegerValue': IntegerValue, 
     }
-    result_xmlstr = req(operation='GrantQualification', args=parameters)
-    result_xml = pp(result_xmlstr)
-    errors = errcheck(result_xml)
-    isvalid = result_xml.childNodes[0].getElementsByTagName('IsValid')[0].childNodes[0].data
+    result = call('GrantQualification', parameters)
+    isvalid = result.get('IsValid')
     return dict(isvalid=isvalid)
 
 
@@ -566,10 +2171,8 @@ def NotifyWorkers(Subject, MessageText, WorkerId):
     }
     for i in range(len(WorkerId)):
            parameters['WorkerId.'+str(i+1)] = WorkerId[i]
-    result_xmlstr = req(operation = 'NotifyWorkers',  args = parameters)
-    result_xml = pp(result_xmlstr)
-    errors = errcheck(result_xml)
-    isvalid = result_xml.childNodes[0].getElementsByTagName('IsValid')[0].childNodes[0].data
+    result = call('NotifyWorkers', parameters)
+    isvalid = result.get('IsValid')
     return dict(isvalid=isvalid)
 
 
@@ -589,14 +2192,13 @@ def RegisterHITType(Title="Complete a survey",
         if Keywords:
             parameters['Keywords'] = Keywords
         if QualificationRequirement:
-            parameters['QualificationRequirement'] = QualificationRequirement
+            parameters.update(qualification_parameters(
+                QualificationRequirement))
         if AutoApprovalDelayInSeconds:
             parameters['AutoApprovalDelayInSeconds'] = AutoApprovalDelayInSeconds
-        result_xmlstr = req(operation='RegisterHITType', args=parameters)
-        result_xml = pp(result_xmlstr)
-        errors = errcheck(result_xml)
-        isvalid = result_xml.childNodes[0].getElementsByTagName('IsValid')[0].childNodes[0].data
-        HITTypeId = result_xml.childNodes[0].getElementsByTagName('HITTypeId')[0].childNodes[0].data
+        result = call('RegisterHITType', parameters)
+        isvalid = result.get('IsValid')
+        HITTypeId = result.get('HITTypeId')
         return dict(isvalid=isvalid, HITTypeID=HITTypeId)
 
 
@@ -607,10 +2209,8 @@ def RejectAssignment(AssignmentId, RequesterFeedback=None):
     }
     if RequesterFeedback:
          parameters['RequesterFeedback']=RequesterFeedback
-    result_xmlstr = req(operation = 'RejectAssignment',  args = parameters)
-    result_xml = pp(result_xmlstr)
-    errors = errcheck(result_xml)
-    isvalid = result_xml.childNodes[0].getElementsByTagName('IsValid')[0].childNodes[0].data
+    result = call('RejectAssignment', parameters)
+    isvalid = result.get('IsValid')
     return dict(isvalid = isvalid)
 
 
@@ -622,11 +2222,8 @@ def RejectQualificationRequest(QualificationRequestId, Reason=None):
     }
     if Reason:
          parameters['Reason'] = Reason
-    result_xmlstr = req(operation='RejectQualificationRequest',
-                        args=parameters)
-    result_xml = pp(result_xmlstr)
-    errors = errcheck(result_xml)
-    isvalid = result_xml.childNodes[0].getElementsByTagName('IsValid')[0].childNodes[0].data
+    result = call('RejectQualificationRequest', parameters)
+    isvalid = result.get('IsValid')
     return dict(isvalid = isvalid)
 
 
@@ -639,30 +2236,21 @@ def RevokeQualification(SubjectId, QualificationTypeId, Reason=None):
     if Reason:
          #Reason = urllib.quote(Reason)
          parameters['Reason'] = Reason
-    result_xmlstr = req(operation='RevokeQualification', args=parameters)
-    result_xml = pp(result_xmlstr)
-    errors = errcheck(result_xml)
-    isvalid = result_xml.childNodes[0].getElementsByTagName('IsValid')[0].childNodes[0].data
+    result = call('RevokeQualification', parameters)
+    isvalid = result.get('IsValid')
     return dict(isvalid=isvalid)
 
 
 def SearchHITs(PageSize=100, PageNumber=1, SortDirection='Descending',
-               SortProperty='Expiration'):
+               SortProperty='Expiration', ResponseGroup=None, fields=None):
     parameters = {
         'PageSize' : PageSize,
         'PageNumber' : PageNumber,
         'SortDirection' : SortDirection,
         'SortProperty' : SortProperty
     }
-    result_xmlstr = req(operation='SearchHITs', args=parameters)
-    result_xml = pp(result_xmlstr)
-    errors = errcheck(result_xml)
-    HIT = []
-    for i in range(len(result_xml.childNodes[0].getElementsByTagName('HITId'))):
-               HIT.append({'HITId' : result_xml.childNodes[0].getElementsByTagName('HITId')[i].childNodes[0].data,\
-                            'CreationTime': result_xml.childNodes[0].getElementsByTagName('CreationTime')[i].childNodes[0].data,
-                            'MaxAssignments':result_xml.childNodes[0].getElementsByTagName('MaxAssignments')[i].childNodes[0].data})
-    return HIT
+    result = call('SearchHITs', parameters, ResponseGroup, fields)
+    return result.all('HIT')
 
 
 #need to test and parse response
@@ -681,11 +2269,39 @@ def SearchQualificationTypes(Query=None, SortProperty=None, SortDirection=None,
         parameters['SortProperty'] = SortProperty
     if SortDirection:
         parameters['SortDirection'] = SortDirection
-    result_xmlstr = req(operation='SearchQualificationTypes', args=parameters)
-    result_xml = pp(result_xmlstr)
-    errors = errcheck(result_xml)
-    isvalid = result_xml.childNodes[0].getElementsByTagName('IsValid')[0].childNodes[0].data
-    return dict(isvalid=isvalid, result_xmlstr=result_xmlstr)
+    result = call('SearchQualificationTypes', parameters)
+    isvalid = result.get('IsValid')
+    return dict(isvalid=isvalid, result_xmlstr=result.xmlstr)
+
+
+def SendTestEventNotification(Destination, TestEventType='Ping',
+                              EventType=None, Transport='REST'):
+    # Destination is the url (or email address) the test event is sent to
+    parameters = {
+        'TestEventType': TestEventType,
+    }
+    parameters.update(notification_parameters(Destination, EventType,
+                                              Transport))
+    result = call('SendTestEventNotification', parameters)
+    isvalid = result.get('IsValid')
+    return dict(isvalid=isvalid)
+
+
+def SetHITTypeNotification(HITTypeId, Destination=None, EventType=None,
+                           Transport='REST', Active=None):
+    # without a Destination only the Active flag of the existing
+    # notification is changed
+    parameters = {
+        'HITTypeId': HITTypeId,
+    }
+    if Destination:
+        parameters.update(notification_parameters(Destination, EventType,
+                                                  Transport))
+    if Active is not None:
+        parameters['Active'] = Active and 'true' or 'false'
+    result = call('SetHITTypeNotification', parameters)
+    isvalid = result.get('IsValid')
+    return dict(isvalid=isvalid)
 
 
 #need to test, update parsing response, fix request for AnswerKey, Test
@@ -710,13 +2326,27 @@ def UpdateQualificationType(QualificationTypeId, RetryDelayInSeconds=None,
                 parameters['TestDurationInSeconds'] = TestDurationInSeconds
             if AutoGranted:
                 parameters['AutoGranted'] = AutoGranted
-            result_xmlstr = req(operation='UpdateQualificationType', args=parameters)
-            result_xml = pp(result_xmlstr)
-            errors = errcheck(result_xml)
-            isvalid = result_xml.childNodes[0].getElementsByTagName('IsValid')[0].childNodes[0].data
-            return dict(isvalid = isvalid,  result_xmlstr=result_xmlstr)
+            result = call('UpdateQualificationType', parameters)
+            isvalid = result.get('IsValid')
+            return dict(isvalid = isvalid,  result_xmlstr=result.xmlstr)
+
+
+# every AWS operation implemented above, in definition order
+OPERATIONS = (
+    'GetAccountBalance', 'UpdateQualificationScore', 'CreateQualificationType',
+    'GetReviewableHITs', 'GetAssignmentsForHIT', 'ApproveAssignment',
+    'AssignQualification', 'DisposeHIT', 'GetHIT', 'SetHITAsReviewing',
+    'BlockWorker', 'UnblockWorker', 'ChangeHITTypeOfHIT', 'CreateHIT',
+    'DisableHIT', 'DisposeQualificationType', 'ExtendHIT', 'ForceExpireHIT',
+    'GetBonusPayments', 'GetFileUploadURL', 'GetHITsForQualificationType',
+    'GetQualificationsForQualificationType', 'GetQualificationRequests',
+    'GetQualificationScore', 'GetQualificationType', 'GetRequesterStatistic',
+    'GrantBonus', 'GrantQualification', 'NotifyWorkers', 'RegisterHITType',
+    'RejectAssignment', 'RejectQualificationRequest', 'RevokeQualification',
+    'SearchHITs', 'SearchQualificationTypes', 'SendTestEventNotification',
+    'SetHITTypeNotification', 'UpdateQualificationType',
+)
 
-#todo: add functions SetHITTypeNotification, SendTestEventNotification
 #all functions below here not in AWS API
 
 # creates Question data 
@@ -733,3 +2363,1208 @@ def externalQuestion(url, frame_height=None):
 def genQual(QualificationTypeId, Comparator='GreaterThan', IntegerValue=50):
            return [dict(QualificationTypeId=QualificationTypeId,
                         Comparator=Comparator, IntegerValue=IntegerValue)]
+
+
+#expand a list of qualification dicts into request parameters
+def qualification_parameters(QualificationRequirement):
+    parameters = {}
+    for i, requirement in enumerate(QualificationRequirement):
+        prefix = 'QualificationRequirement.%d.' % (i + 1)
+        parameters[prefix + 'QualificationTypeId'] = \
+            requirement['QualificationTypeId']
+        parameters[prefix + 'Comparator'] = requirement['Comparator']
+        if requirement.get('IntegerValue'):
+            parameters[prefix + 'IntegerValue'] = requirement['IntegerValue']
+        if requirement.get('LocaleValue'):
+            parameters[prefix + 'LocaleValue.Country'] = \
+                requirement['LocaleValue']
+    return parameters
+
+
+#ResponseGroup.N parameters for a response group name or list of names
+def response_group_parameters(ResponseGroup):
+    if isinstance(ResponseGroup, basestring):
+        ResponseGroup = [ResponseGroup]
+    return dict(('ResponseGroup.%d' % i, group)
+                for i, group in enumerate(ResponseGroup))
+
+
+#Notification parameters for SetHITTypeNotification
+def notification_parameters(Destination, EventType=None, Transport='REST'):
+    parameters = {
+        'Notification.1.Destination': Destination,
+        'Notification.1.Transport': Transport,
+        'Notification.1.Version': NOTIFICATION_VERSION,
+    }
+    if isinstance(EventType, basestring):
+        EventType = [EventType]
+    for i, event_type in enumerate(EventType or NOTIFICATION_EVENT_TYPES):
+        parameters['Notification.1.EventType.%d' % (i + 1)] = event_type
+    return parameters
+
+
+# Paginated iteration
+class prefetch(object):
+    """Iterate over function(item) for every item, in order.
+
+    Worker threads start immediately and compute up to `window` items
+    ahead of the consumer, so the caller can process one result while
+    the next ones are still in flight. An exception raised by function
+    is re-raised when its item is reached. close() stops the workers.
+    """
+
+    def __init__(self, function, items, window=None):
+        self.function = function
+        self.items = list(items)
+        self.window = window or PREFETCH_WINDOW
+        self.client = current_client()
+        self._results = {}
+        self._next = 0
+        self._consumed = 0
+        self._stop = False
+        self._cond = threading.Condition()
+        for i in range(min(self.window, len(self.items))):
+            thread = threading.Thread(target=self._work)
+            thread.daemon = True
+            thread.start()
+
+    def _work(self):
+        with self.client.activate():
+            self._fetch()
+
+    def _fetch(self):
+        cond = self._cond
+        while True:
+            with cond:
+                while (not self._stop and self._next < len(self.items) and
+                       self._next >= self._consumed + self.window):
+                    cond.wait()
+                if self._stop or self._next >= len(self.items):
+                    return
+                i = self._next
+                self._next += 1
+            try:
+                value = (True, self.function(self.items[i]))
+            except Exception:
+                value = (False, sys.exc_info())
+            with cond:
+                self._results[i] = value
+                cond.notify_all()
+
+    def __iter__(self):
+        return self
+
+    def next(self):
+        i = self._consumed
+        if i >= len(self.items) or self._stop:
+            self.close()
+            raise StopIteration
+        with self._cond:
+            while i not in self._results:
+                self._cond.wait()
+            ok, value = self._results.pop(i)
+            self._consumed = i + 1
+            self._cond.notify_all()
+        if not ok:
+            self.close()
+            raise value[0], value[1], value[2]
+        return value
+
+    def close(self):
+        with self._cond:
+            self._stop = True
+            self._results.clear()
+            self._cond.notify_all()
+
+
+def iter_pages(operation, parameters, tag, PageSize=100, window=None,
+               ResponseGroup=None, fields=None):
+    """Yield the `tag` records of every page of a paged operation.
+
+    The first page is fetched directly; its TotalNumResults decides how
+    many more pages there are, and those are fetched concurrently by
+    prefetch() while the first page is being consumed.
+    """
+    client = current_client()
+
+    def fetch(PageNumber):
+        page_parameters = dict(parameters)
+        page_parameters['PageSize'] = PageSize
+        page_parameters['PageNumber'] = PageNumber
+        return client.call(operation, page_parameters, ResponseGroup,
+                           fields)
+
+    return _iter_pages(client, fetch, tag, PageSize, window)
+
+
+def _iter_pages(client, fetch, tag, PageSize, window):
+    first = fetch(1)
+    total = int(first.get('TotalNumResults') or 0)
+    pages = range(2, (total + PageSize - 1) // PageSize + 1)
+    with client.activate():
+        rest = prefetch(fetch, pages, window)
+    try:
+        for record in first.all(tag):
+            yield record
+        first = None
+        for result in rest:
+            for record in result.all(tag):
+                yield record
+    finally:
+        rest.close()
+
+
+def iter_reviewable_hits(PageSize=100, window=None):
+    return iter_pages('GetReviewableHITs', {}, 'HIT', PageSize, window)
+
+
+def iter_search_hits(SortDirection='Descending', SortProperty='Expiration',
+                     PageSize=100, window=None, ResponseGroup=None,
+                     fields=None):
+    parameters = {
+        'SortDirection': SortDirection,
+        'SortProperty': SortProperty,
+    }
+    return iter_pages('SearchHITs', parameters, 'HIT', PageSize, window,
+                      ResponseGroup, fields)
+
+
+def iter_assignments_for_hit(HITId, PageSize=100, window=None,
+                             ResponseGroup=None, fields=None):
+    parameters = {
+        'HITId': HITId,
+    }
+    return iter_pages('GetAssignmentsForHIT', parameters, 'Assignment',
+                      PageSize, window, ResponseGroup, fields)
+
+
+def iter_qualification_requests(QualificationTypeId=None, SortProperty=None,
+                                SortDirection=None, PageSize=100, window=None):
+    parameters = {}
+    if QualificationTypeId:
+        parameters['QualificationTypeId'] = QualificationTypeId
+    if SortProperty:
+        parameters['SortProperty'] = SortProperty
+    if SortDirection:
+        parameters['SortDirection'] = SortDirection
+    return iter_pages('GetQualificationRequests', parameters,
+                      'QualificationRequest', PageSize, window)
+
+
+def iter_qualifications_for_qualification_type(QualificationTypeId,
+                                               Status=None, PageSize=100,
+                                               window=None, ResponseGroup=None,
+                                               fields=None):
+    parameters = {
+        'QualificationTypeId': QualificationTypeId,
+    }
+    if Status:
+        parameters['Status'] = Status
+    return iter_pages('GetQualificationsForQualificationType', parameters,
+                      'Qualification', PageSize, window, ResponseGroup,
+                      fields)
+
+
+def iter_bonus_payments(HITId=None, AssignmentId=None, PageSize=100,
+                        window=None):
+    #function needs HITId or AssignmentId
+    parameters = {}
+    if HITId:
+        parameters['HITId'] = HITId
+    elif AssignmentId != None:
+        parameters['AssignmentId'] = AssignmentId
+    return iter_pages('GetBonusPayments', parameters, 'BonusPayment',
+                      PageSize, window)
+
+
+# Asynchronous operations
+class Timeout(Exception):
+    pass
+
+
+class Future(object):
+    """Result of an operation that runs on another thread."""
+
+    def __init__(self, deadline=None):
+        self.deadline = deadline
+        self._done = threading.Event()
+        self._lock = threading.Lock()
+        self._value = None
+        self._exc_info = None
+        self._callbacks = []
+
+    def done(self):
+        return self._done.is_set()
+
+    def _finish(self, value=None, exc_info=None):
+        with self._lock:
+            self._value = value
+            self._exc_info = exc_info
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def add_done_callback(self, callback):
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def exception(self, timeout=None):
+        self._wait(timeout)
+        if self._exc_info:
+            return self._exc_info[1]
+        return None
+
+    def result(self, timeout=None):
+        """Wait for and return the result, re-raising any error.
+
+        Waits at most `timeout` seconds, or until the call's deadline
+        when no timeout is given, then raises Timeout.
+        """
+        self._wait(timeout)
+        if self._exc_info:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._value
+
+    def _wait(self, timeout):
+        if timeout is None and self.deadline is not None:
+            timeout = max(0, self.deadline - time.time())
+        if not self._done.wait(timeout):
+            raise Timeout('operation did not finish in time')
+
+
+class AsyncClient(object):
+    """Runs operations concurrently and returns Futures.
+
+    Every module-level operation is available as a method with the same
+    arguments, e.g. client.GetHIT(HITId) returns a Future for the
+    dict GetHIT would return. At most `concurrency` operations run at
+    once; the rest wait in a queue. A call that has not started before
+    its `timeout` elapses is not sent at all, and waiting on its result
+    raises Timeout. Calls go through `client`, or through the client
+    current when they are submitted.
+    """
+
+    def __init__(self, concurrency=None, timeout=None, client=None):
+        self.client = client
+        self.concurrency = concurrency or ASYNC_CONCURRENCY
+        self.timeout = timeout or ASYNC_TIMEOUT
+        self._queue = Queue.Queue()
+        self._workers = []
+        self._lock = threading.Lock()
+        self._closed = False
+
+    def _start_workers(self):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError('AsyncClient is closed')
+            while len(self._workers) < self.concurrency:
+                worker = threading.Thread(target=self._work)
+                worker.daemon = True
+                worker.start()
+                self._workers.append(worker)
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+            future, client, function, args, kwargs = item
+            if future.deadline is not None and time.time() > future.deadline:
+                try:
+                    raise Timeout('operation timed out before it was sent')
+                except Timeout:
+                    future._finish(exc_info=sys.exc_info())
+                continue
+            try:
+                with client.activate():
+                    value = function(*args, **kwargs)
+            except Exception:
+                future._finish(exc_info=sys.exc_info())
+            else:
+                future._finish(value)
+
+    def submit(self, function, *args, **kwargs):
+        """Queue function(*args, **kwargs) and return its Future."""
+        self._start_workers()
+        deadline = None
+        if self.timeout is not None:
+            deadline = time.time() + self.timeout
+        future = Future(deadline)
+        client = self.client or current_client()
+        self._queue.put((future, client, function, args, kwargs))
+        return future
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            workers, self._workers = self._workers, []
+        for worker in workers:
+            self._queue.put(None)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _async_operation(name):
+    def operation(self, *args, **kwargs):
+        return self.submit(globals()[name], *args, **kwargs)
+    operation.__name__ = name
+    operation.__doc__ = 'Run %s concurrently, return a Future.' % name
+    return operation
+
+
+for _name in OPERATIONS:
+    setattr(AsyncClient, _name, _async_operation(_name))
+
+
+def wait(futures, timeout=None):
+    """Yield futures as they complete, at most `timeout` seconds overall."""
+    completed = Queue.Queue()
+    futures = list(futures)
+    for future in futures:
+        future.add_done_callback(completed.put)
+    deadline = None
+    if timeout is not None:
+        deadline = time.time() + timeout
+    for i in range(len(futures)):
+        remaining = None
+        if deadline is not None:
+            remaining = max(0, deadline - time.time())
+        try:
+            yield completed.get(True, remaining)
+        except Queue.Empty:
+            raise Timeout('%d of %d operations did not finish in time'
+                          % (len(futures) - i, len(futures)))
+
+
+# Bulk actions
+class BulkResult(object):
+    """Outcome of one bulk action."""
+
+    def __init__(self, action, ok, value=None, code=None, error=None,
+                 latency=0.0):
+        self.action = action
+        self.ok = ok
+        self.value = value
+        self.code = code
+        self.error = error
+        self.latency = latency
+
+    def __repr__(self):
+        operation = getattr(self.action[0], '__name__', self.action[0])
+        if self.ok:
+            return '<BulkResult %s ok %.3fs>' % (operation, self.latency)
+        return '<BulkResult %s failed %s %.3fs>' % (operation, self.code,
+                                                     self.latency)
+
+
+def _run_action(action):
+    operation, kwargs = action
+    function = operation
+    if not callable(function):
+        function = globals()[operation]
+    _local.result = None
+    start = time.time()
+    try:
+        value = function(**kwargs)
+    except Exception, e:
+        return BulkResult(action, False, code=getattr(e, 'code', None),
+                          error=e, latency=time.time() - start)
+    latency = time.time() - start
+    result = last_result()
+    if result is not None and result.get('IsValid') == 'False':
+        return BulkResult(action, False, value, latency=latency)
+    return BulkResult(action, True, value, latency=latency)
+
+
+class bulk(object):
+    """Run many actions concurrently, yielding a BulkResult per action.
+
+    Each action is an (operation, kwargs) pair, where operation is the
+    name of a module function or any callable, e.g.
+
+        for r in bulk(('ApproveAssignment', {'AssignmentId': a}) for a in ids):
+            if not r.ok:
+                print r.action, r.code
+
+    Results are yielded as they complete, not in input order. Actions are
+    read lazily from the iterable, so at most a few times `concurrency`
+    of them are held in memory. Totals are available from stats() during
+    and after the run.
+    """
+
+    def __init__(self, actions, concurrency=None, timeout=None):
+        self.actions = iter(actions)
+        self.executor = AsyncClient(concurrency, timeout, current_client())
+        self.started = None
+        self.finished = None
+        self.completed = 0
+        self.failed = 0
+
+    def __iter__(self):
+        done = Queue.Queue()
+        window = self.executor.concurrency * 2
+        pending = 0
+        self.started = time.time()
+        try:
+            while True:
+                while pending < window:
+                    try:
+                        action = self.actions.next()
+                    except StopIteration:
+                        break
+                    future = self.executor.submit(_run_action, action)
+                    future.action = action
+                    future.add_done_callback(done.put)
+                    pending += 1
+                if not pending:
+                    break
+                future = done.get()
+                pending -= 1
+                try:
+                    item = future.result(0)
+                except Exception, e:
+                    item = BulkResult(future.action, False,
+                                      code=getattr(e, 'code', None), error=e)
+                self.completed += 1
+                if not item.ok:
+                    self.failed += 1
+                yield item
+        finally:
+            self.finished = time.time()
+            self.executor.close()
+
+    def stats(self):
+        end = self.finished or time.time()
+        elapsed = end - (self.started or end)
+        throughput = 0.0
+        if elapsed:
+            throughput = self.completed / elapsed
+        return dict(completed=self.completed,
+                    succeeded=self.completed - self.failed,
+                    failed=self.failed, elapsed=elapsed, throughput=throughput)
+
+
+# File downloads
+class UploadURLExpired(IOError):
+    pass
+
+
+def _fetch_upload(url, path):
+    # stream url into path, continuing after the bytes already there
+    scheme, netloc, urlpath, query = urlparse.urlsplit(url)[:4]
+    if scheme == 'https':
+        conn = httplib.HTTPSConnection(netloc, timeout=POOL_SOCKET_TIMEOUT)
+    else:
+        conn = httplib.HTTPConnection(netloc, timeout=POOL_SOCKET_TIMEOUT)
+    if query:
+        urlpath += '?' + query
+    offset = 0
+    if os.path.exists(path):
+        offset = os.path.getsize(path)
+    headers = {}
+    if offset:
+        headers['Range'] = 'bytes=%d-' % offset
+    try:
+        conn.request('GET', urlpath, headers=headers)
+        response = conn.getresponse()
+        if response.status == 416:
+            return offset
+        if response.status == 403:
+            raise UploadURLExpired('upload url expired: %s' % url)
+        if response.status not in (200, 206):
+            raise httplib.HTTPException('GET %s: %d %s' % (
+                url, response.status, response.reason))
+        if response.status == 200:
+            offset = 0
+        f = open(path, offset and 'ab' or 'wb')
+        try:
+            while True:
+                chunk = response.read(DOWNLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                f.write(chunk)
+                offset += len(chunk)
+        finally:
+            f.close()
+        return offset
+    finally:
+        conn.close()
+
+
+def download_file(AssignmentId, QuestionIdentifier, path):
+    """Download one uploaded file to path, resuming a partial download.
+
+    The data is written to path + '.part' and renamed once complete, so
+    an existing path means the file is already there. The upload url is
+    requested right before each attempt, and again whenever it expired.
+    """
+    if os.path.exists(path):
+        return dict(path=path, size=os.path.getsize(path), skipped=True)
+    partial = path + '.part'
+    attempt = 0
+    while True:
+        url = GetFileUploadURL(AssignmentId, QuestionIdentifier)
+        try:
+            size = _fetch_upload(url, partial)
+        except UploadURLExpired:
+            # the url ran out before the request got there, get a new one
+            if attempt >= MAX_RETRIES:
+                raise
+            attempt += 1
+        except (socket.error, httplib.HTTPException):
+            if attempt >= MAX_RETRIES:
+                raise
+            time.sleep(backoff(attempt))
+            attempt += 1
+        else:
+            os.rename(partial, path)
+            return dict(path=path, size=size, skipped=False)
+
+
+def download_files(files, directory='.', concurrency=None):
+    """Download the files uploaded for (AssignmentId, QuestionIdentifier)
+    pairs into directory, as AssignmentId_QuestionIdentifier.
+
+    Downloads run concurrently and stream to disk in chunks, so memory
+    use does not grow with file size. Yields a BulkResult per file as it
+    completes (see bulk); running it again after an interruption skips
+    finished files and resumes partial ones.
+    """
+    def actions():
+        for AssignmentId, QuestionIdentifier in files:
+            name = '%s_%s' % (AssignmentId, QuestionIdentifier)
+            path = os.path.join(directory, name.replace(os.sep, '_'))
+            yield (download_file, dict(AssignmentId=AssignmentId,
+                                       QuestionIdentifier=QuestionIdentifier,
+                                       path=path))
+    return bulk(actions(), concurrency or DOWNLOAD_CONCURRENCY)
+
+
+# Messaging
+def notify_workers(Subject, MessageText, WorkerIds, chunk_size=None,
+                   concurrency=None):
+    """Send a message to any number of workers.
+
+    Duplicate WorkerIds are dropped and the rest are split into
+    NotifyWorkers calls of at most NOTIFY_WORKERS_MAX recipients, sent
+    concurrently. Returns one BulkResult per chunk, in order; the
+    recipients of a chunk are in result.action[1]['WorkerId'], so the
+    failed ones can be sent again:
+
+        results = notify_workers(subject, text, workers)
+        retry = [w for r in results if not r.ok
+                 for w in r.action[1]['WorkerId']]
+        notify_workers(subject, text, retry)
+    """
+    chunk_size = chunk_size or NOTIFY_WORKERS_MAX
+    seen = set()
+    unique = []
+    for WorkerId in WorkerIds:
+        if WorkerId not in seen:
+            seen.add(WorkerId)
+            unique.append(WorkerId)
+    actions = [('NotifyWorkers', dict(Subject=Subject,
+                                      MessageText=MessageText,
+                                      WorkerId=unique[i:i + chunk_size]))
+               for i in range(0, len(unique), chunk_size)]
+    order = dict((id(action), i) for i, action in enumerate(actions))
+    results = [None] * len(actions)
+    for result in bulk(actions, concurrency):
+        results[order[id(result.action)]] = result
+    return results
+
+
+# Qualification reconciliation
+def reconcile_qualification(QualificationTypeId, scores, revoke=True,
+                            Reason=None, SendNotification=None,
+                            concurrency=None):
+    """Make the granted scores of a qualification type match `scores`.
+
+    scores maps WorkerId to the desired IntegerValue. The current grants
+    are read with GetQualificationsForQualificationType and only the
+    differences are sent, concurrently: AssignQualification for new
+    workers, UpdateQualificationScore for changed scores and, when
+    `revoke` is true, RevokeQualification for workers not in scores.
+    Returns a dict of counts; `avoided` is the number of calls saved
+    over rewriting every worker, `failures` holds the failed BulkResults.
+    """
+    current = {}
+    for qualification in iter_qualifications_for_qualification_type(
+            QualificationTypeId, 'Granted', fields=('SubjectId',
+                                                    'IntegerValue')):
+        current[qualification['SubjectId']] = qualification.get(
+            'IntegerValue')
+    actions = []
+    counts = dict(granted=0, updated=0, revoked=0, unchanged=0)
+    for WorkerId, score in scores.iteritems():
+        if WorkerId not in current:
+            counts['granted'] += 1
+            actions.append(('AssignQualification', dict(
+                QualificationTypeId=QualificationTypeId, WorkerId=WorkerId,
+                IntegerValue=score, SendNotification=SendNotification)))
+        elif str(score) != current[WorkerId]:
+            counts['updated'] += 1
+            actions.append(('UpdateQualificationScore', dict(
+                QualificationTypeId=QualificationTypeId, SubjectId=WorkerId,
+                IntegerValue=score)))
+        else:
+            counts['unchanged'] += 1
+    if revoke:
+        for SubjectId in current:
+            if SubjectId not in scores:
+                counts['revoked'] += 1
+                actions.append(('RevokeQualification', dict(
+                    QualificationTypeId=QualificationTypeId,
+                    SubjectId=SubjectId, Reason=Reason)))
+    failures = [r for r in bulk(actions, concurrency) if not r.ok]
+    counts.update(current=len(current), calls=len(actions),
+                  avoided=len(scores) - counts['granted'] - counts['updated'],
+                  failed=len(failures), failures=failures)
+    return counts
+
+
+# Review pipeline
+#
+# ReviewPipeline runs the review loop as five stages connected by bounded
+# queues, each with its own worker threads:
+#
+#   reserve   SetHITAsReviewing
+#   fetch     GetAssignmentsForHIT, every page
+#   decide    the user's decide(HITId, assignments)
+#   act       the actions decide returned, one at a time
+#   dispose   DisposeHIT, or SetHITAsReviewing(Revert=True) when anything
+#             for the HIT failed, so the next pass picks it up again
+#
+# A full queue blocks the stage feeding it, so a slow stage holds back
+# the ones before it instead of piling up work in memory.
+_DONE = object()
+
+
+class _Stage(object):
+
+    def __init__(self, name, function, workers, queue_size):
+        self.name = name
+        self.function = function
+        self.workers = workers
+        self.queue = Queue.Queue(queue_size)
+        self.processed = 0
+        self.failed = 0
+        self.busy = 0.0
+        self.on_finished = None
+        self._running = 0
+        self._lock = threading.Lock()
+
+    def put(self, item):
+        self.queue.put(item)
+
+    def start(self, client):
+        self._running = self.workers
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, args=(client,))
+            thread.daemon = True
+            thread.start()
+
+    def close(self):
+        for i in range(self.workers):
+            self.queue.put(_DONE)
+
+    def _work(self, client):
+        with client.activate():
+            while True:
+                item = self.queue.get()
+                if item is _DONE:
+                    break
+                start = time.time()
+                try:
+                    self.function(item)
+                except Exception:
+                    ok = False
+                else:
+                    ok = True
+                with self._lock:
+                    self.busy += time.time() - start
+                    self.processed += 1
+                    if not ok:
+                        self.failed += 1
+        with self._lock:
+            self._running -= 1
+            last = not self._running
+        if last and self.on_finished is not None:
+            self.on_finished()
+
+    def stats(self, elapsed):
+        with self._lock:
+            throughput = 0.0
+            if elapsed:
+                throughput = self.processed / elapsed
+            return dict(processed=self.processed, failed=self.failed,
+                        busy=self.busy, workers=self.workers,
+                        queued=self.queue.qsize(), throughput=throughput)
+
+
+class ReviewPipeline(object):
+    """Review reviewable HITs with a staged, concurrent pipeline.
+
+    decide(HITId, assignments) returns the actions to take for a HIT as
+    (operation, kwargs) pairs, as for bulk(), e.g.
+
+        def decide(HITId, assignments):
+            return [('ApproveAssignment', {'AssignmentId': a['AssignmentId']})
+                    for a in assignments
+                    if a['AssignmentStatus'] == 'Submitted']
+
+        pipeline = ReviewPipeline(decide)
+        print pipeline.run()
+
+    The HIT is disposed once all of its actions succeeded. `source` yields
+    the HITs to review (HITIds, HIT records or notification Events, of
+    which only HITReviewable ones are taken). By default every reviewable
+    HIT is listed before the first one is reserved, since reserving and
+    disposing HITs moves the rest between the pages of that listing.
+    `concurrency` overrides REVIEW_CONCURRENCY per stage. Failures are
+    kept in `errors` as (stage, item, exception) tuples.
+    """
+    STAGES = ('reserve', 'fetch', 'decide', 'act', 'dispose')
+
+    def __init__(self, decide, source=None, concurrency=None,
+                 queue_size=None, client=None):
+        self.decide = decide
+        self.source = source
+        self.client = client or current_client()
+        workers = dict(REVIEW_CONCURRENCY)
+        workers.update(concurrency or {})
+        self.stages = collections.OrderedDict()
+        for name in self.STAGES:
+            self.stages[name] = _Stage(name, getattr(self, '_' + name),
+                                       workers[name],
+                                       queue_size or REVIEW_QUEUE_SIZE)
+        stages = self.stages.values()
+        for stage, next_stage in zip(stages, stages[1:]):
+            stage.on_finished = next_stage.close
+        stages[-1].on_finished = self._finished
+        self.errors = []
+        self.started = None
+        self.finished = None
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._stopping = False
+        self._done = threading.Event()
+
+    def start(self):
+        self.started = time.time()
+        for stage in self.stages.values():
+            stage.start(self.client)
+        thread = threading.Thread(target=self._feed)
+        thread.daemon = True
+        thread.start()
+        return self
+
+    def stop(self):
+        # stop reading the source; HITs already taken are finished
+        self._stopping = True
+
+    def join(self, timeout=None):
+        self._done.wait(timeout)
+        return self._done.is_set()
+
+    def run(self):
+        self.start()
+        while not self.join(1):
+            pass
+        return self.stats()
+
+    def stats(self):
+        end = self.finished or time.time()
+        elapsed = end - (self.started or end)
+        return dict(elapsed=elapsed, errors=len(self.errors),
+                    stages=dict((name, stage.stats(elapsed))
+                                for name, stage in self.stages.items()))
+
+    def _finished(self):
+        self.finished = time.time()
+        self._done.set()
+
+    def _error(self, stage, item):
+        self.errors.append((stage, item, sys.exc_info()[1]))
+
+    def _feed(self):
+        reserve = self.stages['reserve']
+        try:
+            with self.client.activate():
+                source = self.source
+                if source is None:
+                    source = [hit['HITId'] for hit in iter_reviewable_hits()]
+                for item in source:
+                    if self._stopping:
+                        break
+                    if not isinstance(item, basestring):
+                        # other events are for HITs that aren't reviewable
+                        if item.get('EventType', 'HITReviewable') != \
+                                'HITReviewable':
+                            continue
+                        item = item['HITId']
+                    reserve.put(item)
+        except Exception:
+            self._error('source', None)
+        finally:
+            reserve.close()
+
+    def _reserve(self, HITId):
+        try:
+            SetHITAsReviewing(HITId)
+        except Exception:
+            self._error('reserve', HITId)
+            raise
+        self.stages['fetch'].put(HITId)
+
+    def _fetch(self, HITId):
+        try:
+            assignments = list(iter_assignments_for_hit(HITId))
+        except Exception:
+            self._error('fetch', HITId)
+            self.stages['dispose'].put((HITId, False))
+            raise
+        self.stages['decide'].put((HITId, assignments))
+
+    def _decide(self, item):
+        HITId, assignments = item
+        try:
+            actions = list(self.decide(HITId, assignments) or ())
+        except Exception:
+            self._error('decide', HITId)
+            self.stages['dispose'].put((HITId, False))
+            raise
+        if not actions:
+            self.stages['dispose'].put((HITId, True))
+            return
+        with self._lock:
+            self._pending[HITId] = [len(actions), True]
+        for action in actions:
+            self.stages['act'].put((HITId, action))
+
+    def _act(self, item):
+        HITId, action = item
+        result = _run_action(action)
+        with self._lock:
+            pending = self._pending[HITId]
+            pending[0] -= 1
+            if not result.ok:
+                pending[1] = False
+            last = not pending[0]
+            if last:
+                del self._pending[HITId]
+        if last:
+            self.stages['dispose'].put((HITId, pending[1]))
+        if not result.ok:
+            error = result.error or MTurkError(result.code,
+                                               'action failed', action[0])
+            self.errors.append(('act', item, error))
+            raise error
+
+    def _dispose(self, item):
+        HITId, ok = item
+        try:
+            if ok:
+                DisposeHIT(HITId)
+            else:
+                SetHITAsReviewing(HITId, Revert=True)
+        except Exception:
+            self._error('dispose', HITId)
+            if ok:
+                # leave the HIT reviewable for the next pass if we can
+                try:
+                    SetHITAsReviewing(HITId, Revert=True)
+                except Exception:
+                    pass
+            raise
+
+
+# Clients
+#
+# Module functions send their requests as the current client. Unless a
+# Client has been activated on this thread, that is default_client, which
+# reads the module settings above (AWS_ACCESS_KEY_ID, SANDBOXP, ...) on
+# every call. A Client carries its own credentials, endpoint, connection
+# pool, signer, rate limits and cache, so several accounts can be used
+# from the same process at once:
+#
+#     a = Client('KEY1', 'SECRET1')
+#     b = Client('KEY2', 'SECRET2', sandbox=True)
+#     a.GetHIT(HITId)
+#     with b.activate():
+#         for hit in iter_reviewable_hits():
+#             ...
+class Client(object):
+    """Credentials and connection state for one requester account.
+
+    Every operation and iter_* helper is available as a method, and a
+    Client is safe to share between threads.
+    """
+
+    def __init__(self, aws_access_key_id, aws_secret_access_key,
+                 sandbox=False, url=None, pool_size=None, rate_limits=None,
+                 service=SERVICE_NAME):
+        self.aws_access_key_id = aws_access_key_id
+        self.url = url or (sandbox and SANDBOX_URL or PRODUCTION_URL)
+        self.pool = ConnectionPool(self.url, pool_size)
+        self.signer = Signer(aws_secret_access_key, service)
+        self.rate_limits = dict(rate_limits or RATE_LIMITS)
+        self.cache = None
+        self.single_flight = None
+        self.journal = None
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def bucket(self, operation):
+        name = operation_class(operation)
+        with self._lock:
+            bucket = self._buckets.get(name)
+            if bucket is None:
+                rate, burst = self.rate_limits.get(name) or (None, None)
+                bucket = self._buckets[name] = TokenBucket(rate, burst)
+        return bucket
+
+    def enable_cache(self, size=None, ttls=None):
+        self.cache = ResponseCache(size, ttls)
+        return self.cache
+
+    def disable_cache(self):
+        self.cache = None
+
+    def enable_coalescing(self):
+        self.single_flight = SingleFlight()
+        return self.single_flight
+
+    def disable_coalescing(self):
+        self.single_flight = None
+
+    def enable_journal(self, path, sync=True):
+        self.disable_journal()
+        self.journal = Journal(path, sync, self)
+        return self.journal
+
+    def disable_journal(self):
+        if self.journal is not None:
+            self.journal.close()
+        self.journal = None
+
+    def activate(self):
+        """Make this the current client of the thread inside a with block."""
+        return _Activation(self)
+
+    def call(self, operation, parameters=None, ResponseGroup=None,
+             fields=None):
+        with self.activate():
+            return call(operation, parameters, ResponseGroup, fields)
+
+    def close(self):
+        self.pool.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+class _DefaultClient(Client):
+    # the module-level settings, looked up on every use
+
+    def __init__(self):
+        pass
+
+    aws_access_key_id = property(lambda self: AWS_ACCESS_KEY_ID)
+    url = property(lambda self: endpoint())
+    pool = property(lambda self: get_pool())
+    signer = property(lambda self: get_signer())
+    cache = property(lambda self: response_cache)
+    single_flight = property(lambda self: single_flight)
+    journal = property(lambda self: journal)
+
+    def bucket(self, operation):
+        return get_bucket(operation)
+
+    def enable_cache(self, size=None, ttls=None):
+        return enable_cache(size, ttls)
+
+    def disable_cache(self):
+        disable_cache()
+
+    def enable_coalescing(self):
+        return enable_coalescing()
+
+    def disable_coalescing(self):
+        disable_coalescing()
+
+    def enable_journal(self, path, sync=True):
+        return enable_journal(path, sync)
+
+    def disable_journal(self):
+        disable_journal()
+
+    def close(self):
+        close_pools()
+
+
+default_client = _DefaultClient()
+
+
+def current_client():
+    return getattr(_local, 'client', None) or default_client
+
+
+class _Activation(object):
+
+    def __init__(self, client):
+        self.client = client
+
+    def __enter__(self):
+        self.previous = getattr(_local, 'client', None)
+        _local.client = self.client
+        return self.client
+
+    def __exit__(self, *exc_info):
+        _local.client = self.previous
+
+
+def _client_method(name):
+    def method(self, *args, **kwargs):
+        with self.activate():
+            return globals()[name](*args, **kwargs)
+    method.__name__ = name
+    method.__doc__ = 'Run %s as this client.' % name
+    return method
+
+
+for _name in OPERATIONS + ('iter_reviewable_hits', 'iter_search_hits',
+                           'iter_assignments_for_hit',
+                           'iter_qualification_requests',
+                           'iter_qualifications_for_qualification_type',
+                           'iter_bonus_payments', 'bulk'):
+    setattr(Client, _name, _client_method(_name))
+
+
+# Notifications
+#
+# NotificationReceiver is a small HTTP server for the REST notifications
+# set up with SetHITTypeNotification, so work can start as soon as an
+# assignment is submitted instead of polling GetReviewableHITs:
+#
+#     receiver = NotificationReceiver(secret_access_key=AWS_SECRET_ACCESS_KEY)
+#     url = receiver.start(port=8080)     # must be reachable by mturk
+#     SetHITTypeNotification(HITTypeId, 'http://example.com:8080/')
+#     for event in receiver:
+#         if event['EventType'] == 'AssignmentSubmitted':
+#             ...
+class Event(Record):
+    FIELDS = ('EventType', 'EventTime', 'HITTypeId', 'HITId', 'AssignmentId')
+    __slots__ = _slot_names(FIELDS)
+
+Event._keys = dict(zip(Event.FIELDS, Event.__slots__))
+
+
+def parse_notification(parameters):
+    """Decode the Event.N.* parameters of a REST notification."""
+    events = {}
+    for name, value in parameters.iteritems():
+        parts = name.split('.')
+        if len(parts) == 3 and parts[0] == 'Event' and parts[1].isdigit():
+            events.setdefault(int(parts[1]), Event())[parts[2]] = value
+    return [events[n] for n in sorted(events)]
+
+
+class NotificationReceiver(object):
+    """HTTP server turning REST notifications into Event records.
+
+    Every event is passed to `callback` if one is given, otherwise put on
+    the `events` queue (iterating over the receiver blocks on it). When
+    secret_access_key is given, notifications without a valid signature
+    are refused.
+    """
+
+    def __init__(self, callback=None, secret_access_key=None):
+        self.callback = callback
+        self.events = Queue.Queue()
+        self.signer = None
+        if secret_access_key:
+            self.signer = Signer(secret_access_key, NOTIFICATION_SERVICE)
+        self.received = 0
+        self.rejected = 0
+        self.server = None
+
+    def handle(self, parameters):
+        """Accept one notification, return the http status to reply with."""
+        if parameters.get('method') != 'Notify':
+            return 400
+        if self.signer is not None:
+            expected = self.signer.sign('Notify',
+                                        parameters.get('Timestamp', ''))
+            if parameters.get('Signature') != expected:
+                self.rejected += 1
+                return 403
+        for event in parse_notification(parameters):
+            self.received += 1
+            if self.callback is None:
+                self.events.put(event)
+            else:
+                try:
+                    self.callback(event)
+                except Exception:
+                    # mturk sends the notification again later
+                    return 500
+        return 200
+
+    def __iter__(self):
+        while True:
+            yield self.events.get()
+
+    def start(self, host='', port=0):
+        """Serve in a background thread, return the url listened on."""
+        self.server = _NotificationServer((host, port), _NotificationHandler)
+        self.server.receiver = self
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        host, port = self.server.server_address[:2]
+        return 'http://%s:%d/' % (host, port)
+
+    def stop(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
+
+
+class _NotificationHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.notify(self.path.partition('?')[2])
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        self.notify(self.rfile.read(length))
+
+    def notify(self, query):
+        parameters = dict(urlparse.parse_qsl(query, True))
+        status = self.server.receiver.handle(parameters)
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+class _NotificationServer(SocketServer.ThreadingMixIn,
+                          BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
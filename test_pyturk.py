@@ -0,0 +1,772 @@
+#!/usr/bin/env python
+# Copyright (c) 2010 Nathan Morris, nathan.ms@gmail.com
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish, dis-
+# tribute, sublicense, and/or sell copies of the Software, and to permit
+# persons to whom the Software is furnished to do so, subject to the fol-
+# lowing conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABIL
+# ITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT
+# SHALL THE AUTHOR BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+
+# regression tests against fakemturk
+#
+#   python -m unittest test_pyturk
+
+
+import os
+import hmac
+import time
+import pickle
+import base64
+import socket
+import hashlib
+import shutil
+import tempfile
+import unittest
+import threading
+
+import pyturk
+import fakemturk
+import turkmirror
+import turkanswers
+import turkpublish
+import turksnapshot
+
+
+class FakeTestCase(unittest.TestCase):
+    # each test talks to its own fake through its own Client
+
+    def setUp(self):
+        self.fake = fakemturk.FakeMTurk(seed=2010)
+        self.client = pyturk.Client('AKIAEXAMPLE', 'secret',
+                                    url=self.fake.start())
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        self.client.close()
+        self.fake.stop()
+        shutil.rmtree(self.directory)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def lose_responses(self, *calls):
+        # run calls whose responses are lost after the service ran them
+        parse = pyturk.pp
+
+        def lost(string, fields=None):
+            raise socket.error('connection reset')
+        pyturk.pp = lost
+        try:
+            for function, args in calls:
+                self.assertRaises(socket.error, function, *args)
+        finally:
+            pyturk.pp = parse
+
+
+class PoolTest(FakeTestCase):
+
+    def test_closed_idle_connection_is_dropped(self):
+        self.client.GetAccountBalance()
+        self.fake.drop_connections()
+        self.client.GetAccountBalance()
+        stats = self.client.pool.stats()
+        self.assertEqual((stats['dropped'], stats['reconnects']), (1, 0))
+        self.assertEqual(self.fake.counts['GetAccountBalance'], 2)
+
+    def test_write_after_server_closes_connection(self):
+        self.fake.populate(hits=1)
+        assignment = self.fake.assignments.values()[0]
+        self.client.GetAccountBalance()
+        self.fake.drop_connections()
+        self.client.ApproveAssignment(assignment['AssignmentId'])
+        self.assertEqual(assignment['AssignmentStatus'], 'Approved')
+        self.assertEqual(self.fake.counts['ApproveAssignment'], 1)
+
+    def test_only_unanswered_requests_are_resent(self):
+        closed = pyturk.httplib.BadStatusLine('')
+        reset = socket.error(pyturk.errno.ECONNRESET, 'reset')
+        self.assertTrue(pyturk.unanswered(reset, 'request'))
+        self.assertTrue(pyturk.unanswered(closed, 'status'))
+        self.assertTrue(pyturk.unanswered(reset, 'status'))
+        self.assertFalse(pyturk.unanswered(socket.timeout(), 'status'))
+        self.assertFalse(pyturk.unanswered(socket.timeout(), 'request'))
+        self.assertFalse(pyturk.unanswered(reset, 'body'))
+        self.assertFalse(pyturk.unanswered(
+            pyturk.httplib.BadStatusLine('HTTP/1.1 2'), 'status'))
+
+    def test_timeout_not_resent(self):
+        self.fake.populate(hits=1)
+        assignment = self.fake.assignments.values()[0]
+        self.client.pool = pyturk.ConnectionPool(self.client.url, timeout=0.2)
+        self.client.GetAccountBalance()
+        self.fake.latency = 0.4
+        self.assertRaises(socket.timeout, self.client.GrantBonus,
+                          assignment['WorkerId'], assignment['AssignmentId'],
+                          0.5, 'thanks')
+        # the fake is still sleeping on the timed out request
+        time.sleep(0.4)
+        self.fake.latency = 0
+        self.client.GetAccountBalance()
+        self.assertEqual(len(self.fake.bonus_payments), 1)
+
+
+class RecordTest(unittest.TestCase):
+
+    def test_records_behave_like_dicts(self):
+        hit = pyturk.HIT(HITId='H1', Custom='x')
+        hit['Reward.Amount'] = '0.05'
+        self.assertEqual(hit.Reward_Amount, '0.05')
+        self.assertEqual(hit, {'HITId': 'H1', 'Custom': 'x',
+                               'Reward.Amount': '0.05'})
+        self.assertEqual(hit.get('Title'), None)
+        self.assertFalse('Title' in hit)
+        self.assertRaises(KeyError, hit.__getitem__, 'Title')
+        del hit['Custom']
+        self.assertEqual(sorted(hit), ['HITId', 'Reward.Amount'])
+        self.assertEqual(pickle.loads(pickle.dumps(hit, 2)), hit)
+        self.assertRaises(AttributeError, setattr, hit, 'Other', 1)
+
+    def test_repeated_values_are_interned(self):
+        statuses = [pyturk.Assignment(AssignmentStatus=''.join(
+            ['Sub', 'mitted']))['AssignmentStatus'] for i in range(2)]
+        self.assertTrue(statuses[0] is statuses[1])
+
+
+class ClientTest(FakeTestCase):
+
+    def test_clients_keep_to_their_own_account(self):
+        other = fakemturk.FakeMTurk(secret='other', seed=1)
+        client = pyturk.Client('AKIAOTHER', 'other', url=other.start())
+        try:
+            mine = set(self.fake.populate(hits=3, assignments=0))
+            theirs = set(other.populate(hits=2, assignments=0))
+            seen = {}
+
+            def search(name, client):
+                for i in range(10):
+                    seen[name] = set(hit['HITId'] for hit in
+                                     client.SearchHITs(PageSize=10))
+            threads = [threading.Thread(target=search, args=args) for args in
+                       [('mine', self.client), ('theirs', client)] * 4]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual(seen, dict(mine=mine, theirs=theirs))
+            with client.activate():
+                self.assertTrue(pyturk.current_client() is client)
+                with self.client.activate():
+                    self.assertEqual(len(pyturk.SearchHITs()), 3)
+                self.assertEqual(len(pyturk.SearchHITs()), 2)
+        finally:
+            client.close()
+            other.stop()
+
+    def test_wrong_secret_is_refused(self):
+        other = fakemturk.FakeMTurk(secret='other')
+        client = pyturk.Client('AKIAOTHER', 'secret', url=other.start())
+        try:
+            self.assertRaises(pyturk.MTurkError, client.GetAccountBalance)
+        finally:
+            client.close()
+            other.stop()
+
+
+class ParseTest(FakeTestCase):
+
+    RESPONSE = (
+        '<GetHITResponse><OperationRequest><RequestId>r1</RequestId>'
+        '</OperationRequest><HIT><Request><IsValid>True</IsValid></Request>'
+        '<HITId>H1</HITId><HITStatus>Assignable</HITStatus>'
+        '<Reward><Amount>0.05</Amount><CurrencyCode>USD</CurrencyCode>'
+        '</Reward><Title>Caf\xc3\xa9</Title></HIT></GetHITResponse>')
+
+    def test_records_and_fields(self):
+        result = pyturk.parse(self.RESPONSE)
+        hit = result.first('HIT')
+        self.assertEqual(hit['HITId'], 'H1')
+        self.assertEqual(hit['Reward.Amount'], '0.05')
+        self.assertEqual(hit['Title'], u'Caf\xe9')
+        self.assertEqual(result.get('RequestId'), 'r1')
+        self.assertEqual(result.get('Request.IsValid'), 'True')
+        self.assertEqual(result.errors, [])
+
+    def test_errors(self):
+        result = pyturk.parse(
+            '<R><Request><IsValid>False</IsValid><Errors><Error>'
+            '<Code>AWS.BadClaimsSupplied</Code><Message>bad</Message>'
+            '</Error></Errors></Request></R>')
+        self.assertEqual([(e['Code'], e['Message']) for e in result.errors],
+                         [('AWS.BadClaimsSupplied', 'bad')])
+        self.assertRaises(pyturk.MTurkError, pyturk.errcheck, result, 'R')
+
+    def test_operations_read_the_records(self):
+        HITIds = self.fake.populate(hits=3, assignments=0)
+        self.assertEqual(sorted(hit['HITId'] for hit in
+                                self.client.SearchHITs(PageSize=10)),
+                         sorted(HITIds))
+
+
+class AsyncTest(FakeTestCase):
+
+    def test_results_and_errors_come_back_through_futures(self):
+        HITIds = self.fake.populate(hits=8, assignments=0)
+        with pyturk.AsyncClient(concurrency=4, client=self.client) as client:
+            futures = [client.GetHIT(HITId) for HITId in HITIds]
+            missing = client.GetHIT('NOSUCHHIT')
+            done = list(pyturk.wait(futures, timeout=10))
+            self.assertEqual(len(done), 8)
+            self.assertEqual([f.result()['HITStatus'] for f in futures],
+                             ['Assignable'] * 8)
+            self.assertRaises(pyturk.MTurkError, missing.result)
+
+    def test_calls_not_started_in_time_are_not_sent(self):
+        HITId = self.fake.populate(hits=1, assignments=0)[0]
+        self.fake.latency = 0.3
+        with pyturk.AsyncClient(concurrency=1, timeout=0.1,
+                                client=self.client) as client:
+            futures = [client.GetHIT(HITId) for i in range(3)]
+            futures[0].result(timeout=5)
+            self.assertRaises(pyturk.Timeout, futures[2].result)
+        self.assertEqual(self.fake.counts['GetHIT'], 1)
+
+
+class BulkTest(FakeTestCase):
+
+    def test_every_action_gets_a_result(self):
+        self.fake.populate(hits=5, assignments=4)
+        ids = list(self.fake.assignments) + ['NOSUCHASSIGNMENT']
+        with self.client.activate():
+            run = pyturk.bulk((('ApproveAssignment', {'AssignmentId': a})
+                               for a in ids), concurrency=4)
+            results = list(run)
+        failed = [r for r in results if not r.ok]
+        self.assertEqual(len(results), 21)
+        self.assertEqual([r.action[1]['AssignmentId'] for r in failed],
+                         ['NOSUCHASSIGNMENT'])
+        self.assertTrue(failed[0].code)
+        self.assertEqual(run.stats()['succeeded'], 20)
+        self.assertEqual(self.fake.counts['ApproveAssignment'], 21)
+        self.assertEqual(set(a['AssignmentStatus'] for a in
+                             self.fake.assignments.values()), set(['Approved']))
+
+
+class RateLimitTest(FakeTestCase):
+
+    def test_one_cut_per_window(self):
+        bucket = pyturk.TokenBucket(40, 40)
+        for i in range(16):
+            bucket.throttled()
+        self.assertEqual((bucket.rate, bucket.throttles, bucket.cuts),
+                         (20, 16, 1))
+
+    def test_concurrent_throttles_keep_the_rate_up(self):
+        self.fake.rate_limit = 50
+        results = list(self.client.bulk(
+            (('GetAccountBalance', {}) for i in range(300)), 16))
+        bucket = self.client.bucket('GetAccountBalance')
+        self.assertTrue(all(result.ok for result in results))
+        self.assertTrue(bucket.throttles > 0)
+        self.assertTrue(bucket.rate >= 10, bucket.rate)
+
+
+class RetryTest(FakeTestCase):
+
+    def setUp(self):
+        FakeTestCase.setUp(self)
+        self.backoff = pyturk.BACKOFF_BASE
+        pyturk.BACKOFF_BASE = 0.001
+        self.fake.populate(hits=1)
+        self.assignment = self.fake.assignments.values()[0]
+
+    def tearDown(self):
+        pyturk.BACKOFF_BASE = self.backoff
+        FakeTestCase.tearDown(self)
+
+    def test_reads_are_retried_on_internal_errors(self):
+        self.fake.error_rate = 1
+        self.assertRaises(pyturk.ServiceUnavailableError,
+                          self.client.GetAccountBalance)
+        self.assertEqual(self.fake.counts['GetAccountBalance'],
+                         pyturk.MAX_RETRIES + 1)
+
+    def test_writes_are_not_retried_on_internal_errors(self):
+        self.fake.error_rate = 1
+        self.assertRaises(pyturk.ServiceUnavailableError,
+                          self.client.GrantBonus,
+                          self.assignment['WorkerId'],
+                          self.assignment['AssignmentId'])
+        self.assertEqual(self.fake.counts['GrantBonus'], 1)
+
+    def test_tokenized_writes_are_retried(self):
+        self.fake.error_rate = 1
+        self.assertRaises(pyturk.ServiceUnavailableError,
+                          self.client.GrantBonus,
+                          self.assignment['WorkerId'],
+                          self.assignment['AssignmentId'],
+                          UniqueRequestToken='bonus-1')
+        self.assertEqual(self.fake.counts['GrantBonus'],
+                         pyturk.MAX_RETRIES + 1)
+
+    def test_throttled_writes_are_retried(self):
+        self.fake.throttle_rate = 0.5
+        for i in range(5):
+            self.client.GrantBonus(self.assignment['WorkerId'],
+                                   self.assignment['AssignmentId'])
+        self.assertEqual(len(self.fake.bonus_payments), 5)
+
+
+class JournalTest(FakeTestCase):
+
+    def test_resume_replays_unfinished_writes_once(self):
+        self.fake.populate(hits=1, assignments=2)
+        first, second = self.fake.assignments.values()
+        journal = self.client.enable_journal(self.path('journal'))
+        self.lose_responses(
+            (self.client.GrantBonus, (first['WorkerId'],
+                                      first['AssignmentId'], 0.5,
+                                      'caf\xc3\xa9')),
+            (self.client.ApproveAssignment, (second['AssignmentId'],)),
+            (self.client.NotifyWorkers, ('hi', 'hello', ['W1'])))
+        self.assertEqual(len(journal.unfinished()), 3)
+        self.assertEqual(journal.resume(),
+                         dict(ok=0, duplicate=1, error=1, uncertain=1))
+        self.assertEqual(len(self.fake.bonus_payments), 1)
+        self.assertEqual(journal.unfinished(), [])
+        self.client.disable_journal()
+
+    def test_resume_sends_as_the_journal_client(self):
+        self.fake.populate(hits=1)
+        assignment = self.fake.assignments.values()[0]
+        other = fakemturk.FakeMTurk()
+        saved = pyturk.LOCAL_URL, pyturk.LOCALP
+        pyturk.LOCAL_URL, pyturk.LOCALP = other.start(), True
+        try:
+            journal = self.client.enable_journal(self.path('journal'))
+            self.lose_responses((self.client.GrantBonus, (
+                assignment['WorkerId'], assignment['AssignmentId'])))
+            journal.resume()
+            self.assertEqual(other.counts['GrantBonus'], 0)
+            self.assertEqual(self.fake.counts['GrantBonus'], 2)
+        finally:
+            self.client.disable_journal()
+            pyturk.LOCAL_URL, pyturk.LOCALP = saved
+            other.stop()
+
+    def test_torn_entry_is_skipped(self):
+        journal = self.client.enable_journal(self.path('journal'))
+        self.client.disable_journal()
+        open(self.path('journal'), 'a').write('{"id": "torn"')
+        journal = self.client.enable_journal(self.path('journal'))
+        self.assertEqual(journal.unfinished(), [])
+        self.client.disable_journal()
+
+
+class HookTest(FakeTestCase):
+
+    def test_collector_counts_calls_errors_and_phases(self):
+        HITId = self.fake.populate(hits=1, assignments=0)[0]
+        collector = pyturk.add_hook(pyturk.Collector())
+        try:
+            for i in range(3):
+                self.client.GetHIT(HITId)
+            self.assertRaises(pyturk.MTurkError, self.client.GetHIT, 'NOPE')
+        finally:
+            pyturk.remove_hook(collector)
+        self.client.GetHIT(HITId)
+        summary = collector.summary()['GetHIT']
+        self.assertEqual(summary['calls'], 4)
+        self.assertEqual(summary['errors'],
+                         {'AWS.MechanicalTurk.HITDoesNotExist': 1})
+        self.assertEqual(summary['latency']['count'], 4)
+        self.assertTrue(summary['response_bytes'] > 0)
+        self.assertTrue(summary['phases']['parse']['max'] > 0)
+
+    def test_histogram_percentiles(self):
+        histogram = pyturk.Histogram((1, 2, 5))
+        for value in [0.5] * 50 + [1.5] * 40 + [4] * 9 + [7]:
+            histogram.add(value)
+        self.assertEqual(histogram.percentile(50), 1)
+        self.assertEqual(histogram.percentile(90), 2)
+        self.assertEqual(histogram.percentile(99), 5)
+        self.assertEqual(histogram.percentile(100), 7)
+
+
+class SignerTest(unittest.TestCase):
+
+    def test_signatures_match_a_fresh_hmac(self):
+        signer = pyturk.Signer('secret', cache_size=2)
+        for stamp in ['2010-01-01T00:00:00Z', '2010-01-01T00:00:01Z'] * 2:
+            expected = base64.b64encode(hmac.new(
+                'secret', pyturk.SERVICE_NAME + 'GetHIT' + stamp,
+                hashlib.sha1).digest())
+            self.assertEqual(signer.sign('GetHIT', stamp), expected)
+        self.assertEqual(signer.stats(), dict(hits=2, misses=2, size=2))
+        signer.sign('GetHIT', '2010-01-01T00:00:02Z')
+        self.assertEqual(signer.stats()['size'], 2)
+        signer.clear()
+        self.assertEqual(signer.stats()['size'], 0)
+
+    def test_signers_are_shared_per_secret(self):
+        self.assertTrue(pyturk.get_signer('a') is pyturk.get_signer('a'))
+        self.assertFalse(pyturk.get_signer('a') is pyturk.get_signer('b'))
+
+
+class CacheTest(FakeTestCase):
+
+    def test_writes_invalidate_cached_hits(self):
+        HITId = self.fake.populate(hits=1, assignments=0)[0]
+        self.client.enable_cache()
+        self.assertEqual(self.client.GetHIT(HITId)['HITStatus'],
+                         'Assignable')
+        self.client.DisableHIT(HITId)
+        self.assertRaises(pyturk.MTurkError, self.client.GetHIT, HITId)
+
+    def test_change_hit_type_invalidates(self):
+        HITId = self.fake.populate(hits=1, assignments=0)[0]
+        self.client.enable_cache()
+        self.assertEqual(self.client.GetHIT(HITId)['Reward'], '0.05')
+        HITTypeId = self.client.RegisterHITType(
+            Title='other', Description='other', Reward=0.2)['HITTypeID']
+        self.client.ChangeHITTypeOfHIT(HITId, HITTypeId)
+        self.assertEqual(self.client.GetHIT(HITId)['Reward'], '0.20')
+
+    def test_qualification_writes_invalidate_scores(self):
+        cache = pyturk.ResponseCache()
+        score = dict(QualificationTypeId='Q1', SubjectId='W1')
+        for operation, parameters in [
+                ('UpdateQualificationScore', dict(score, IntegerValue=5)),
+                ('RevokeQualification', score),
+                ('AssignQualification',
+                 dict(QualificationTypeId='Q1', WorkerId='W1')),
+                ('GrantQualification', dict(QualificationRequestId='R1'))]:
+            cache.put('GetQualificationScore', score, 'cached', cache.version)
+            cache.put('GetQualificationScore', dict(score, SubjectId='W2'),
+                      'other', cache.version)
+            cache.invalidate(operation, parameters)
+            self.assertEqual(cache.get('GetQualificationScore', score), None,
+                             operation)
+        self.assertEqual(cache.get('GetQualificationScore', dict(
+            score, SubjectId='W2')), None)
+
+
+class CoalescingTest(FakeTestCase):
+
+    def test_concurrent_identical_reads_share_a_request(self):
+        HITId = self.fake.populate(hits=1, assignments=0)[0]
+        self.fake.latency = 0.3
+        self.client.enable_coalescing()
+        results = []
+
+        def get(HITId):
+            try:
+                results.append(self.client.GetHIT(HITId)['HITStatus'])
+            except pyturk.MTurkError, e:
+                results.append(e.code)
+        threads = [threading.Thread(target=get, args=(h,))
+                   for h in [HITId] * 6 + ['NOPE'] * 2]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(sorted(results), [
+            'AWS.MechanicalTurk.HITDoesNotExist'] * 2 + ['Assignable'] * 6)
+        self.assertEqual(self.fake.counts['GetHIT'], 2)
+        self.assertEqual(self.client.single_flight.stats()['coalesced'], 6)
+
+    def test_reads_after_a_write_are_not_shared(self):
+        flights = pyturk.SingleFlight()
+        started, release = threading.Event(), threading.Event()
+
+        def slow():
+            started.set()
+            release.wait()
+            return 'before'
+        leader = threading.Thread(target=flights.do,
+                                  args=('GetHIT', {'HITId': 'H'}, slow))
+        leader.start()
+        started.wait()
+        flights.do('DisableHIT', {'HITId': 'H'}, lambda: None)
+        self.assertEqual(flights.do('GetHIT', {'HITId': 'H'},
+                                    lambda: 'after'), ('after', False))
+        release.set()
+        leader.join()
+        self.assertEqual(flights.stats()['resets'], 1)
+
+
+class PaginationTest(FakeTestCase):
+
+    def test_iter_search_hits_returns_every_hit_once(self):
+        HITIds = self.fake.populate(hits=250, assignments=0)
+        found = [hit['HITId'] for hit in self.client.iter_search_hits()]
+        self.assertEqual(sorted(found), sorted(HITIds))
+
+    def test_iter_assignments_for_hit(self):
+        HITId = self.fake.populate(
+            hits=1, assignments=150,
+            workers=['W%013dEXAMPLE' % i for i in range(150)])[0]
+        assignments = list(self.client.iter_assignments_for_hit(
+            HITId, PageSize=20))
+        self.assertEqual(len(set(a['AssignmentId'] for a in assignments)),
+                         150)
+
+
+class NotificationTest(FakeTestCase):
+
+    def setUp(self):
+        FakeTestCase.setUp(self)
+        self.fake.secret = 'secret'
+        self.receiver = pyturk.NotificationReceiver(
+            secret_access_key='secret')
+        self.url = self.receiver.start('127.0.0.1')
+
+    def tearDown(self):
+        self.receiver.stop()
+        FakeTestCase.tearDown(self)
+
+    def test_submitted_assignments_are_pushed(self):
+        HITId = self.fake.populate(hits=1, assignments=0)[0]
+        HITTypeId = self.fake.hits[HITId]['HITTypeId']
+        self.client.SetHITTypeNotification(HITTypeId, self.url,
+                                           'AssignmentSubmitted')
+        AssignmentId = self.fake.submit_assignment(HITId)
+        event = self.receiver.events.get(timeout=5)
+        self.assertEqual((event['EventType'], event['HITId'],
+                          event['AssignmentId']),
+                         ('AssignmentSubmitted', HITId, AssignmentId))
+        self.client.SendTestEventNotification(self.url)
+        self.assertEqual(self.receiver.events.get(timeout=5)['EventType'],
+                         'Ping')
+
+    def test_unsigned_notifications_are_refused(self):
+        self.assertEqual(self.receiver.handle(dict(
+            method='Notify', Timestamp='2010-01-01T00:00:00Z',
+            Signature='forged', **{'Event.1.EventType': 'Ping'})), 403)
+        self.assertEqual(self.receiver.rejected, 1)
+        self.assertTrue(self.receiver.events.empty())
+
+
+class ProjectionTest(FakeTestCase):
+
+    def test_response_groups_and_fields(self):
+        self.fake.populate(hits=3, assignments=0)
+        full = self.client.SearchHITs(PageSize=10)
+        minimal = self.client.SearchHITs(PageSize=10,
+                                         ResponseGroup='Minimal')
+        self.assertTrue('Title' in full[0])
+        self.assertFalse('Title' in minimal[0])
+        self.assertEqual([hit['HITId'] for hit in minimal],
+                         [hit['HITId'] for hit in full])
+        with pyturk.projection(fields=['HITId', 'HITStatus']):
+            projected = self.client.SearchHITs(PageSize=10)
+        self.assertEqual(sorted(projected[0].keys()), ['HITId', 'HITStatus'])
+        self.assertTrue('Title' in self.client.SearchHITs(PageSize=10)[0])
+
+
+class DownloadTest(FakeTestCase):
+
+    def test_downloads_resume_and_skip_finished_files(self):
+        HITId = self.fake.populate(hits=1, assignments=0)[0]
+        data = os.urandom(300000)
+        AssignmentId = self.fake.submit_assignment(
+            HITId, files={'photo': data, 'scan': 'small'})
+        path = self.path('%s_photo' % AssignmentId)
+        f = open(path + '.part', 'wb')
+        f.write(data[:1000])
+        f.close()
+        files = [(AssignmentId, 'photo'), (AssignmentId, 'scan'),
+                 (AssignmentId, 'missing')]
+        with self.client.activate():
+            results = dict((r.action[1]['QuestionIdentifier'], r) for r in
+                           pyturk.download_files(files, self.directory))
+            self.assertEqual(results['photo'].value['size'], 300000)
+            self.assertFalse(results['missing'].ok)
+            self.assertEqual(open(path, 'rb').read(), data)
+            self.assertEqual(open(self.path('%s_scan' % AssignmentId),
+                                  'rb').read(), 'small')
+            again = list(pyturk.download_files(files[:2], self.directory))
+        self.assertTrue(all(r.value['skipped'] for r in again))
+
+
+class NotifyTest(FakeTestCase):
+
+    def test_workers_are_chunked_once_each(self):
+        workers = ['W%03d' % i for i in range(250)] * 2
+        with self.client.activate():
+            results = pyturk.notify_workers('Hi', 'news', workers)
+        self.assertEqual([len(r.action[1]['WorkerId']) for r in results],
+                         [100, 100, 50])
+        self.assertTrue(all(r.ok for r in results))
+        sent = sum((m['WorkerIds'] for m in self.fake.messages), [])
+        self.assertEqual(sorted(sent), sorted(set(workers)))
+
+
+class ReconcileTest(FakeTestCase):
+
+    def test_only_differences_are_sent(self):
+        QualificationTypeId = self.client.CreateQualificationType(
+            'Skill', 'skill test')['QualificationTypeId']
+        for WorkerId, score in [('W1', 10), ('W2', 20), ('W3', 30)]:
+            self.client.AssignQualification(QualificationTypeId, WorkerId,
+                                            score)
+        with self.client.activate():
+            counts = pyturk.reconcile_qualification(
+                QualificationTypeId, {'W1': 10, 'W2': 25, 'W4': 40})
+            granted = dict(
+                (q['SubjectId'], q['IntegerValue']) for q in
+                pyturk.iter_qualifications_for_qualification_type(
+                    QualificationTypeId, 'Granted'))
+        self.assertEqual((counts['granted'], counts['updated'],
+                          counts['revoked'], counts['unchanged'],
+                          counts['failed']), (1, 1, 1, 1, 0))
+        self.assertEqual(self.fake.counts['AssignQualification'], 4)
+        self.assertEqual(self.fake.counts['UpdateQualificationScore'], 1)
+        self.assertEqual(granted, {'W1': '10', 'W2': '25', 'W4': '40'})
+
+
+class PipelineTest(FakeTestCase):
+
+    def approve(self, HITId, assignments):
+        return [('ApproveAssignment', {'AssignmentId': a['AssignmentId']})
+                for a in assignments if a['AssignmentStatus'] == 'Submitted']
+
+    def test_reviews_every_reviewable_hit(self):
+        self.fake.populate(hits=250, assignments=1)
+        pipeline = pyturk.ReviewPipeline(self.approve, client=self.client)
+        stats = pipeline.run()
+        self.assertEqual(stats['errors'], 0)
+        self.assertEqual(stats['stages']['dispose']['processed'], 250)
+        self.assertEqual(self.client.GetReviewableHITs()['TotalNumResults'],
+                         '0')
+
+    def test_only_reviewable_events_are_taken(self):
+        HITId = self.fake.populate(hits=1, assignments=1)[0]
+        events = [pyturk.Event(dict(EventType='AssignmentSubmitted',
+                                    HITId=HITId)),
+                  pyturk.Event(dict(EventType='HITReviewable', HITId=HITId))]
+        pipeline = pyturk.ReviewPipeline(self.approve, events,
+                                         client=self.client)
+        stats = pipeline.run()
+        self.assertEqual(stats['errors'], 0)
+        self.assertEqual(stats['stages']['reserve']['processed'], 1)
+
+
+class MirrorTest(FakeTestCase):
+
+    def test_sync_only_fetches_what_changed(self):
+        HITIds = self.fake.populate(hits=4, assignments=3)
+        mirror = turkmirror.Mirror(self.path('mirror.db'), self.client)
+        try:
+            self.assertEqual(mirror.sync()['assignments'], 12)
+            self.assertEqual(mirror.sync()['changed'], 0)
+            self.client.DisableHIT(HITIds[0])
+            self.assertEqual(mirror.sync()['removed'], 1)
+            self.assertEqual(mirror.hit(HITIds[0]), None)
+            mirror.mark_stale(HITIds[1])
+            self.assertEqual(mirror.sync()['assignments'], 3)
+            assignment = list(mirror.assignments(HITIds[2]))[0]
+            self.client.ApproveAssignment(assignment['AssignmentId'])
+            mirror.refresh(HITIds[2])
+            self.assertEqual(mirror.assignment(assignment['AssignmentId'])[
+                'AssignmentStatus'], 'Approved')
+            self.assertEqual(mirror.worker(assignment['WorkerId'])[
+                'approved'], 1)
+        finally:
+            mirror.close()
+
+
+class PublishTest(FakeTestCase):
+
+    def test_duplicate_rows_are_checkpointed(self):
+        rows = [dict(Title='t', Description='d', Reward='0.10',
+                     ExternalURL='http://example.com/%d' % i,
+                     LifetimeInSeconds=3600) for i in range(4)]
+        checkpoint = self.path('done')
+        publisher = turkpublish.Publisher(checkpoint, client=self.client)
+        list(publisher.publish(rows))
+        publisher.close()
+        lines = open(checkpoint).readlines()
+        open(checkpoint, 'w').writelines(lines[:2])
+        publisher = turkpublish.Publisher(checkpoint, client=self.client)
+        results = list(publisher.publish(rows))
+        publisher.close()
+        self.assertEqual(publisher.duplicates, 2)
+        self.assertTrue(all(result.ok for key, result in results))
+        self.assertEqual(len(self.fake.hits), 4)
+        self.assertEqual(len(turkpublish.Checkpoint(checkpoint).done), 4)
+
+
+class AnswersTest(unittest.TestCase):
+
+    def setUp(self):
+        if turkanswers.numpy is None:
+            self.skipTest('numpy not installed')
+        self.table = turkanswers.AnswerTable()
+        for worker, answer in [('W1', 'cat'), ('W2', 'cat'), ('W3', 'dog')]:
+            self.table.add('H1', worker, {'q': answer})
+        self.table.add('H2', 'W1', {'q': ['b', 'a']})
+        self.table.add('H2', 'W3', {'q': 'a|b'})
+
+    def test_consensus(self):
+        self.assertEqual(self.table.consensus(),
+                         {('H1', 'q'): 'cat', ('H2', 'q'): 'a|b'})
+        agreement = self.table.agreement()
+        self.assertAlmostEqual(agreement[0], 1 / 3.0)
+        self.assertEqual(agreement[1], 1.0)
+        self.assertEqual(self.table.worker_agreement(),
+                         {'W1': 1.0, 'W2': 1.0, 'W3': 0.5})
+        self.assertEqual(self.table.accuracy({('H1', 'q'): 'dog'}),
+                         {'W1': 0.0, 'W2': 0.0, 'W3': 1.0})
+
+    def test_columns_survive_later_answers(self):
+        item, worker, code = self.table.columns()
+        for i in range(10000):
+            self.table.add('H%d' % i, 'W9', {'q': 'fish'})
+        self.assertEqual(item.tolist(), [0, 0, 0, 1, 1])
+        self.assertEqual(code.tolist(), [0, 0, 1, 2, 2])
+
+
+class SnapshotTest(unittest.TestCase):
+
+    def test_arrays_outlive_the_snapshot(self):
+        if turksnapshot.numpy is None:
+            self.skipTest('numpy not installed')
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'snapshot')
+            with turksnapshot.SnapshotWriter(path) as writer:
+                for i in range(100):
+                    writer.add_assignment(dict(
+                        AssignmentId='A%d' % i, WorkerId='W%d' % (i % 3),
+                        SubmitTime='2010-07-22T18:33:25Z'))
+            with turksnapshot.open_snapshot(path) as snapshot:
+                self.assertEqual(len(snapshot.assignments.where(
+                    AssignmentStatus='NoSuchStatus')), 0)
+                self.assertEqual(len(snapshot.assignments.where(
+                    WorkerId=['W0', 'W9'])), 34)
+                times = snapshot.assignments['SubmitTime'].array()
+                column = snapshot.assignments['WorkerId']
+                self.assertEqual(len(snapshot.assignments.where(
+                    WorkerId='W1')), 33)
+            self.assertEqual(times.sum(), 100 * 1279823605.0)
+            self.assertRaises(ValueError, column.__getitem__, 0)
+        finally:
+            shutil.rmtree(directory)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# Copyright (c) 2010 Nathan Morris, nathan.ms@gmail.com
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish, dis-
+# tribute, sublicense, and/or sell copies of the Software, and to permit
+# persons to whom the Software is furnished to do so, subject to the fol-
+# lowing conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABIL
+# ITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT
+# SHALL THE AUTHOR BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+
+# columnar answer tables and batch aggregation, needs numpy
+#
+#   table = turkanswers.AnswerTable()
+#   for HITId in HITIds:
+#       table.extend(pyturk.iter_assignments_for_hit(HITId))
+#   consensus = table.consensus()        # {(HITId, question): answer}
+#   accuracy = table.accuracy(gold)      # {WorkerId: fraction correct}
+#
+# Every answer is one row of three parallel integer columns: the item
+# answered (a HITId, QuestionIdentifier pair), the worker and the answer
+# code, an index into the distinct answer values. Aggregations are done
+# on those columns with numpy, without a Python loop per answer.
+
+
+import array
+
+import pyturk
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def _require_numpy():
+    if numpy is None:
+        raise ImportError('answer aggregation needs numpy')
+
+
+class _Index(object):
+    # distinct values numbered in order of first appearance
+
+    def __init__(self):
+        self.values = []
+        self.codes = {}
+
+    def code(self, value):
+        code = self.codes.get(value)
+        if code is None:
+            code = self.codes[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def __len__(self):
+        return len(self.values)
+
+
+class AnswerTable(object):
+    """Answers of many assignments as item, worker and answer columns.
+
+    Multiple selections are stored as one answer, their identifiers
+    sorted and joined with '|'. Ties in majority votes go to the answer
+    value that was seen first.
+    """
+
+    def __init__(self, assignments=None):
+        self.items = _Index()
+        self.workers = _Index()
+        self.answers = _Index()
+        self._item = array.array('i')
+        self._worker = array.array('i')
+        self._code = array.array('i')
+        if assignments is not None:
+            self.extend(assignments)
+
+    def add(self, HITId, WorkerId, answers):
+        """Add one assignment's decoded answers (see pyturk.parse_answers)."""
+        worker = self.workers.code(WorkerId)
+        for question, value in answers.iteritems():
+            if isinstance(value, list):
+                value = '|'.join(sorted(value))
+            self._item.append(self.items.code((HITId, question)))
+            self._worker.append(worker)
+            self._code.append(self.answers.code(value))
+
+    def extend(self, assignments):
+        for assignment in assignments:
+            self.add(assignment['HITId'], assignment['WorkerId'],
+                     pyturk.parse_answers(assignment.get('Answer')))
+
+    def __len__(self):
+        return len(self._code)
+
+    def columns(self):
+        """The (item, worker, answer) columns as numpy arrays.
+
+        The arrays are copies, adding answers later leaves them as they were.
+        """
+        _require_numpy()
+        # views would point into the array buffers, which move as they grow
+        return (numpy.frombuffer(self._item, numpy.intc).copy(),
+                numpy.frombuffer(self._worker, numpy.intc).copy(),
+                numpy.frombuffer(self._code, numpy.intc).copy())
+
+    def majority_vote(self):
+        """Per item arrays (answer code, its votes, all votes).
+
+        Items nobody answered have code -1.
+        """
+        item, worker, code = self.columns()
+        n_items, n_answers = len(self.items), max(len(self.answers), 1)
+        key = item.astype(numpy.int64) * n_answers + code
+        pairs, votes = numpy.unique(key, return_counts=True)
+        pair_item = pairs // n_answers
+        pair_code = pairs % n_answers
+        # per item, most votes first and the earliest answer code on ties
+        order = numpy.lexsort((pair_code, -votes, pair_item))
+        first = numpy.ones(len(order), bool)
+        first[1:] = pair_item[order][1:] != pair_item[order][:-1]
+        winners = order[first]
+        winner = numpy.full(n_items, -1, numpy.int64)
+        winner_votes = numpy.zeros(n_items, numpy.int64)
+        winner[pair_item[winners]] = pair_code[winners]
+        winner_votes[pair_item[winners]] = votes[winners]
+        total = numpy.bincount(item, minlength=n_items)
+        return winner, winner_votes, total
+
+    def consensus(self):
+        """{(HITId, QuestionIdentifier): majority answer}"""
+        winner, votes, total = self.majority_vote()
+        values = self.answers.values
+        return dict((key, values[code]) for key, code in
+                    zip(self.items.values, winner.tolist()) if code >= 0)
+
+    def agreement(self):
+        """Per item share of worker pairs that gave the same answer.
+
+        Items with fewer than two answers are nan. numpy.nanmean() of
+        the result is the observed agreement over the whole table.
+        """
+        item, worker, code = self.columns()
+        n_items, n_answers = len(self.items), max(len(self.answers), 1)
+        key = item.astype(numpy.int64) * n_answers + code
+        pairs, votes = numpy.unique(key, return_counts=True)
+        votes = votes.astype(numpy.float64)
+        agreeing = numpy.bincount(pairs // n_answers,
+                                  weights=votes * (votes - 1),
+                                  minlength=n_items)
+        total = numpy.bincount(item, minlength=n_items).astype(numpy.float64)
+        possible = total * (total - 1)
+        result = numpy.full(n_items, numpy.nan)
+        answered = possible > 0
+        result[answered] = agreeing[answered] / possible[answered]
+        return result
+
+    def worker_agreement(self):
+        """{WorkerId: share of their answers that match the majority}"""
+        item, worker, code = self.columns()
+        winner = self.majority_vote()[0]
+        agree = (winner[item] == code).astype(numpy.float64)
+        return self._per_worker(worker, agree)
+
+    def accuracy(self, gold):
+        """{WorkerId: share correct} over the items in gold, a dict of
+        {(HITId, QuestionIdentifier): answer}. Workers who answered no
+        gold item are left out.
+        """
+        item, worker, code = self.columns()
+        expected = numpy.full(len(self.items), -2, numpy.int64)
+        for key, value in gold.iteritems():
+            index = self.items.codes.get(key)
+            if index is not None:
+                if isinstance(value, list):
+                    value = '|'.join(sorted(value))
+                expected[index] = self.answers.codes.get(value, -1)
+        graded = expected[item] != -2
+        correct = (expected[item] == code)[graded].astype(numpy.float64)
+        return self._per_worker(worker[graded], correct)
+
+    def _per_worker(self, worker, scores):
+        n = len(self.workers)
+        counts = numpy.bincount(worker, minlength=n)
+        sums = numpy.bincount(worker, weights=scores, minlength=n)
+        return dict((self.workers.values[i], sums[i] / counts[i])
+                    for i in numpy.flatnonzero(counts).tolist())
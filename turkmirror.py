@@ -0,0 +1,338 @@
+#!/usr/bin/env python
+# Copyright (c) 2010 Nathan Morris, nathan.ms@gmail.com
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish, dis-
+# tribute, sublicense, and/or sell copies of the Software, and to permit
+# persons to whom the Software is furnished to do so, subject to the fol-
+# lowing conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABIL
+# ITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT
+# SHALL THE AUTHOR BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+
+# local sqlite mirror of an account's HITs, assignments and workers
+#
+#   mirror = turkmirror.Mirror('account.db')
+#   mirror.sync()
+#   for assignment in mirror.assignments(WorkerId=w, status='Submitted'):
+#       ...
+#
+# sync() pages through SearchHITs and compares every HIT's status, review
+# status and assignment counts with what was stored last time. Only HITs
+# that changed (plus new ones, ones with submitted assignments that are
+# due for auto-approval, and ones marked stale) have their assignments
+# fetched again, so a sync of a quiet account costs one request per 100
+# HITs. HITs that SearchHITs no longer returns are dropped.
+
+
+import time
+import sqlite3
+
+import pyturk
+
+# SearchHITs response groups that carry the status and assignment counts
+SEARCH_RESPONSE_GROUPS = ('Minimal', 'HITDetail', 'HITAssignmentSummary')
+
+HIT_FIELDS = ('HITId', 'HITTypeId', 'CreationTime', 'Title', 'Description',
+              'Keywords', 'HITStatus', 'HITReviewStatus', 'MaxAssignments',
+              'Reward.Amount', 'Reward.CurrencyCode', 'Expiration',
+              'AutoApprovalDelayInSeconds', 'AssignmentDurationInSeconds',
+              'NumberOfAssignmentsPending', 'NumberOfAssignmentsAvailable',
+              'NumberOfAssignmentsCompleted', 'RequesterAnnotation')
+
+ASSIGNMENT_FIELDS = ('AssignmentId', 'WorkerId', 'HITId', 'AssignmentStatus',
+                     'AutoApprovalTime', 'AcceptTime', 'SubmitTime',
+                     'ApprovalTime', 'RejectionTime', 'Deadline',
+                     'RequesterFeedback', 'Answer')
+
+# a HIT is fetched again when any of these differ from the stored copy
+SIGNATURE_FIELDS = ('HITStatus', 'HITReviewStatus', 'MaxAssignments',
+                    'Expiration', 'NumberOfAssignmentsPending',
+                    'NumberOfAssignmentsAvailable',
+                    'NumberOfAssignmentsCompleted')
+
+
+def column(field):
+    return field.replace('.', '_')
+
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS hits (
+    %s,
+    signature TEXT,
+    stale INTEGER NOT NULL DEFAULT 0,
+    synced REAL,
+    PRIMARY KEY (HITId)
+);
+CREATE INDEX IF NOT EXISTS hits_status ON hits (HITStatus);
+CREATE INDEX IF NOT EXISTS hits_review_status ON hits (HITReviewStatus);
+CREATE INDEX IF NOT EXISTS hits_type ON hits (HITTypeId);
+
+CREATE TABLE IF NOT EXISTS assignments (
+    %s,
+    synced REAL,
+    PRIMARY KEY (AssignmentId)
+);
+CREATE INDEX IF NOT EXISTS assignments_hit ON assignments (HITId);
+CREATE INDEX IF NOT EXISTS assignments_worker
+    ON assignments (WorkerId, AssignmentStatus);
+CREATE INDEX IF NOT EXISTS assignments_status
+    ON assignments (AssignmentStatus, AutoApprovalTime);
+
+CREATE TABLE IF NOT EXISTS workers (
+    WorkerId TEXT PRIMARY KEY,
+    assignments INTEGER,
+    submitted INTEGER,
+    approved INTEGER,
+    rejected INTEGER,
+    first_submit TEXT,
+    last_submit TEXT
+);
+
+CREATE TABLE IF NOT EXISTS sync_state (
+    name TEXT PRIMARY KEY,
+    value
+);
+''' % (',\n    '.join('%s TEXT' % column(f) for f in HIT_FIELDS),
+       ',\n    '.join('%s TEXT' % column(f) for f in ASSIGNMENT_FIELDS))
+
+
+def signature(hit):
+    return '|'.join(hit.get(field) or '' for field in SIGNATURE_FIELDS)
+
+
+class Mirror(object):
+    """SQLite copy of an account, refreshed incrementally by sync().
+
+    The database is only used from the thread that created the Mirror;
+    requests made by sync() go through `client` (the current client when
+    the Mirror was created, see pyturk.Client) and are spread over
+    `window` threads.
+    """
+
+    def __init__(self, path=':memory:', client=None, window=None):
+        self.path = path
+        self.client = client or pyturk.current_client()
+        self.window = window
+        self.db = sqlite3.connect(path)
+        self.db.text_factory = str
+        self.db.executescript(SCHEMA)
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    # syncing
+
+    def sync(self, full=False):
+        """Bring the mirror up to date, returning a dict of counts.
+
+        full=True fetches the assignments of every HIT, not only the
+        ones that changed.
+        """
+        started = time.time()
+        stored = dict(self.db.execute(
+            'SELECT HITId, CASE WHEN stale THEN NULL ELSE signature END '
+            'FROM hits'))
+        due = set(row[0] for row in self.db.execute(
+            'SELECT DISTINCT HITId FROM assignments '
+            'WHERE AssignmentStatus = ? AND AutoApprovalTime <= ?',
+            ('Submitted', pyturk.generate_timestamp(time.gmtime()))))
+        with self.client.activate():
+            hits = list(pyturk.iter_search_hits(
+                window=self.window, ResponseGroup=SEARCH_RESPONSE_GROUPS,
+                fields=HIT_FIELDS))
+        seen = set()
+        changed = []
+        for hit in hits:
+            seen.add(hit['HITId'])
+            if full or hit['HITId'] in due or \
+                    stored.get(hit['HITId']) != signature(hit):
+                changed.append(hit)
+        fetched = self.refresh_hits(changed)
+        removed = [HITId for HITId in stored if HITId not in seen]
+        self.remove_hits(removed)
+        self.set_state('last_sync', started)
+        return dict(hits=len(hits), changed=len(changed),
+                    removed=len(removed), assignments=fetched,
+                    elapsed=time.time() - started)
+
+    def refresh_hits(self, hits):
+        """Store `hits` (HIT records) and fetch their assignments again.
+
+        Each HIT is committed together with its assignments, so an
+        interrupted sync picks up where it stopped. Returns the number
+        of assignments stored.
+        """
+        def fetch(hit):
+            return list(pyturk.iter_assignments_for_hit(
+                hit['HITId'], fields=ASSIGNMENT_FIELDS))
+
+        with self.client.activate():
+            results = pyturk.prefetch(fetch, hits, self.window)
+        count = 0
+        try:
+            for hit, assignments in zip(hits, results):
+                self.store(hit, assignments)
+                count += len(assignments)
+        finally:
+            results.close()
+        return count
+
+    def refresh(self, HITId):
+        # fetch one HIT and its assignments now
+        with self.client.activate():
+            result = pyturk.call('GetHIT', {'HITId': HITId},
+                                 SEARCH_RESPONSE_GROUPS, HIT_FIELDS)
+        return self.refresh_hits(result.all('HIT'))
+
+    def mark_stale(self, HITId):
+        # have the next sync() fetch this HIT's assignments again
+        self.db.execute('UPDATE hits SET stale = 1 WHERE HITId = ?', (HITId,))
+        self.db.commit()
+
+    def store(self, hit, assignments):
+        now = time.time()
+        db = self.db
+        HITId = hit['HITId']
+        old_workers = [row[0] for row in db.execute(
+            'SELECT DISTINCT WorkerId FROM assignments WHERE HITId = ?',
+            (HITId,))]
+        db.execute('DELETE FROM assignments WHERE HITId = ?', (HITId,))
+        db.executemany(
+            'INSERT OR REPLACE INTO assignments VALUES (%s)'
+            % ', '.join('?' * (len(ASSIGNMENT_FIELDS) + 1)),
+            [[a.get(field) for field in ASSIGNMENT_FIELDS] + [now]
+             for a in assignments])
+        db.execute(
+            'INSERT OR REPLACE INTO hits VALUES (%s)'
+            % ', '.join('?' * (len(HIT_FIELDS) + 3)),
+            [hit.get(field) for field in HIT_FIELDS] +
+            [signature(hit), 0, now])
+        self.update_workers(set(old_workers) |
+                            set(a['WorkerId'] for a in assignments))
+        db.commit()
+
+    def remove_hits(self, HITIds):
+        db = self.db
+        workers = set()
+        for HITId in HITIds:
+            workers.update(row[0] for row in db.execute(
+                'SELECT DISTINCT WorkerId FROM assignments WHERE HITId = ?',
+                (HITId,)))
+            db.execute('DELETE FROM assignments WHERE HITId = ?', (HITId,))
+            db.execute('DELETE FROM hits WHERE HITId = ?', (HITId,))
+        self.update_workers(workers)
+        db.commit()
+
+    def update_workers(self, WorkerIds):
+        db = self.db
+        for WorkerId in WorkerIds:
+            db.execute('DELETE FROM workers WHERE WorkerId = ?', (WorkerId,))
+            db.execute(
+                'INSERT INTO workers '
+                'SELECT WorkerId, COUNT(*), '
+                '  SUM(AssignmentStatus = \'Submitted\'), '
+                '  SUM(AssignmentStatus = \'Approved\'), '
+                '  SUM(AssignmentStatus = \'Rejected\'), '
+                '  MIN(SubmitTime), MAX(SubmitTime) '
+                'FROM assignments WHERE WorkerId = ? GROUP BY WorkerId',
+                (WorkerId,))
+
+    def get_state(self, name, default=None):
+        row = self.db.execute('SELECT value FROM sync_state WHERE name = ?',
+                              (name,)).fetchone()
+        if row is None:
+            return default
+        return row[0]
+
+    def set_state(self, name, value):
+        self.db.execute('INSERT OR REPLACE INTO sync_state VALUES (?, ?)',
+                        (name, value))
+        self.db.commit()
+
+    # queries, answered from the database only
+
+    def select(self, cls, table, fields, conditions, order):
+        where = [(column(name) + ' = ?', value)
+                 for name, value in conditions if value is not None]
+        sql = 'SELECT %s FROM %s' % (', '.join(map(column, fields)), table)
+        if where:
+            sql += ' WHERE ' + ' AND '.join(clause for clause, v in where)
+        sql += ' ORDER BY ' + order
+        for row in self.db.execute(sql, [v for clause, v in where]):
+            yield cls((field, value) for field, value in zip(fields, row)
+                      if value is not None)
+
+    def hits(self, HITStatus=None, HITReviewStatus=None, HITTypeId=None):
+        return self.select(pyturk.HIT, 'hits', HIT_FIELDS,
+                           [('HITStatus', HITStatus),
+                            ('HITReviewStatus', HITReviewStatus),
+                            ('HITTypeId', HITTypeId)], 'CreationTime')
+
+    def hit(self, HITId):
+        for hit in self.select(pyturk.HIT, 'hits', HIT_FIELDS,
+                               [('HITId', HITId)], 'HITId'):
+            return hit
+        return None
+
+    def assignments(self, HITId=None, WorkerId=None, status=None):
+        return self.select(pyturk.Assignment, 'assignments',
+                           ASSIGNMENT_FIELDS,
+                           [('HITId', HITId), ('WorkerId', WorkerId),
+                            ('AssignmentStatus', status)], 'SubmitTime')
+
+    def assignment(self, AssignmentId):
+        for assignment in self.select(pyturk.Assignment, 'assignments',
+                                      ASSIGNMENT_FIELDS,
+                                      [('AssignmentId', AssignmentId)],
+                                      'AssignmentId'):
+            return assignment
+        return None
+
+    def workers(self):
+        cursor = self.db.execute('SELECT * FROM workers ORDER BY WorkerId')
+        names = [d[0] for d in cursor.description]
+        return [dict(zip(names, row)) for row in cursor]
+
+    def worker(self, WorkerId):
+        cursor = self.db.execute('SELECT * FROM workers WHERE WorkerId = ?',
+                                 (WorkerId,))
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip([d[0] for d in cursor.description], row))
+
+
+if __name__ == '__main__':
+    import optparse
+    parser = optparse.OptionParser(usage='%prog [options] DATABASE')
+    parser.add_option('--full', action='store_true',
+                      help='fetch the assignments of every HIT')
+    parser.add_option('--sandbox', action='store_true')
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error('a database path is required')
+    pyturk.SANDBOXP = options.sandbox
+    mirror = Mirror(args[0])
+    try:
+        print mirror.sync(options.full)
+    finally:
+        mirror.close()
@@ -0,0 +1,242 @@
+#!/usr/bin/env python
+# Copyright (c) 2010 Nathan Morris, nathan.ms@gmail.com
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish, dis-
+# tribute, sublicense, and/or sell copies of the Software, and to permit
+# persons to whom the Software is furnished to do so, subject to the fol-
+# lowing conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABIL
+# ITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT
+# SHALL THE AUTHOR BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+
+# bulk HIT publishing from a csv or jsonl file
+#
+#   python turkpublish.py hits.jsonl --checkpoint hits.done
+#
+# Every row holds CreateHIT arguments (Title, Description, Reward,
+# Question or ExternalURL, MaxAssignments, ...). RegisterHITType is called
+# once per distinct set of HIT type attributes and the HITs themselves are
+# created concurrently with only HITTypeId, Question and the per-HIT
+# settings. Each published row is appended to the checkpoint file, so
+# running the same command again after a crash skips what is already up,
+# and every row is sent with a UniqueRequestToken of its own so that a
+# HIT created but not yet checkpointed is not created twice.
+
+
+import os
+import re
+import sys
+import csv
+import json
+import hashlib
+
+import pyturk
+
+# CreateHIT arguments that belong to the HIT type
+HIT_TYPE_FIELDS = ('Title', 'Description', 'Reward',
+                   'AssignmentDurationInSeconds', 'Keywords',
+                   'AutoApprovalDelayInSeconds', 'QualificationRequirement')
+
+# CreateHIT arguments sent with every HIT
+HIT_FIELDS = ('Question', 'LifetimeInSeconds', 'MaxAssignments',
+              'RequesterAnnotation')
+
+# checkpointed in place of the HITId of a row that an earlier run
+# published, when the DuplicateRequest error doesn't say which HIT it was
+UNKNOWN_HITID = '-'
+
+_duplicate_hitid = re.compile(r'HIT ?I[Dd]\W+([A-Z0-9]+)')
+
+
+def duplicate_hitid(error):
+    # the HITId named in a DuplicateRequest error message, if any
+    match = _duplicate_hitid.search(getattr(error, 'message', '') or '')
+    return match and match.group(1) or None
+
+
+def read_rows(path):
+    """Yield rows of a .csv (with a header line) or .jsonl file as dicts."""
+    f = open(path, 'rb')
+    try:
+        if path.endswith('.csv'):
+            for row in csv.DictReader(f):
+                yield row
+        else:
+            for line in f:
+                if line.strip():
+                    yield json.loads(line)
+    finally:
+        f.close()
+
+
+def create_hit_arguments(row):
+    # the default template: rows are CreateHIT arguments, optionally with
+    # an ExternalURL (and FrameHeight) instead of a Question
+    arguments = dict((str(k), v) for k, v in row.iteritems()
+                     if v not in (None, ''))
+    if 'Question' not in arguments and 'ExternalURL' in arguments:
+        arguments['Question'] = pyturk.externalQuestion(
+            arguments.pop('ExternalURL'), arguments.pop('FrameHeight', None))
+    return arguments
+
+
+class Checkpoint(object):
+    """Append-only record of published rows: one "key<TAB>HITId" line each."""
+
+    def __init__(self, path):
+        self.path = path
+        self.done = {}
+        try:
+            f = open(path)
+        except IOError:
+            pass
+        else:
+            for line in f:
+                if line.endswith('\n'):
+                    key, HITId = line[:-1].split('\t', 1)
+                    self.done[key] = HITId
+            f.close()
+        self.file = open(path, 'a')
+
+    def __contains__(self, key):
+        return key in self.done
+
+    def token(self, key):
+        # the UniqueRequestToken of a row, the same on every run
+        return hashlib.sha1('%s\t%s' % (os.path.abspath(self.path),
+                                         key)).hexdigest()
+
+    def add(self, key, HITId):
+        self.done[key] = HITId
+        self.file.write('%s\t%s\n' % (key, HITId))
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+class Publisher(object):
+    """Create one HIT per row, reusing HIT types and skipping done rows.
+
+    `template` turns a row into CreateHIT arguments (see
+    create_hit_arguments), `key` names the column that identifies a row
+    in the checkpoint (by default its position in the input).
+    """
+
+    def __init__(self, checkpoint=None, template=None, key=None,
+                 concurrency=None, timeout=None, client=None):
+        self.checkpoint = checkpoint and Checkpoint(checkpoint)
+        self.template = template or create_hit_arguments
+        self.key = key
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.client = client or pyturk.current_client()
+        self.hit_types = {}
+        self.skipped = 0
+        self.duplicates = 0
+        self.stats = None
+
+    def hit_type(self, arguments):
+        """HITTypeId for the type attributes in arguments, registered once."""
+        attributes = dict((name, arguments[name]) for name in HIT_TYPE_FIELDS
+                          if name in arguments)
+        signature = repr(sorted(attributes.items()))
+        HITTypeId = self.hit_types.get(signature)
+        if HITTypeId is None:
+            with self.client.activate():
+                result = pyturk.RegisterHITType(**attributes)
+            HITTypeId = result['HITTypeID']
+            if not HITTypeId:
+                raise pyturk.MTurkError(None, 'RegisterHITType failed',
+                                        'RegisterHITType')
+            self.hit_types[signature] = HITTypeId
+        return HITTypeId
+
+    def actions(self, rows, keys):
+        for i, row in enumerate(rows):
+            if self.key:
+                key = str(row[self.key])
+            else:
+                key = str(i)
+            if self.checkpoint and key in self.checkpoint:
+                self.skipped += 1
+                continue
+            arguments = self.template(row)
+            parameters = dict((name, arguments[name]) for name in HIT_FIELDS
+                              if name in arguments)
+            parameters['HITTypeId'] = self.hit_type(arguments)
+            if self.checkpoint:
+                # a row whose HIT was created just before a crash, but
+                # not checkpointed, comes back as a DuplicateRequest next
+                # time and is checkpointed then
+                parameters['UniqueRequestToken'] = self.checkpoint.token(key)
+            action = ('CreateHIT', parameters)
+            keys[id(action)] = key
+            yield action
+
+    def publish(self, rows):
+        """Publish rows, yielding (key, BulkResult) as HITs are created."""
+        keys = {}
+        with self.client.activate():
+            run = pyturk.bulk(self.actions(rows, keys), self.concurrency,
+                              self.timeout)
+        self.stats = run.stats
+        for result in run:
+            key = keys.pop(id(result.action))
+            if result.code == 'AWS.MechanicalTurk.DuplicateRequest':
+                # created by an earlier run that stopped before the
+                # checkpoint was written: published, not failed
+                self.duplicates += 1
+                HITId = duplicate_hitid(result.error) or UNKNOWN_HITID
+                result = pyturk.BulkResult(result.action, True,
+                                           dict(HITId=HITId),
+                                           latency=result.latency)
+            if result.ok and self.checkpoint:
+                self.checkpoint.add(key, result.value['HITId'])
+            yield key, result
+
+    def close(self):
+        if self.checkpoint:
+            self.checkpoint.close()
+
+
+if __name__ == '__main__':
+    import optparse
+    parser = optparse.OptionParser(usage='%prog [options] FILE')
+    parser.add_option('-c', '--checkpoint',
+                      help='file recording published rows (FILE.done)')
+    parser.add_option('-k', '--key',
+                      help='column identifying a row, default line number')
+    parser.add_option('-n', '--concurrency', type='int')
+    parser.add_option('--sandbox', action='store_true')
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error('an input file is required')
+    pyturk.SANDBOXP = options.sandbox
+    publisher = Publisher(options.checkpoint or args[0] + '.done',
+                          key=options.key, concurrency=options.concurrency)
+    failed = 0
+    try:
+        for key, result in publisher.publish(read_rows(args[0])):
+            if not result.ok:
+                failed += 1
+                print >> sys.stderr, 'row %s failed: %s %s' % (
+                    key, result.code, result.error or '')
+    finally:
+        publisher.close()
+    stats = publisher.stats()
+    print ('%d published, %d failed, %d skipped, %d HIT types in %.1fs'
+           % (stats['succeeded'] + publisher.duplicates, failed,
+              publisher.skipped, len(publisher.hit_types), stats['elapsed']))
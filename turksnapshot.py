@@ -0,0 +1,547 @@
+#!/usr/bin/env python
+# Copyright (c) 2010 Nathan Morris, nathan.ms@gmail.com
+#
+# Permission is hereby granted, free of charge, to any person obtaining a
+# copy of this software and associated documentation files (the
+# "Software"), to deal in the Software without restriction, including
+# without limitation the rights to use, copy, modify, merge, publish, dis-
+# tribute, sublicense, and/or sell copies of the Software, and to permit
+# persons to whom the Software is furnished to do so, subject to the fol-
+# lowing conditions:
+#
+# The above copyright notice and this permission notice shall be included
+# in all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS
+# OR IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABIL
+# ITY, FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT
+# SHALL THE AUTHOR BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER LIABILITY,
+# WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS
+# IN THE SOFTWARE.
+
+
+# columnar, memory-mapped snapshots of an account's HITs and assignments
+#
+#   python turksnapshot.py account.snapshot
+#
+#   snapshot = turksnapshot.open_snapshot('account.snapshot')
+#   rows = snapshot.assignments.where(AssignmentStatus='Submitted')
+#   submitted = snapshot.assignments['SubmitTime'].array()[rows]
+#
+# A snapshot is a directory with one file per column and a small
+# meta.json. Numbers and times are fixed width arrays; statuses, HIT
+# types, workers and other repeated strings are int32 codes into a
+# dictionary; unique strings such as AssignmentIds are an offsets array
+# into one blob. Records are written as they are crawled and opening a
+# snapshot only maps the files, so columns are read (or handed to numpy
+# without copying) on demand.
+
+
+import os
+import sys
+import mmap
+import json
+import time
+import array
+import shutil
+import struct
+import itertools
+import calendar
+
+import pyturk
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+FORMAT_VERSION = 1
+
+# column kinds: (struct format, numpy dtype, missing value)
+#   i  integers              t  times, as seconds since the epoch
+#   d  decimals              c  repeated strings, codes into a dictionary
+#   s  strings, offsets into a blob (missing strings are read back as '')
+KINDS = {
+    'i': ('i', 'i4', -1),
+    'd': ('d', 'f8', float('nan')),
+    't': ('d', 'f8', float('nan')),
+    'c': ('i', 'i4', -1),
+    's': ('q', 'i8', None),
+}
+
+HIT_COLUMNS = (
+    ('HITId', 's'), ('HITTypeId', 'c'), ('CreationTime', 't'),
+    ('Title', 'c'), ('HITStatus', 'c'), ('HITReviewStatus', 'c'),
+    ('MaxAssignments', 'i'), ('Reward.Amount', 'd'),
+    ('Reward.CurrencyCode', 'c'), ('Expiration', 't'),
+    ('AutoApprovalDelayInSeconds', 'i'), ('AssignmentDurationInSeconds', 'i'),
+    ('NumberOfAssignmentsPending', 'i'), ('NumberOfAssignmentsAvailable', 'i'),
+    ('NumberOfAssignmentsCompleted', 'i'), ('RequesterAnnotation', 's'))
+
+ASSIGNMENT_COLUMNS = (
+    ('AssignmentId', 's'), ('HITId', 'c'), ('WorkerId', 'c'),
+    ('AssignmentStatus', 'c'), ('AcceptTime', 't'), ('SubmitTime', 't'),
+    ('AutoApprovalTime', 't'), ('ApprovalTime', 't'), ('RejectionTime', 't'),
+    ('Deadline', 't'), ('RequesterFeedback', 's'))
+
+# rows buffered per column before they are appended to its file
+FLUSH_ROWS = 65536
+
+# HITs held in memory at once while export() fetches their assignments
+EXPORT_BATCH = 1000
+
+
+def _typecode(format):
+    # an array typecode with the same item size as the struct format
+    size = struct.calcsize(format)
+    for code in (format, 'l', 'q'):
+        try:
+            if array.array(code).itemsize == size:
+                return code
+        except ValueError:
+            pass
+    raise ValueError('no array type for %r' % format)
+
+
+def _seconds(value):
+    # '2010-07-22T18:33:25Z' -> seconds since the epoch
+    return calendar.timegm((int(value[0:4]), int(value[5:7]),
+                            int(value[8:10]), int(value[11:13]),
+                            int(value[14:16]), int(value[17:19]), 0, 0, 0))
+
+
+def _bytes(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def _column_file(directory, table, name, part):
+    return os.path.join(directory, '%s.%s.%s' % (table, name, part))
+
+
+class _BlobWriter(object):
+    # strings appended to a blob file, with their end offsets
+
+    def __init__(self, prefix):
+        self.data = open(prefix + '.data', 'wb')
+        self.offsets = open(prefix + '.offsets', 'wb')
+        self.ends = array.array(_typecode('q'), [0])
+        self.end = 0
+
+    def append(self, value):
+        if value:
+            self.data.write(value)
+            self.end += len(value)
+        self.ends.append(self.end)
+        if len(self.ends) >= FLUSH_ROWS:
+            self.flush()
+
+    def flush(self):
+        self.ends.tofile(self.offsets)
+        del self.ends[:]
+
+    def close(self):
+        self.flush()
+        self.data.close()
+        self.offsets.close()
+
+
+class _ColumnWriter(object):
+
+    def __init__(self, directory, table, name, kind):
+        self.name = name
+        self.kind = kind
+        prefix = os.path.join(directory, '%s.%s' % (table, name))
+        format, dtype, self.missing = KINDS[kind]
+        if kind == 's':
+            self.blob = _BlobWriter(prefix)
+            return
+        self.file = open(prefix + '.data', 'wb')
+        self.buffer = array.array(_typecode(format))
+        if kind == 'c':
+            self.codes = {}
+            self.dictionary = _BlobWriter(prefix + '.dictionary')
+
+    def append(self, value):
+        kind = self.kind
+        if kind == 's':
+            self.blob.append(_bytes(value))
+            return
+        if value is None or value == '':
+            value = self.missing
+        elif kind == 'c':
+            value = _bytes(value)
+            code = self.codes.get(value)
+            if code is None:
+                code = self.codes[value] = len(self.codes)
+                self.dictionary.append(value)
+            value = code
+        elif kind == 't':
+            value = _seconds(value)
+        elif kind == 'i':
+            value = int(value)
+        else:
+            value = float(value)
+        self.buffer.append(value)
+        if len(self.buffer) >= FLUSH_ROWS:
+            self.flush()
+
+    def flush(self):
+        self.buffer.tofile(self.file)
+        del self.buffer[:]
+
+    def close(self):
+        if self.kind == 's':
+            self.blob.close()
+            return
+        self.flush()
+        self.file.close()
+        if self.kind == 'c':
+            self.dictionary.close()
+
+
+class SnapshotWriter(object):
+    """Streams HIT and assignment records into a new snapshot.
+
+    Everything is written to `path`.tmp, which replaces `path` on close(),
+    so a crawl that dies part way leaves any earlier snapshot alone.
+    """
+
+    def __init__(self, path, answers=False):
+        self.path = path
+        self.directory = path.rstrip(os.sep) + '.tmp'
+        if os.path.exists(self.directory):
+            shutil.rmtree(self.directory)
+        os.makedirs(self.directory)
+        assignment_columns = ASSIGNMENT_COLUMNS
+        if answers:
+            assignment_columns += (('Answer', 's'),)
+        self.tables = {}
+        self.rows = {}
+        for table, columns in (('hits', HIT_COLUMNS),
+                               ('assignments', assignment_columns)):
+            self.tables[table] = [_ColumnWriter(self.directory, table, name,
+                                                kind)
+                                  for name, kind in columns]
+            self.rows[table] = 0
+
+    def add(self, table, record):
+        for column in self.tables[table]:
+            column.append(record.get(column.name))
+        self.rows[table] += 1
+
+    def add_hit(self, hit):
+        self.add('hits', hit)
+
+    def add_assignment(self, assignment):
+        self.add('assignments', assignment)
+
+    def close(self):
+        meta = dict(version=FORMAT_VERSION, byteorder=sys.byteorder,
+                    created=time.strftime('%Y-%m-%dT%H:%M:%SZ',
+                                          time.gmtime()),
+                    tables={})
+        for table, columns in self.tables.items():
+            for column in columns:
+                column.close()
+            meta['tables'][table] = dict(
+                rows=self.rows[table],
+                columns=[(column.name, column.kind) for column in columns])
+        f = open(os.path.join(self.directory, 'meta.json'), 'w')
+        json.dump(meta, f, indent=1)
+        f.close()
+        if os.path.exists(self.path):
+            shutil.rmtree(self.path)
+        os.rename(self.directory, self.path)
+
+    def abort(self):
+        for columns in self.tables.values():
+            for column in columns:
+                column.close()
+        shutil.rmtree(self.directory)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+def export(path, answers=False, client=None, window=None, **kwargs):
+    """Crawl every HIT (SearchHITs) and its assignments into a snapshot.
+
+    HITs are taken EXPORT_BATCH at a time and their assignments fetched
+    `window` HITs ahead, as in turkmirror. `answers` also keeps each assignment's
+    Answer XML, which is usually most of the size. Extra keyword
+    arguments go to pyturk.iter_search_hits. Returns the row counts.
+    """
+    client = client or pyturk.current_client()
+    hit_fields = [name for name, kind in HIT_COLUMNS]
+    assignment_fields = [name for name, kind in ASSIGNMENT_COLUMNS]
+    if answers:
+        assignment_fields.append('Answer')
+
+    def fetch(hit):
+        return list(pyturk.iter_assignments_for_hit(
+            hit['HITId'], fields=assignment_fields))
+
+    with SnapshotWriter(path, answers) as writer:
+        with client.activate():
+            hits = pyturk.iter_search_hits(fields=hit_fields, **kwargs)
+            while True:
+                batch = list(itertools.islice(hits, EXPORT_BATCH))
+                if not batch:
+                    break
+                results = pyturk.prefetch(fetch, batch, window)
+                try:
+                    for hit, assignments in zip(batch, results):
+                        writer.add_hit(hit)
+                        for assignment in assignments:
+                            writer.add_assignment(assignment)
+                finally:
+                    results.close()
+        return dict(writer.rows)
+
+
+def _map(path):
+    f = open(path, 'rb')
+    try:
+        if not os.fstat(f.fileno()).st_size:
+            return ''
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    finally:
+        f.close()
+
+
+def _require_numpy():
+    if numpy is None:
+        raise ImportError('column arrays need numpy')
+
+
+class _Blob(object):
+    # strings read back from a _BlobWriter's files
+
+    def __init__(self, prefix):
+        self.data = _map(prefix + '.data')
+        self.offsets = _map(prefix + '.offsets')
+        self.size = struct.calcsize('q')
+
+    def __len__(self):
+        return max(len(self.offsets) // self.size - 1, 0)
+
+    def __getitem__(self, index):
+        start, end = struct.unpack_from('2q', self.offsets, index * self.size)
+        return self.data[start:end]
+
+    def close(self):
+        self.data = self.offsets = None
+
+
+class Column(object):
+    """One column of a snapshot table, read straight from its mapped file.
+
+    column[i] gives one value (None when missing, except for strings);
+    array() gives the whole column as a numpy array sharing the mapped
+    memory, codes into dictionary for repeated strings.
+
+    close() only lets go of the maps: each one is unmapped once nothing,
+    arrays included, refers to it any more, so an array stays valid
+    after its snapshot is closed.
+    """
+
+    def __init__(self, prefix, name, kind, rows):
+        self.name = name
+        self.kind = kind
+        self.rows = rows
+        self.format, self.dtype, self.missing = KINDS[kind]
+        self.dictionary = None
+        self._codes = None
+        self.closed = False
+        if kind == 's':
+            self.blob = _Blob(prefix)
+            return
+        self.data = _map(prefix + '.data')
+        self.size = struct.calcsize(self.format)
+        if kind == 'c':
+            self.dictionary = _Blob(prefix + '.dictionary')
+
+    def __len__(self):
+        return self.rows
+
+    def _check(self):
+        if self.closed:
+            raise ValueError('column %s is closed' % self.name)
+
+    def __getitem__(self, index):
+        self._check()
+        if index < 0:
+            index += self.rows
+        if not 0 <= index < self.rows:
+            raise IndexError(index)
+        if self.kind == 's':
+            return self.blob[index]
+        value, = struct.unpack_from(self.format, self.data, index * self.size)
+        if value != value or value == self.missing:
+            return None
+        if self.kind == 'c':
+            return self.dictionary[value]
+        return value
+
+    def __iter__(self):
+        for index in xrange(self.rows):
+            yield self[index]
+
+    def array(self):
+        """The raw column as a numpy array, without copying.
+
+        Strings give their rows + 1 end offsets into the blob.
+        """
+        _require_numpy()
+        self._check()
+        if self.kind == 's':
+            return numpy.frombuffer(self.blob.offsets or '', '=' + self.dtype)
+        return numpy.frombuffer(self.data or '', '=' + self.dtype)
+
+    def code(self, value):
+        """The dictionary code of a repeated string, -1 if never seen."""
+        self._check()
+        if self._codes is None:
+            self._codes = dict((self.dictionary[i], i)
+                               for i in xrange(len(self.dictionary)))
+        return self._codes.get(_bytes(value), -1)
+
+    def mask(self, value):
+        """numpy bool array of the rows equal to value (or to any value
+        in a list, tuple or set of them).
+        """
+        _require_numpy()
+        if isinstance(value, (list, tuple, set, frozenset)):
+            values = list(value)
+        else:
+            values = [value]
+        if self.kind == 's':
+            values = set(_bytes(v) for v in values)
+            return numpy.fromiter((v in values for v in self), bool,
+                                  self.rows)
+        if self.kind == 'c':
+            # unseen values are -1, the same as missing rows
+            values = [c for c in map(self.code, values) if c >= 0]
+            if not values:
+                return numpy.zeros(self.rows, bool)
+        return numpy.in1d(self.array(), values)
+
+    def close(self):
+        # never mmap.close(): numpy arrays may still point into the map
+        self.closed = True
+        if self.kind == 's':
+            self.blob.close()
+            return
+        self.data = None
+        if self.dictionary is not None:
+            self.dictionary.close()
+        self._codes = None
+
+
+class Table(object):
+
+    def __init__(self, directory, name, meta):
+        self.name = name
+        self.rows = meta['rows']
+        self.columns = {}
+        self.names = []
+        for column, kind in meta['columns']:
+            column = str(column)
+            self.names.append(column)
+            self.columns[column] = Column(
+                os.path.join(directory, '%s.%s' % (name, column)), column,
+                str(kind), self.rows)
+
+    def __len__(self):
+        return self.rows
+
+    def __getitem__(self, name):
+        return self.columns[name]
+
+    def row(self, index):
+        return dict((name, self.columns[name][index]) for name in self.names)
+
+    def where(self, **conditions):
+        """numpy array of the indexes of the rows matching every
+        condition, e.g. where(AssignmentStatus='Submitted', WorkerId=w).
+        """
+        _require_numpy()
+        mask = numpy.ones(self.rows, bool)
+        for name, value in conditions.items():
+            mask &= self.columns[name].mask(value)
+        return numpy.flatnonzero(mask)
+
+    def select(self, indexes=None, fields=None):
+        """Yield rows (all, or those at indexes) as dicts of fields."""
+        if indexes is None:
+            indexes = xrange(self.rows)
+        columns = [self.columns[name] for name in fields or self.names]
+        for index in indexes:
+            yield dict((column.name, column[index]) for column in columns)
+
+    def close(self):
+        for column in self.columns.values():
+            column.close()
+
+
+class Snapshot(object):
+    """A snapshot directory written by SnapshotWriter, opened read only.
+
+    Tables are attributes (snapshot.hits, snapshot.assignments).
+    """
+
+    def __init__(self, path):
+        f = open(os.path.join(path, 'meta.json'))
+        try:
+            self.meta = json.load(f)
+        finally:
+            f.close()
+        if self.meta['version'] != FORMAT_VERSION:
+            raise ValueError('unsupported snapshot version %r' %
+                             self.meta['version'])
+        if self.meta['byteorder'] != sys.byteorder:
+            raise ValueError('snapshot was written %s endian' %
+                             self.meta['byteorder'])
+        self.path = path
+        self.created = self.meta['created']
+        self.tables = {}
+        for name, meta in self.meta['tables'].items():
+            self.tables[name] = Table(path, str(name), meta)
+        self.hits = self.tables['hits']
+        self.assignments = self.tables['assignments']
+
+    def close(self):
+        for table in self.tables.values():
+            table.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_snapshot(path):
+    return Snapshot(path)
+
+
+if __name__ == '__main__':
+    import optparse
+    parser = optparse.OptionParser(usage='%prog [options] DIRECTORY')
+    parser.add_option('--answers', action='store_true',
+                      help="keep every assignment's Answer XML")
+    parser.add_option('--sandbox', action='store_true')
+    options, args = parser.parse_args()
+    if len(args) != 1:
+        parser.error('a snapshot directory is required')
+    pyturk.SANDBOXP = options.sandbox
+    print export(args[0], options.answers)